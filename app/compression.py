@@ -0,0 +1,110 @@
+"""Per-chunk compression for file transfers.
+
+A transfer negotiates one codec by name. Every DATA payload of a
+compressed transfer then starts with a flag byte: RAW when the chunk went
+out as-is (it would not shrink), PACKED when it was compressed. Chunks are
+independent, so offsets, ranges and resume work on the raw bytes exactly
+as they do without compression.
+"""
+import asyncio, zlib
+
+RAW = 0
+PACKED = 1
+SAMPLE_SIZE = 2048      # bytes compressed to judge a chunk
+SAMPLE_RATIO = 0.9      # skip chunks whose sample does not shrink below this
+BATCH = 8               # chunks compressed per executor call
+MAX_CHUNK = 16*1024*1024  # largest chunk a payload may inflate to
+
+class Codec:
+    """Interface for a chunk codec; register implementations in CODECS.
+    decompress() raises ValueError on corrupt input."""
+    name = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data, max_size=MAX_CHUNK):
+        raise NotImplementedError
+
+class ZlibCodec(Codec):
+    name = "zlib"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, max_size=MAX_CHUNK):
+        d = zlib.decompressobj()
+        try:
+            out = d.decompress(data, max_size)
+        except zlib.error as e:
+            raise ValueError(f"corrupt chunk: {e}")
+        if d.unconsumed_tail or not d.eof:
+            raise ValueError("corrupt or oversized chunk")
+        return out
+
+CODECS = {ZlibCodec.name: ZlibCodec}
+
+def register_codec(cls):
+    CODECS[cls.name] = cls
+    return cls
+
+def get_codec(name):
+    """Codec instance for a negotiated name; None means no compression"""
+    if not name or name == "none":
+        return None
+    if name not in CODECS:
+        raise ValueError(f"unsupported codec: {name}")
+    return CODECS[name]()
+
+def choose_codec(offered):
+    """First codec in the peer's preference list that we support"""
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
+
+def compressible(data):
+    """Cheap check on a sample: already-compressed data is not worth a full pass"""
+    sample = data[:SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) < len(sample) * SAMPLE_RATIO
+
+def encode_chunk(codec, data):
+    if compressible(data):
+        packed = codec.compress(data)
+        if len(packed) < len(data):
+            return bytes([PACKED]) + packed
+    return bytes([RAW]) + data
+
+def decode_chunk(codec, payload):
+    if not payload:
+        raise ValueError("empty chunk")
+    if payload[0] == PACKED:
+        return codec.decompress(payload[1:])
+    if payload[0] == RAW:
+        return payload[1:]
+    raise ValueError(f"bad chunk flag {payload[0]}")
+
+async def encode_chunks(codec, chunks, executor=None):
+    """Yield (raw_length, payload) for each chunk, compressing BATCH chunks
+    per executor job with the next batch in progress while one is consumed"""
+    loop = asyncio.get_running_loop()
+    it = iter(chunks)
+
+    def next_batch():
+        batch = [chunk for _, chunk in zip(range(BATCH), it)]
+        return [(len(chunk), encode_chunk(codec, chunk)) for chunk in batch]
+
+    pending = loop.run_in_executor(executor, next_batch)
+    try:
+        while True:
+            batch = await pending
+            if not batch:
+                return
+            pending = loop.run_in_executor(executor, next_batch)
+            for item in batch:
+                yield item
+    finally:
+        pending.cancel()  # consumer stopped early, drop the read-ahead batch
@@ -0,0 +1,210 @@
+"""rsync-style delta transfer.
+
+The side holding the old copy (the basis) describes it with a manifest:
+a weak rolling checksum and a strong hash per block. The side holding the
+new file slides a block-sized window over it, looks every offset's weak
+checksum up in the manifest and confirms hits with the strong hash. The
+result is a stream of ops, sent as DATA payloads:
+
+    C <first block> <count>   copy blocks of the basis
+    D <bytes>                 literal bytes
+
+The receiver applies them in order with a Patcher to rebuild the new file.
+"""
+import hashlib, struct, zlib
+import numpy as np
+from app.fileops import CHUNK_SIZE
+
+BLOCK_SIZE = CHUNK_SIZE
+SEGMENT = 4*1024*1024   # window positions hashed per encoder step
+FILTER_BITS = 20        # size of the table that pre-screens weak checksums
+
+MANIFEST_HDR = struct.Struct("!IQ")   # block size, basis size
+SIGNATURE = struct.Struct("!I16s")    # weak checksum, strong hash
+OP_COPY = ord("C")
+OP_DATA = ord("D")
+COPY = struct.Struct("!BII")          # op, first block, block count
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+def weak_hashes(data, block_size):
+    """rsync's weak checksum of every block_size window of data, as a uint32 array.
+
+    a = sum(x) and b = sum((L - i) * x[i]) come from prefix sums; the
+    uint32 arithmetic wraps, which is harmless as only the low 16 bits of
+    each are kept.
+    """
+    x = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+    n = len(x) - block_size + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint32)
+    s = np.zeros(len(x) + 1, dtype=np.uint32)
+    t = np.zeros(len(x) + 1, dtype=np.uint32)
+    np.cumsum(x, out=s[1:])
+    x *= np.arange(len(x), dtype=np.uint32)
+    np.cumsum(x, out=t[1:])
+    a = s[block_size:] - s[:n]
+    b = np.arange(block_size, block_size + n, dtype=np.uint32) * a - (t[block_size:] - t[:n])
+    return (a & 0xffff) | (b << 16)
+
+def make_manifest(basis, block_size=BLOCK_SIZE):
+    """Manifest payload describing basis (a bytes-like, e.g. an mmap view)"""
+    out = bytearray(MANIFEST_HDR.pack(block_size, len(basis)))
+    for seg in range(0, len(basis), SEGMENT):
+        chunk = basis[seg:seg + SEGMENT]
+        full = len(chunk) // block_size
+        if full:
+            x = np.frombuffer(chunk, dtype=np.uint8, count=full*block_size)
+            x = x.reshape(full, block_size).astype(np.uint32)
+            a = x.sum(axis=1, dtype=np.uint32)
+            b = (x * np.arange(block_size, 0, -1, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+            weak = (a & 0xffff) | (b << 16)
+        for i in range(0, len(chunk), block_size):
+            block = chunk[i:i + block_size]
+            w = int(weak[i // block_size]) if len(block) == block_size else 0
+            out += SIGNATURE.pack(w, strong_hash(block))
+    return bytes(out)
+
+def parse_manifest(payload):
+    """(block_size, basis_size, [(weak, strong)]) from a manifest payload"""
+    if len(payload) < MANIFEST_HDR.size:
+        raise ValueError("short manifest")
+    block_size, size = MANIFEST_HDR.unpack_from(payload)
+    count = (len(payload) - MANIFEST_HDR.size) // SIGNATURE.size
+    if block_size <= 0 or count != -(-size // block_size):
+        raise ValueError("bad manifest")
+    sigs = [SIGNATURE.unpack_from(payload, MANIFEST_HDR.size + i*SIGNATURE.size)
+            for i in range(count)]
+    return block_size, size, sigs
+
+class DeltaEncoder:
+    """Turns the new file into ops against a manifest, one segment per step().
+
+    step() is plain CPU work (numpy, hashing) and may run on an executor;
+    it returns a list of op payloads, or None once the file is done.
+    """
+    def __init__(self, data, manifest):
+        self.data = data
+        self.block_size, self.basis_size, sigs = parse_manifest(manifest)
+        self.strong = [strong for _, strong in sigs]
+        self.table = {}   # weak -> block indices, full blocks only
+        for i, (weak, _) in enumerate(sigs):
+            if (i + 1) * self.block_size <= self.basis_size:
+                self.table.setdefault(weak, []).append(i)
+        self.keys = np.sort(np.fromiter(self.table, dtype=np.uint32, count=len(self.table)))
+        self.filter = np.zeros(1 << FILTER_BITS, dtype=bool)
+        self.filter[self.keys & ((1 << FILTER_BITS) - 1)] = True
+        self.pos = 0          # bytes up to here are covered by emitted ops
+        self.scanned = 0      # window positions hashed so far
+        self.run = None       # pending [first, count] copy run
+        self.literal_bytes = 0
+        self.copied_bytes = 0
+        self.finished = False
+
+    def step(self):
+        if self.finished:
+            return None
+        ops = []
+        L, n = self.block_size, len(self.data)
+        last = n - L + 1      # number of window positions
+        if self.scanned < last and self.table:
+            start = max(self.scanned, self.pos)
+            end = min(last, start + SEGMENT)
+            if start < end:
+                weak = weak_hashes(self.data[start:end + L - 1], L)
+                for c in self.candidates(weak):
+                    c = int(c) + start
+                    if c < self.pos:
+                        continue
+                    digest = strong_hash(self.data[c:c + L])
+                    for idx in self.table[int(weak[c - start])]:
+                        if digest == self.strong[idx]:
+                            self.literal(ops, c)
+                            self.copy(ops, idx, L)
+                            break
+            self.scanned = end
+            # hold back the unmatched tail; a later window may still match there
+            self.literal(ops, min(end, n))
+            return ops
+        if n - self.pos > SEGMENT + L:
+            # nothing left to match (e.g. the receiver has no copy): the rest
+            # is literal, still sent one segment per step
+            self.literal(ops, self.pos + SEGMENT)
+            return ops
+        self.finish(ops)
+        return ops
+
+    def candidates(self, weak):
+        """Window positions whose weak checksum is in the manifest"""
+        hits = np.flatnonzero(self.filter[weak & ((1 << FILTER_BITS) - 1)])
+        idx = np.searchsorted(self.keys, weak[hits])
+        idx[idx == len(self.keys)] = 0
+        return hits[self.keys[idx] == weak[hits]]
+
+    def finish(self, ops):
+        # a short last basis block can only match the very end of the file
+        L, n = self.block_size, len(self.data)
+        tail = self.basis_size % L
+        if tail and n - tail >= self.pos and self.strong:
+            if strong_hash(self.data[n - tail:n]) == self.strong[-1]:
+                self.literal(ops, n - tail)
+                self.copy(ops, len(self.strong) - 1, tail)
+        self.literal(ops, n)
+        self.flush_run(ops)
+        self.finished = True
+
+    def literal(self, ops, upto):
+        if upto <= self.pos:
+            return
+        self.flush_run(ops)
+        for off in range(self.pos, upto, CHUNK_SIZE):
+            chunk = self.data[off:min(off + CHUNK_SIZE, upto)]
+            ops.append(bytes([OP_DATA]) + chunk)
+        self.literal_bytes += upto - self.pos
+        self.pos = upto
+
+    def copy(self, ops, idx, length):
+        if self.run and self.run[0] + self.run[1] == idx:
+            self.run[1] += 1
+        else:
+            self.flush_run(ops)
+            self.run = [idx, 1]
+        self.pos += length
+        self.copied_bytes += length
+
+    def flush_run(self, ops):
+        if self.run:
+            ops.append(COPY.pack(OP_COPY, *self.run))
+            self.run = None
+
+class Patcher:
+    """Applies ops to a basis, handing each piece of the new file to
+    write(offset, data) in order and keeping a running crc32"""
+    def __init__(self, basis, block_size, write):
+        self.basis = basis
+        self.block_size = block_size
+        self.write = write
+        self.pos = 0
+        self.crc = 0
+
+    def feed(self, op):
+        if not op:
+            raise ValueError("empty delta op")
+        if op[0] == OP_COPY:
+            if len(op) != COPY.size:
+                raise ValueError("bad copy op")
+            _, first, count = COPY.unpack(op)
+            start = first * self.block_size
+            end = min(start + count * self.block_size, len(self.basis))
+            if count == 0 or start >= end:
+                raise ValueError("copy outside the basis")
+            data = self.basis[start:end]
+        elif op[0] == OP_DATA:
+            data = memoryview(op)[1:]
+        else:
+            raise ValueError(f"unknown delta op {op[0]}")
+        result = self.write(self.pos, data)
+        self.pos += len(data)
+        self.crc = zlib.crc32(data, self.crc)
+        return result
@@ -0,0 +1,350 @@
+"""In-memory index of the served directory tree, for LIST.
+
+Every file under the root (subdirectories included, dotfiles such as
+in-progress uploads excluded) has an Entry: its name relative to the root
+with "/" separators, size, mtime and, once asked for, a CRC-32 of its
+contents (the same digest GET's END carries). Names are also kept sorted
+(in blocks, see SortedNames), so a page of a prefix-filtered listing is a
+bisect and a slice, and each directory's files are kept apart so a rescan
+only compares that directory.
+
+The index stays current three ways. The server reports its own commits
+with update(), which costs one stat, so they show up at once. Files added,
+removed or renamed behind its back change their directory's mtime: at most
+every REVALIDATE_INTERVAL seconds refresh() stats each indexed directory
+and rescans only those whose mtime moved, on an executor. A file appended
+to or rewritten in place leaves its directory alone, so its own stat is
+checked: revalidate() re-stats every page before it is served, and each
+refresh() also re-stats the next RESTAT_BATCH files in name order, so the
+whole index is swept over time and changes_since() sees such edits too,
+if only eventually.
+
+Every change bumps a version number and goes into a bounded change log.
+A token names an index (epoch) and a version. changes_since(token) returns
+what changed after it, or asks for a full listing (reset) when the token
+is from another index or older than the log.
+"""
+import asyncio, bisect, itertools, os, time, zlib
+
+REVALIDATE_INTERVAL = 1.0
+MAX_CHANGES = 100_000       # change log entries kept for changes_since(), at least
+DIGEST_CHUNK = 1024*1024
+RESTAT_BATCH = 2000         # files re-stated per refresh()
+
+class Entry:
+    __slots__ = ("name", "size", "mtime_ns", "digest", "version")
+
+    def __init__(self, name, size, mtime_ns, version):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = None      # CRC-32, computed on demand
+        self.version = version
+
+def file_digest(fpath):
+    crc = 0
+    with open(fpath, "rb") as f:
+        while chunk := f.read(DIGEST_CHUNK):
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+def scan_dirs(root, dirs):
+    """Executor side of a refresh. dirs maps each relative dir to scan to a
+    copy of what the index holds for its files, {name: (size, mtime_ns)}.
+    Returns {dir: (mtime_ns, changed, removed, subdirs)}, or None for a dir
+    that is gone: changed maps new or modified files to (size, mtime_ns),
+    removed lists the indexed files no longer there."""
+    out = {}
+    for rel, known in dirs.items():
+        path = os.path.join(root, rel)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            changed, seen, subdirs = {}, set(), []
+            with os.scandir(path) as it:
+                for de in it:
+                    if de.name.startswith("."):
+                        continue
+                    name = f"{rel}/{de.name}" if rel else de.name
+                    try:
+                        if de.is_dir(follow_symlinks=False):
+                            subdirs.append(name)
+                        elif de.is_file(follow_symlinks=False):
+                            st = de.stat(follow_symlinks=False)
+                            seen.add(name)
+                            if known.get(name) != (st.st_size, st.st_mtime_ns):
+                                changed[name] = (st.st_size, st.st_mtime_ns)
+                    except FileNotFoundError:
+                        pass  # removed while we looked
+        except (FileNotFoundError, NotADirectoryError):
+            out[rel] = None
+            continue
+        out[rel] = (mtime, changed, [name for name in known if name not in seen], subdirs)
+    return out
+
+def stat_files(root, names):
+    """Executor side of revalidate(): (size, mtime_ns) per name, None if gone"""
+    out = {}
+    for name in names:
+        try:
+            st = os.stat(os.path.join(root, name))
+            out[name] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            out[name] = None
+    return out
+
+def stale_dirs(root, dirs):
+    """Executor side: the dirs whose mtime differs from the recorded one"""
+    stale = []
+    for rel, mtime in dirs.items():
+        try:
+            if os.stat(os.path.join(root, rel)).st_mtime_ns != mtime:
+                stale.append(rel)
+        except OSError:
+            stale.append(rel)
+    return stale
+
+class SortedNames:
+    """Strings in sorted order, kept in blocks of up to 2*BLOCK so that an
+    insert or removal shifts one block, not the whole list"""
+    BLOCK = 1000
+
+    def __init__(self):
+        self.blocks = []    # sorted, non-empty lists
+        self.maxes = []     # last name of each block
+
+    def add(self, name):
+        if not self.blocks:
+            self.blocks.append([name])
+            self.maxes.append(name)
+            return
+        i = min(bisect.bisect_left(self.maxes, name), len(self.blocks) - 1)
+        block = self.blocks[i]
+        bisect.insort(block, name)
+        self.maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK:
+            self.blocks[i:i+1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            self.maxes[i:i+1] = [block[self.BLOCK - 1], block[-1]]
+
+    def remove(self, name):
+        i = bisect.bisect_left(self.maxes, name)
+        block = self.blocks[i]
+        del block[bisect.bisect_left(block, name)]
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+
+    def irange(self, start, inclusive=True):
+        """The names from start on (or past it, if not inclusive), in order"""
+        i = bisect.bisect_left(self.maxes, start)
+        if i == len(self.blocks):
+            return
+        block = self.blocks[i]
+        j = (bisect.bisect_left if inclusive else bisect.bisect_right)(block, start)
+        yield from block[j:]
+        for block in self.blocks[i+1:]:
+            yield from block
+
+class DirIndex:
+    def __init__(self, root, revalidate_interval=REVALIDATE_INTERVAL, max_changes=MAX_CHANGES):
+        self.root = os.path.realpath(root)
+        self.revalidate_interval = revalidate_interval
+        self.max_changes = max_changes
+        self.entries = {}         # name -> Entry
+        self.names = SortedNames()
+        self.dirs = {}            # relative dir ("" is the root) -> mtime_ns at its last scan
+        self.files = {}           # relative dir -> {name: (size, mtime_ns)} of its direct children
+        self.subdirs = {}         # relative dir -> set of its subdirectories
+        self.version = 0
+        # names changed, one per version, oldest first: log[i] is version
+        # log_first + i, so a token's place in it is a subtraction
+        self.log = []
+        self.log_first = 1
+        self.epoch = f"{os.getpid():x}{time.time_ns() & 0xffffffff:08x}"
+        self.checked = None       # monotonic time of the last refresh
+        self.swept = ""           # name the next refresh's re-stat sweep continues after
+        self.refreshing = None    # the refresh in progress, shared by concurrent callers
+
+    @property
+    def token(self):
+        return f"{self.epoch}.{self.version}"
+
+    # ------------------------
+    async def refresh(self, force=False):
+        """Rescan the directories changed since the last look, if that was
+        more than revalidate_interval ago (or force)"""
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < self.revalidate_interval:
+            return
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self._refresh())
+            self.refreshing.add_done_callback(lambda _: setattr(self, "refreshing", None))
+        await asyncio.shield(self.refreshing)
+
+    async def _refresh(self):
+        """Directory listing and the comparison with the index both run on
+        the executor; the loop only applies the differences"""
+        loop = asyncio.get_running_loop()
+        if self.checked is None:
+            todo = [""]
+        else:
+            todo = await loop.run_in_executor(None, stale_dirs, self.root, dict(self.dirs))
+        self.checked = time.monotonic()
+        while todo:
+            start = self.version
+            known = {rel: dict(self.files.get(rel, ())) for rel in todo}
+            scanned = await loop.run_in_executor(None, scan_dirs, self.root, known)
+            todo = []
+            for rel, result in scanned.items():
+                if result is None:
+                    self.drop_dir(rel)
+                    continue
+                mtime, changed, removed, subdirs = result
+                self.dirs[rel] = mtime
+                self.apply_dir(changed, removed, start)
+                # new subdirectories get scanned next round; vanished ones go now
+                subdirs = set(subdirs)
+                for d in self.subdirs.get(rel, set()) - subdirs:
+                    self.drop_dir(d)
+                self.subdirs[rel] = subdirs
+                todo += [d for d in subdirs if d not in self.dirs]
+        await self.sweep()
+
+    async def sweep(self):
+        """Re-stat the next RESTAT_BATCH files, wrapping around at the end"""
+        names = list(itertools.islice(self.names.irange(self.swept, inclusive=False), RESTAT_BATCH))
+        self.swept = names[-1] if len(names) == RESTAT_BATCH else ""
+        await self.revalidate([self.entries[name] for name in names])
+
+    async def revalidate(self, entries):
+        """Re-stat entries on an executor and index what changed in place;
+        returns the entries as they are now (those still there)"""
+        if not entries:
+            return entries
+        start = self.version
+        stats = await asyncio.get_running_loop().run_in_executor(
+            None, stat_files, self.root, [entry.name for entry in entries])
+        for name, st in stats.items():
+            entry = self.entries.get(name)
+            if entry is None or entry.version > start:
+                continue  # changed meanwhile, by update() or another scan
+            if st is None:
+                self.remove(name)
+            elif st != (entry.size, entry.mtime_ns):
+                self.put(name, *st)  # a new Entry: new version, digest to recompute
+        return [self.entries[e.name] for e in entries if e.name in self.entries]
+
+    def apply_dir(self, changed, removed, start):
+        """Apply a scan's differences. Entries update() touched after
+        version start are newer than the scan: kept."""
+        for name in removed:
+            entry = self.entries.get(name)
+            if entry is not None and entry.version <= start:
+                self.remove(name)
+        for name, (size, mtime) in changed.items():
+            entry = self.entries.get(name)
+            if entry is None or (entry.version <= start and
+                                 (entry.size != size or entry.mtime_ns != mtime)):
+                self.put(name, size, mtime)
+
+    def drop_dir(self, rel):
+        """Forget a directory that is gone, with everything below it"""
+        for d in self.subdirs.pop(rel, ()):
+            self.drop_dir(d)
+        if rel:
+            self.subdirs.get(os.path.dirname(rel), set()).discard(rel)
+        self.dirs.pop(rel, None)
+        for name in list(self.files.get(rel, ())):
+            self.remove(name)
+        self.files.pop(rel, None)
+
+    # ------------------------
+    def update(self, fpath):
+        """The server changed fpath itself (e.g. committed an upload): index
+        it now. Its directory's mtime moved too, so the next refresh() still
+        rescans that directory, which catches anything else that changed in it."""
+        name = os.path.relpath(os.path.realpath(fpath), self.root).replace(os.sep, "/")
+        if name.startswith("../") or any(p.startswith(".") for p in name.split("/")):
+            return
+        try:
+            st = os.stat(fpath)
+        except FileNotFoundError:
+            self.remove(name)
+            return
+        entry = self.entries.get(name)
+        if entry is None or entry.size != st.st_size or entry.mtime_ns != st.st_mtime_ns:
+            self.put(name, st.st_size, st.st_mtime_ns)
+
+    def put(self, name, size, mtime_ns):
+        if name not in self.entries:
+            self.names.add(name)
+        self.version += 1
+        self.entries[name] = Entry(name, size, mtime_ns, self.version)
+        self.files.setdefault(os.path.dirname(name), {})[name] = (size, mtime_ns)
+        self.record(name)
+
+    def remove(self, name):
+        if self.entries.pop(name, None) is None:
+            return
+        self.names.remove(name)
+        self.files.get(os.path.dirname(name), {}).pop(name, None)
+        self.version += 1
+        self.record(name)
+
+    def record(self, name):
+        self.log.append(name)
+        if len(self.log) >= 2 * self.max_changes:
+            # trim in bulk, amortized O(1) per change
+            drop = len(self.log) - self.max_changes
+            del self.log[:drop]
+            self.log_first += drop
+
+    # ------------------------
+    def page(self, prefix="", after=None, limit=1000):
+        """Up to limit entries whose names start with prefix, in name order,
+        after the name `after`; returns (entries, name to continue after or None)"""
+        if after is not None and after >= prefix:
+            names = self.names.irange(after, inclusive=False)
+        else:
+            names = self.names.irange(prefix)
+        out = []
+        for name in names:
+            if not name.startswith(prefix):
+                break
+            if len(out) == limit:
+                return out, out[-1].name
+            out.append(self.entries[name])
+        return out, None
+
+    def changes_since(self, token, limit=1000):
+        """(changes, token, more, reset): changes holds (name, Entry or None
+        if deleted) for up to limit names changed after token, in change
+        order. reset means the token is unusable: list everything instead."""
+        epoch, _, version = token.partition(".")
+        if epoch != self.epoch or not version.isdigit():
+            return [], self.token, False, True
+        version = int(version)
+        if version > self.version or version < self.log_first - 1:
+            return [], self.token, False, True
+        changes, seen, last = [], set(), version
+        for i in range(version + 1 - self.log_first, len(self.log)):
+            name = self.log[i]
+            if name not in seen:
+                if len(changes) == limit:
+                    return changes, f"{self.epoch}.{last}", True, False
+                seen.add(name)
+                changes.append((name, self.entries.get(name)))
+            last = i + self.log_first
+        return changes, self.token, False, False
+
+    async def fill_digests(self, entries):
+        """Compute the missing digests of entries, on an executor"""
+        loop = asyncio.get_running_loop()
+        for entry in entries:
+            if entry.digest is None:
+                fpath = os.path.join(self.root, entry.name)
+                try:
+                    entry.digest = await loop.run_in_executor(None, file_digest, fpath)
+                except OSError:
+                    pass  # gone meanwhile; the next refresh drops it
@@ -0,0 +1,129 @@
+"""Hot-file cache for GET.
+
+Files are mapped read-only with mmap and served as memoryview slices, so
+repeated downloads of a popular file neither re-read nor copy it. Range
+digests are computed on an executor and memoized per entry. Entries are keyed on the
+file's (path, mtime, size): a file replaced by an upload gets a new entry,
+and the old mapping stays valid for requests still streaming it.
+"""
+import asyncio, mmap, os, zlib
+from collections import OrderedDict
+from app.fileops import CHUNK_SIZE
+
+CACHE_BYTES = 256*1024*1024
+
+class CachedFile:
+    """A read-only mapping of one version of a file"""
+    def __init__(self, fpath, key):
+        self.fpath = fpath
+        self.key = key          # (mtime_ns, size)
+        self.size = key[1]
+        self.mm = None
+        if self.size:
+            with open(fpath, "rb") as f:
+                self.mm = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mm)
+        else:
+            self.view = memoryview(b"")
+        self.digests = {}       # (offset, length) -> future of its crc32
+        self.users = 0
+        self.evicted = False
+
+    def chunks(self, offset=0, length=None, chunk_size=CHUNK_SIZE):
+        """Yield memoryview slices of the mapping from offset for length bytes"""
+        end = self.size if length is None else min(self.size, offset + length)
+        for pos in range(offset, end, chunk_size):
+            yield self.view[pos:min(pos + chunk_size, end)]
+
+    def digest(self, offset=0, length=None):
+        """Awaitable CRC of a byte range (the whole file by default).
+
+        Computed once per range, on an executor: crc32 drops the GIL, so a
+        large file is summed while the loop keeps serving. Call it when the
+        transfer starts and await it at the end to overlap the two.
+        """
+        if length is None:
+            length = self.size - offset
+        key = (offset, length)
+        fut = self.digests.get(key)
+        if fut is None:
+            view = self.view[offset:offset + length]
+            fut = self.digests[key] = asyncio.get_running_loop().run_in_executor(
+                None, zlib.crc32, view)
+            fut.add_done_callback(lambda f: self.digest_done(key, f))
+        return asyncio.shield(fut)  # a cancelled waiter must not cancel the others
+
+    def digest_done(self, key, fut):
+        if fut.cancelled() or fut.exception():
+            del self.digests[key]  # not memoized, the next caller tries again
+
+    def close(self):
+        self.view.release()
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass  # a slice is still alive somewhere; the map goes when it does
+            self.mm = None
+
+class FileCache:
+    """LRU of CachedFile entries under a byte budget.
+
+    open() returns a pinned entry; pass it back to release() when the
+    request is done. Pinned entries are never unmapped, eviction only
+    drops them from the index and the last release() closes them.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES, metrics=None):
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.entries = OrderedDict()   # path -> CachedFile
+        self.bytes = 0
+
+    def open(self, fpath):
+        st = os.stat(fpath)
+        key = (st.st_mtime_ns, st.st_size)
+        entry = self.entries.get(fpath)
+        if entry is not None and entry.key == key:
+            self.entries.move_to_end(fpath)
+            self.record(hit=True)
+        else:
+            if entry is not None:
+                self.evict(fpath)
+            entry = CachedFile(fpath, key)
+            self.record(hit=False)
+            if entry.size <= self.max_bytes:
+                self.entries[fpath] = entry
+                self.bytes += entry.size
+                self.trim()
+            else:
+                entry.evicted = True  # too big to keep, mapped for this request only
+        entry.users += 1
+        return entry
+
+    def release(self, entry):
+        entry.users -= 1
+        if entry.evicted and entry.users == 0:
+            entry.close()
+
+    def invalidate(self, fpath):
+        if fpath in self.entries:
+            self.evict(fpath)
+
+    def evict(self, fpath):
+        entry = self.entries.pop(fpath)
+        self.bytes -= entry.size
+        entry.evicted = True
+        if entry.users == 0:
+            entry.close()
+
+    def trim(self):
+        while self.bytes > self.max_bytes and self.entries:
+            self.evict(next(iter(self.entries)))
+
+    def record(self, hit):
+        if self.metrics is not None:
+            self.metrics.record_cache(hit)
+
+    def clear(self):
+        for fpath in list(self.entries):
+            self.evict(fpath)
@@ -1,14 +1,19 @@
-import zlib, os
+import zlib, os, asyncio, tempfile, threading
 
 CHUNK_SIZE = 16*1024
+FSYNC_BYTES = 8*1024*1024  # fsync a streaming upload after this many bytes
 
-def iter_chunks(fpath):
-    """Yield (data, crc) for each chunk of the file"""
+def iter_chunks(fpath, offset=0, length=None):
+    """Yield (data, crc) for each chunk of the file, from offset for length bytes"""
     with open(fpath, "rb") as f:
-        while True:
-            data = f.read(CHUNK_SIZE)
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            data = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
             if not data:
                 break
+            if remaining is not None:
+                remaining -= len(data)
             yield data, zlib.crc32(data) & 0xffffffff
 
 def save_chunks(fpath, chunks):
@@ -17,3 +22,143 @@ def save_chunks(fpath, chunks):
     with open(fpath, "wb") as f:
         for data, _ in chunks:
             f.write(data)
+
+class RangeSet:
+    """Set of byte ranges, kept as sorted, merged [start, end) pairs"""
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for start, end in ranges:
+            self.add(start, end - start)
+
+    def add(self, offset, length):
+        start, end = offset, offset + length
+        if length <= 0:
+            return
+        merged = []
+        for s, e in self.ranges:
+            if e < start or s > end:
+                merged.append([s, e])
+            else:
+                start, end = min(s, start), max(e, end)
+        merged.append([start, end])
+        self.ranges = sorted(merged)
+
+    def covered(self):
+        return sum(e - s for s, e in self.ranges)
+
+    def missing(self, size):
+        """[start, end) gaps between 0 and size"""
+        gaps, pos = [], 0
+        for s, e in self.ranges:
+            if s > pos:
+                gaps.append([pos, min(s, size)])
+            pos = max(pos, e)
+        if pos < size:
+            gaps.append([pos, size])
+        return [g for g in gaps if g[0] < g[1]]
+
+def split_ranges(ranges, piece):
+    """Cut [start, end) ranges into (offset, length) pieces of at most piece bytes"""
+    return [(off, min(piece, end - off)) for start, end in ranges for off in range(start, end, piece)]
+
+if hasattr(os, "pwrite"):
+    def pwrite(fd, data, offset):
+        return os.pwrite(fd, data, offset)
+else:  # Windows: emulate positional writes with a seek under a lock
+    _seek_lock = threading.Lock()
+
+    def pwrite(fd, data, offset):
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.write(fd, data)
+
+def preallocate(fd, size):
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass  # e.g. unsupported by the filesystem
+    os.ftruncate(fd, size)
+
+class StreamingSink:
+    """Write-behind sink for an upload.
+
+    Chunks are written at their offsets into a temporary file next to
+    fpath as they arrive, on an executor so the event loop never waits
+    for the disk. commit() flushes and atomically renames the file into
+    place; abort() throws it away.
+    """
+    def __init__(self, fpath, size=None, executor=None, fsync_bytes=FSYNC_BYTES):
+        self.fpath = fpath
+        self.size = size
+        self.executor = executor
+        self.fsync_bytes = fsync_bytes
+        self.loop = asyncio.get_running_loop()
+        self.pending = set()     # in-flight write/fsync futures
+        self.unsynced = 0
+        self.written = 0
+        self.error = None
+        dirname = os.path.dirname(fpath) or "."
+        os.makedirs(dirname, exist_ok=True)
+        self.fd, self.tmp_path = tempfile.mkstemp(
+            dir=dirname, prefix="." + os.path.basename(fpath) + ".", suffix=".part")
+        if size:
+            self.submit(preallocate, self.fd, size)
+
+    def submit(self, fn, *args):
+        fut = self.loop.run_in_executor(self.executor, fn, *args)
+        self.pending.add(fut)
+        fut.add_done_callback(self._done)
+        return fut
+
+    def _done(self, fut):
+        self.pending.discard(fut)
+        if not fut.cancelled() and fut.exception() and self.error is None:
+            self.error = fut.exception()
+
+    def write(self, offset, data):
+        """Queue data for writing at offset; returns the write's future"""
+        if self.error:
+            raise self.error
+        fut = self.submit(pwrite, self.fd, data, offset)
+        self.written += len(data)
+        self.unsynced += len(data)
+        if self.unsynced >= self.fsync_bytes:
+            self.unsynced = 0
+            self.submit(os.fsync, self.fd)
+        return fut
+
+    async def wait(self):
+        while self.pending:
+            await asyncio.wait(list(self.pending))
+        if self.error:
+            raise self.error
+
+    async def commit(self):
+        await self.wait()
+        await self.loop.run_in_executor(self.executor, self._finish)
+
+    def _finish(self):
+        os.ftruncate(self.fd, self.size if self.size is not None else self.written)
+        os.fsync(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        os.replace(self.tmp_path, self.fpath)
+        if hasattr(os, "O_DIRECTORY"):
+            dfd = os.open(os.path.dirname(self.fpath) or ".", os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dfd)
+            finally:
+                os.close(dfd)
+
+    async def abort(self):
+        try:
+            await self.wait()
+        except OSError:
+            pass
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
@@ -1,66 +1,773 @@
-import asyncio, zlib, os, time
+import asyncio, itertools, zlib, os, time, json, mmap, multiprocessing.util
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote, unquote
 from transport.transport import GBNTransport
-from transport.lossy_shim import LossySocket
+from transport.netem import ImpairedLink
+from transport.udpio import create_endpoint
+from app.fileops import RangeSet, split_ranges, pwrite
+from app.delta import DeltaEncoder, Patcher, make_manifest, parse_manifest
+from app.compression import get_codec, encode_chunks, decode_chunk
+from app.protocol import (FrameDecoder, send_frame, RemoteError,
+                          MSG_CMD, MSG_OK, MSG_ERR, MSG_DATA, MSG_END)
 from tools.metrics import Metrics
 
 CHUNK_SIZE = 16*1024
+RANGE_SIZE = 4*1024*1024  # piece size for parallel transfers
+KEEPALIVE = 20.0          # NOOP after this many idle seconds, well inside the server's idle timeout
+KEEPALIVE_TIMEOUT = 10.0
+RECONNECT_ATTEMPTS = 3
+BATCH_IN_FLIGHT = 16      # MGET/MPUT requests outstanding at once
+
+# A file in a LIST reply; digest is its CRC-32, or None unless asked for
+RemoteFile = namedtuple("RemoteFile", "name size mtime_ns digest")
+
+class Request:
+    """One in-flight command: `response` resolves on the first OK, `done` when it is finished"""
+    def __init__(self, loop, on_data=None, final_ok=True):
+        self.response = loop.create_future()
+        self.done = loop.create_future()
+        self.on_data = on_data
+        self.final_ok = final_ok  # OK ends the request (LIST, PUT) or announces DATA (GET, SYNC)
+        self.codec = None         # named by a compressed GET's OK reply
+        self.wire_bytes = 0       # DATA payload bytes as received
+
+    def handle(self, mtype, payload):
+        if mtype == MSG_DATA:
+            if self.done.done():
+                return
+            self.wire_bytes += len(payload)
+            if self.codec:
+                try:
+                    payload = decode_chunk(self.codec, payload)
+                except ValueError as e:
+                    self.fail(RemoteError(f"bad chunk: {e}"))
+                    return
+            if self.on_data:
+                self.on_data(payload)
+        elif mtype == MSG_OK:
+            if self.final_ok or self.response.done():
+                self.finish(payload)  # a second OK ends the request too (SYNC PUT)
+            if not self.response.done():
+                if not self.final_ok:
+                    self.codec = get_codec(reply_option(payload, "codec"))
+                self.response.set_result(payload)
+        elif mtype == MSG_END:
+            self.finish(payload)
+        elif mtype == MSG_ERR:
+            self.fail(RemoteError(payload.decode(errors="replace")))
+
+    def finish(self, payload):
+        if not self.done.done():
+            self.done.set_result(payload)
+
+    def fail(self, exc):
+        for fut in (self.response, self.done):
+            if not fut.done():
+                fut.set_exception(exc)
+        self.done.exception()      # mark retrieved, callers may only await one of them
+        self.response.exception()
+
+def reply_option(payload, key):
+    """Value of a "key=value" word in an OK reply, or None"""
+    for word in payload.split()[1:]:
+        name, _, value = word.decode(errors="replace").partition("=")
+        if name == key:
+            return value
+    return None
+
+def parse_list_head(head):
+    """The "key=value" words of a LIST reply's first line, as a dict"""
+    return dict(word.partition("=")[::2] for word in head.split())
+
+def parse_list_line(line):
+    size, mtime, digest, name = line.split(" ", 3)
+    return RemoteFile(unquote(name), int(size), int(mtime), None if digest == "-" else int(digest, 16))
+
+def read_chunks(f, length=None):
+    """CHUNK_SIZE reads from f's current position, for length bytes or to EOF"""
+    while length is None or length > 0:
+        chunk = f.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+        if not chunk:
+            return
+        if length is not None:
+            length -= len(chunk)
+        yield chunk
 
 class FTPClient:
-    def __init__(self, server_addr=('127.0.0.1',9000), loss_rate=0.05):
+    """A session with the server: one connection, kept alive while idle and
+    re-established when lost. Every operation may be called at any time,
+    also concurrently; they share the connection, multiplexed by request id."""
+    def __init__(self, server_addr=('127.0.0.1',9000), loss_rate=0.05, codecs=("zlib",),
+                 sndbuf=None, rcvbuf=1024*1024, profile=None, seed=None, window_size=256,
+                 fec=False, conn_id=None, keepalive=KEEPALIVE):
+        self.server_addr = server_addr
+        # link impairments, see transport/netem.py; loss_rate alone is the simple case
+        self.profile = dict(profile) if profile is not None else {"loss_rate": loss_rate}
+        self.seed = seed if seed is not None else self.profile.get("seed")
+        self.codecs = list(codecs)   # compression we offer, in order of preference
+        self.server_codecs = None    # what the server supports, asked on first upload
+        self.list_token = None       # from the last list_entries(), for changes()
+        self.sock_opts = {"sndbuf": sndbuf, "rcvbuf": rcvbuf}
+        # a multi-worker server shards by conn_id, so the extra connections of a
+        # parallel transfer reuse ours to reach the worker holding its state
+        self.transport_opts = {"window_size": window_size, "fec": fec, "conn_id": conn_id}
+        self.keepalive = keepalive   # idle seconds before a NOOP, None for no keepalive
+        self.metrics = Metrics()
+        self.t = None
+        self.link = None     # ImpairedLink between the socket and the transport
+        self.loop = asyncio.get_event_loop()
+        self.connecting = None       # future of the connect in progress
+        self.keepalive_task = None
+        self.requests = {}   # req_id -> Request
+        self.next_req = 0
+        self.new_connection()
+
+    def new_connection(self):
         import socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.lossy = LossySocket(sock, loss_rate)
-        self.t = GBNTransport(local_port=0, remote_addr=server_addr, loss_wrapper=self.lossy)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', 0))
+        self.t = GBNTransport(local_port=0, remote_addr=self.server_addr, metrics=self.metrics,
+                              **self.transport_opts)
         self.t.on_receive_cb = self.on_receive
-        self.loop = asyncio.get_event_loop()
-        self.recv_data = bytearray()
-        self.metrics = Metrics()
-        self.put_state = None
-        self.get_state = None
+        self.t.on_close_cb = self.on_close
+        self.decoder = FrameDecoder()
+        self.link = None
+
+    @property
+    def connected(self):
+        return self.link is not None and self.connecting is None and not self.t.closed
 
     async def start(self):
-        await self.loop.create_datagram_endpoint(lambda: self.t, local_addr=('0.0.0.0',0))
+        """Connect, or reconnect if the connection was lost; returns at once
+        while connected, so call it before every operation"""
+        self.loop = asyncio.get_running_loop()
+        if self.connected:
+            return
+        if self.connecting is None:
+            self.connecting = self.loop.create_task(self.reconnect())
+        # shielded: one caller giving up must not abort the connect for the others
+        await asyncio.shield(self.connecting)
 
-    def send_command(self, cmd: str):
-        self.t.send(cmd.encode())
+    async def reconnect(self):
+        try:
+            for attempt in range(RECONNECT_ATTEMPTS):
+                if self.link is not None:
+                    # the old connection is gone (reset, evicted, timed out): start afresh
+                    self.link.close()
+                    self.new_connection()
+                try:
+                    _, self.link = await create_endpoint(
+                        lambda: ImpairedLink(self.t, self.profile, seed=self.seed),
+                        sock=self.sock, **self.sock_opts)
+                    await self.t.connect()
+                    break
+                except ConnectionError:
+                    if attempt == RECONNECT_ATTEMPTS - 1:
+                        raise
+                    print(f"[Client] Connect failed, retrying ({attempt + 1}/{RECONNECT_ATTEMPTS})")
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+        finally:
+            self.connecting = None
+        if self.keepalive and (self.keepalive_task is None or self.keepalive_task.done()):
+            self.keepalive_task = self.loop.create_task(self.keep_alive())
+
+    async def keep_alive(self):
+        """NOOP whenever nothing has been heard from the server for keepalive
+        seconds, so the server does not evict an idle connection and a server
+        that died under outstanding requests is noticed; a NOOP that fails
+        drops the connection (failing those requests) and the next operation
+        reconnects"""
+        while self.connected:
+            idle = time.monotonic() - self.t.last_activity
+            if idle < self.keepalive:
+                await asyncio.sleep(self.keepalive - idle)
+                continue
+            _, req = self.request("NOOP")
+            try:
+                await asyncio.wait_for(req.done, KEEPALIVE_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError, RemoteError):
+                if not self.t.closed:
+                    print("[Client] Keepalive failed, dropping the connection")
+                    self.t.shutdown(ConnectionError("keepalive timed out"))
+
+    async def close(self):
+        if self.keepalive_task:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
+        if self.connecting:
+            await asyncio.gather(self.connecting, return_exceptions=True)
+        if self.link is not None:
+            await self.t.close()
+            self.link.close()
+
+    # ------------------------
+    def request(self, cmd, on_data=None, final_ok=True, body=b""):
+        """Send a command, with an optional binary body; returns its Request"""
+        if self.t.closed:
+            raise ConnectionError("not connected")
+        for _ in range(0xffff):
+            self.next_req = self.next_req % 0xffff + 1
+            if self.next_req not in self.requests:
+                break  # ids wrap during long batches; skip the ones still outstanding
+        else:
+            raise RuntimeError("too many requests in flight")
+        req_id = self.next_req
+        req = Request(self.loop, on_data, final_ok)
+        self.requests[req_id] = req
+        req.done.add_done_callback(lambda _: self.forget(req_id, req))
+        send_frame(self.t, MSG_CMD, req_id, cmd.encode() + (b"\n" + body if body else b""))
+        return req_id, req
+
+    def forget(self, req_id, req):
+        if self.requests.get(req_id) is req:
+            del self.requests[req_id]
 
     def on_receive(self, data):
-        self.recv_data.extend(data)
-        print("[Client] Received:", data.decode())
+        try:
+            frames = self.decoder.feed(data)
+        except ValueError as e:
+            # the stream is out of step and cannot be resynchronized: fail
+            # everything on it and drop the connection; the next call reconnects
+            print("[Client] Protocol error:", e)
+            for req in list(self.requests.values()):
+                req.fail(ConnectionError(f"protocol error: {e}"))
+            self.t.shutdown()
+            return
+        for mtype, req_id, payload in frames:
+            req = self.requests.get(req_id)
+            if req:
+                req.handle(mtype, payload)
+            elif mtype == MSG_ERR:
+                print("[Client] Server error:", payload.decode(errors="replace"))
 
-    async def put_file(self, local_path, remote_name, resume=False):
-        offset = 0
-        if resume and os.path.exists(local_path + ".resume"):
-            offset = int(open(local_path + ".resume").read())
-        self.send_command(f"PUT {remote_name}\n")
-        await asyncio.sleep(0.5)
+    def on_close(self):
+        for req in list(self.requests.values()):
+            req.fail(ConnectionError("connection closed"))
+
+    # ------------------------
+    async def list_files(self, prefix=""):
+        """Names of every file on the server (under prefix), in name order"""
+        return [f.name async for f in self.list_entries(prefix)]
+
+    async def list_page(self, prefix="", after=None, limit=None, digest=False):
+        """One LIST reply: (files, token, cursor). Pass cursor back as after
+        for the next page; it is None on the last one. token is for changes()."""
+        await self.start()
+        cmd = "LIST" + (f" {quote(prefix, safe='/')}" if prefix else "")
+        if limit is not None:
+            cmd += f" limit={limit}"
+        if after is not None:
+            cmd += f" after={quote(after, safe='/')}"
+        if digest:
+            cmd += " digest=1"
+        _, req = self.request(cmd)
+        head, *lines = (await req.done).decode().split("\n")
+        head = parse_list_head(head)
+        files = [parse_list_line(line) for line in lines if line]
+        return files, head["token"], None if head["next"] == "-" else unquote(head["next"])
+
+    async def list_entries(self, prefix="", digest=False, limit=None):
+        """Every file under prefix as a RemoteFile, page by page. The token
+        of the first page is left in self.list_token."""
+        files, self.list_token, cursor = await self.list_page(prefix, None, limit, digest)
+        for f in files:
+            yield f
+        while cursor is not None:
+            files, _, cursor = await self.list_page(prefix, cursor, limit, digest)
+            for f in files:
+                yield f
+
+    async def changes(self, token, limit=None):
+        """What changed on the server since token (from a LIST or an earlier
+        call): (changed, removed, new token). changed holds a RemoteFile per
+        new or modified file, removed their names. Returns None in place of
+        the lists when the server cannot tell (it restarted, or the token is
+        too old): list everything again then."""
+        await self.start()
+        cmd = f"LIST since={token}" + (f" limit={limit}" if limit is not None else "")
+        changed, removed = {}, set()
+        while True:
+            _, req = self.request(cmd)
+            head, *lines = (await req.done).decode().split("\n")
+            head = parse_list_head(head)
+            if head.get("reset") == "1":
+                return None, None, head["token"]
+            for line in lines:
+                if line.startswith("+ "):
+                    f = parse_list_line(line[2:])
+                    changed[f.name] = f
+                    removed.discard(f.name)
+                elif line.startswith("- "):
+                    name = unquote(line[2:])
+                    changed.pop(name, None)
+                    removed.add(name)
+            if head.get("more") != "1":
+                return list(changed.values()), sorted(removed), head["token"]
+            cmd = f"LIST since={head['token']}" + (f" limit={limit}" if limit is not None else "")
+
+    async def stat(self, remote_name):
+        await self.start()
+        _, req = self.request(f"STAT {quote(remote_name, safe='/')}")
+        return int(await req.done)
+
+    def get_options(self):
+        """Options appended to a GET: the codecs we accept"""
+        return f" codec={','.join(self.codecs)}" if self.codecs else ""
+
+    async def put_options(self):
+        """Options appended to a PUT: our preferred codec the server supports"""
+        if not self.codecs:
+            return ""
+        if self.server_codecs is None:
+            _, req = self.request("CODECS")
+            try:
+                self.server_codecs = (await req.done).decode().split()
+            except RemoteError:
+                self.server_codecs = []  # a server without compression
+        for name in self.codecs:
+            if name in self.server_codecs:
+                return f" codec={name}"
+        return ""
+
+    async def send_chunks(self, req_id, req, chunks, options, progress=None):
+        """Stream chunks as DATA frames, compressed if options named a codec;
+        progress, if given, is called with the file bytes sent so far"""
+        codec = get_codec(options.partition("codec=")[2])
+        if codec:
+            source = encode_chunks(codec, chunks)
+        else:
+            source = plain_chunks(chunks)
+        sent = 0
+        async for raw_len, payload in source:
+            send_frame(self.t, MSG_DATA, req_id, payload)
+            self.metrics.record_bytes(raw_len)
+            self.metrics.record_wire(raw_len, len(payload))
+            if progress:
+                sent += raw_len
+                progress(sent)
+            await self.t.drain()
+            if req.done.done():
+                break  # refused, stop sending
+
+    async def put_file(self, local_path, remote_name, resume=False, progress=None):
+        """Upload local_path; progress(bytes done, total), if given, is called
+        as the data goes out (see also get_file)"""
+        await self.start()
+        if resume:
+            # resumable uploads go as ranges so the missing pieces can be resent
+            await self.put_file_parallel(local_path, remote_name, streams=1, resume=True,
+                                         progress=progress)
+            return
+        start_time = time.time()
+        size = os.path.getsize(local_path)
+        options = await self.put_options()
+        req_id, req = self.request(f"PUT {quote(remote_name, safe='/')} {size}{options}")
         with open(local_path, "rb") as f:
-            f.seek(offset)
-            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
-                self.send_command(b"DATA " + chunk)
-                self.metrics.record_bytes(len(chunk))
-                offset += len(chunk)
-                if resume:
-                    with open(local_path + ".resume", "w") as rf:
-                        rf.write(str(offset))
-        self.send_command("END")
-        if os.path.exists(local_path + ".resume"):
-            os.remove(local_path + ".resume")
+            await self.send_chunks(req_id, req, read_chunks(f), options,
+                                   progress and (lambda sent: progress(sent, size)))
+        send_frame(self.t, MSG_END, req_id)
+        await req.done
+        self.metrics.record_delay((time.time()-start_time)*1000, size)
         print("[Client] PUT complete")
 
-    async def get_file(self, remote_name, local_path, resume=False):
+    async def get_file(self, remote_name, local_path, resume=False, progress=None):
+        """Download to local_path; progress(bytes done, total), if given, is
+        called for every chunk received. It runs on the event loop, between
+        packets, so it must be quick: rate-limit anything expensive."""
+        await self.start()
         offset = 0
         if resume and os.path.exists(local_path):
             offset = os.path.getsize(local_path)
         start_time = time.time()
-        self.send_command(f"GET {remote_name}\n")
-        await asyncio.sleep(2)
-        mode = "r+b" if os.path.exists(local_path) else "wb"
-        with open(local_path, mode) as f:
+        f = None
+        received = crc = 0
+        total = None
+
+        def open_local():
+            # not before the server's OK: an ERR reply must leave the file alone
+            nonlocal f
+            f = open(local_path, "r+b" if os.path.exists(local_path) else "wb")
             f.seek(offset)
-            f.write(self.recv_data)
-        self.metrics.record_delay((time.time()-start_time)*1000)
-        print(f"[Client] GET complete, {len(self.recv_data)} bytes")
+            f.truncate()
+
+        def on_data(chunk):
+            nonlocal received, crc, total
+            try:
+                if f is None:
+                    open_local()
+                f.write(chunk)
+            except OSError as e:
+                req.fail(e)
+                return
+            received += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            if progress:
+                if total is None:  # DATA only follows the OK carrying the size
+                    total = int(req.response.result().split()[0])
+                progress(offset + received, total)
+
+        try:
+            _, req = self.request(f"GET {quote(remote_name, safe='/')} {offset}{self.get_options()}",
+                                  on_data=on_data, final_ok=False)
+            size = int((await req.response).split()[0])
+            remote_crc = (await req.done).decode()
+            if f is None:
+                open_local()  # nothing was sent: empty, or already complete
+        finally:
+            if f is not None:
+                f.close()
+        if offset + received != size:
+            raise RemoteError(f"short transfer: {offset + received} of {size} bytes")
+        if f"{crc:08x}" != remote_crc:
+            raise RemoteError("checksum mismatch")
+        self.metrics.record_bytes(received)
+        self.metrics.record_wire(received, req.wire_bytes)
+        self.metrics.record_delay((time.time()-start_time)*1000, received)
+        print(f"[Client] GET complete, {received} bytes")
+
+    # ------------------------
+    async def mget(self, remote_names, local_dir, in_flight=BATCH_IN_FLIGHT, retries=1):
+        """Download many files into local_dir over this one connection, with up
+        to in_flight GETs outstanding. An async iterator of (name, error or
+        None), in completion order."""
+        os.makedirs(local_dir, exist_ok=True)
+
+        def get(name):
+            return self.get_file(name, os.path.join(local_dir, os.path.basename(name)))
+
+        async for result in self.pipeline(get, remote_names, in_flight, retries):
+            yield result
+
+    async def mput(self, local_paths, remote_dir="", in_flight=BATCH_IN_FLIGHT, retries=1):
+        """Upload many files (to remote_dir/<basename>) over this one connection,
+        with up to in_flight PUTs outstanding. An async iterator of
+        (local path, error or None), in completion order."""
+        def put(path):
+            name = os.path.basename(path)
+            return self.put_file(path, f"{remote_dir.rstrip('/')}/{name}" if remote_dir else name)
+
+        async for result in self.pipeline(put, local_paths, in_flight, retries):
+            yield result
+
+    async def pipeline(self, op, items, in_flight, retries):
+        """Run op(item) for every item, in_flight at a time, yielding (item,
+        error or None) as each finishes. Items that fail because the
+        connection dropped are retried (after a reconnect) up to retries times."""
+        await self.start()
+        items = iter(items)
+        running = {}   # task -> (item, attempts so far)
+
+        def launch(item, attempt=0):
+            running[self.loop.create_task(op(item))] = (item, attempt)
+
+        for item in itertools.islice(items, in_flight):
+            launch(item)
+        try:
+            while running:
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    item, attempt = running.pop(task)
+                    error = task.exception()
+                    if isinstance(error, ConnectionError) and attempt < retries:
+                        launch(item, attempt + 1)  # its op reconnects first
+                        continue
+                    for nxt in itertools.islice(items, 1):
+                        launch(nxt)
+                    yield item, error
+        finally:
+            for task in running:
+                task.cancel()
+
+    # ------------------------
+    async def sync_get(self, remote_name, local_path):
+        """Bring local_path up to date with the server's copy, fetching only
+        the blocks that differ"""
+        await self.start()
+        start_time = time.time()
+        tmp_path = local_path + ".sync"
+        with open_basis(local_path) as basis, open(tmp_path, "wb") as out:
+            manifest = await self.loop.run_in_executor(None, make_manifest, basis.view)
+            patcher = Patcher(basis.view, parse_manifest(manifest)[0], lambda _, data: out.write(data))
+            wire = 0
+
+            def on_data(op):
+                nonlocal wire
+                wire += len(op)
+                try:
+                    patcher.feed(op)
+                except ValueError as e:
+                    req.fail(RemoteError(f"bad delta: {e}"))
+
+            _, req = self.request(f"SYNC GET {quote(remote_name, safe='/')}", on_data=on_data,
+                                  final_ok=False, body=manifest)
+            try:
+                size = int(await req.response)
+                remote_crc = (await req.done).decode()
+            except BaseException:
+                out.close()
+                os.remove(tmp_path)
+                raise
+        if patcher.pos != size or f"{patcher.crc:08x}" != remote_crc:
+            os.remove(tmp_path)
+            raise RemoteError("delta does not reproduce the file")
+        os.replace(tmp_path, local_path)
+        self.metrics.record_bytes(wire)
+        self.metrics.record_delay((time.time()-start_time)*1000, size)
+        print(f"[Client] SYNC GET complete, {wire} bytes on the wire for {size}")
+
+    async def sync_put(self, local_path, remote_name):
+        """Bring the server's copy up to date with local_path, sending only
+        the blocks that differ"""
+        await self.start()
+        start_time = time.time()
+        size = os.path.getsize(local_path)
+        req_id, req = self.request(f"SYNC PUT {quote(remote_name, safe='/')} {size}", final_ok=False)
+        manifest = await req.response
+        with open_basis(local_path) as source:
+            encoder = DeltaEncoder(source.view, manifest)
+            wire = 0
+            while not req.done.done() and \
+                    (ops := await self.loop.run_in_executor(None, encoder.step)) is not None:
+                for op in ops:
+                    send_frame(self.t, MSG_DATA, req_id, op)
+                    wire += len(op)
+                    await self.t.drain()
+                    if req.done.done():
+                        break
+            if req.done.done():
+                await req.done  # the server refused the delta: raises its ERR
+                raise RemoteError("SYNC PUT ended before its data was sent")
+            # whole-file sum off the loop; zlib drops the GIL while it runs
+            crc = await self.loop.run_in_executor(None, zlib.crc32, source.view)
+        send_frame(self.t, MSG_END, req_id, f"{crc:08x}".encode())
+        await req.done
+        self.metrics.record_bytes(wire)
+        self.metrics.record_delay((time.time()-start_time)*1000, size)
+        print(f"[Client] SYNC PUT complete, {wire} bytes on the wire for {size}")
+
+    async def get_range(self, remote_name, local_path, offset, length, progress=None):
+        """Fetch one range of a file into local_path at the same offset;
+        progress, if given, is called with the range's bytes received so far"""
+        await self.start()
+        fd = os.open(local_path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+        try:
+            pos, crc = offset, 0
+
+            def on_data(chunk):
+                nonlocal pos, crc
+                pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                if progress:
+                    progress(pos - offset)
+
+            _, req = self.request(f"GET {quote(remote_name, safe='/')} {offset} {length}{self.get_options()}",
+                                  on_data=on_data, final_ok=False)
+            remote_crc = (await req.done).decode()
+        finally:
+            os.close(fd)
+        if pos != offset + length:
+            raise RemoteError(f"short range: {pos - offset} of {length} bytes")
+        if f"{crc:08x}" != remote_crc:
+            raise RemoteError("checksum mismatch")
+        self.metrics.record_bytes(length)
+        self.metrics.record_wire(length, req.wire_bytes)
+
+    async def put_range(self, local_path, remote_name, size, offset, length, progress=None):
+        """Upload one range of local_path; returns True once the server has the
+        whole file. progress, if given, is called with the range's bytes sent so far"""
+        await self.start()
+        options = await self.put_options()
+        req_id, req = self.request(f"PUT {quote(remote_name, safe='/')} {size} {offset} {length}{options}")
+        with open(local_path, "rb") as f:
+            f.seek(offset)
+            await self.send_chunks(req_id, req, read_chunks(f, length), options, progress)
+        send_frame(self.t, MSG_END, req_id)
+        reply = (await req.done).decode()
+        return reply == "done"
+
+    async def get_file_parallel(self, remote_name, local_path, streams=4,
+                                range_size=RANGE_SIZE, processes=False, resume=False, progress=None):
+        """Download a file as ranges over several connections, writing each at its offset"""
+        start_time = time.time()
+        size = await self.stat(remote_name)
+        state_path = local_path + ".resume"
+        done = load_resume(state_path, remote_name, size) if resume else RangeSet()
+        mode = "r+b" if done.ranges and os.path.exists(local_path) else "wb"
+        with open(local_path, mode) as f:
+            f.truncate(size)
+        pieces = split_ranges(done.missing(size), range_size)
+        await self.run_ranges("get", remote_name, local_path, pieces, streams, processes,
+                              done, state_path, size, progress)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        self.metrics.record_delay((time.time()-start_time)*1000, size)
+        print(f"[Client] GET complete, {size} bytes over {streams} streams")
+
+    async def put_file_parallel(self, local_path, remote_name, streams=4,
+                                range_size=RANGE_SIZE, processes=False, resume=False, progress=None):
+        """Upload a file as ranges over several connections; the server
+        assembles them and commits the file when every range has arrived"""
+        start_time = time.time()
+        size = os.path.getsize(local_path)
+        state_path = local_path + ".put.resume"
+        done = load_resume(state_path, remote_name, size) if resume else RangeSet()
+        pieces = split_ranges(done.missing(size), range_size) or [(0, 0)]
+        complete = await self.run_ranges("put", remote_name, local_path, pieces, streams,
+                                         processes, done, state_path, size, progress)
+        if not complete and done.ranges:
+            # the server no longer holds the earlier pieces, send everything again
+            done = RangeSet()
+            pieces = split_ranges([[0, size]], range_size) or [(0, 0)]
+            complete = await self.run_ranges("put", remote_name, local_path, pieces, streams,
+                                             processes, done, state_path, size, progress)
+        if not complete:
+            raise RemoteError("upload incomplete")
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        self.metrics.record_delay((time.time()-start_time)*1000, size)
+        print(f"[Client] PUT complete, {size} bytes over {streams} streams")
+
+    async def run_ranges(self, op, remote_name, local_path, pieces, streams, processes,
+                         done, state_path, size, progress=None):
+        """Spread pieces over streams connections (or worker processes),
+        recording each finished piece in the resume file. Returns True if
+        the server reported the upload complete."""
+        complete = False
+        moving = {}  # offset -> bytes of that piece moved so far, for progress
+
+        def finished(offset, length, result):
+            nonlocal complete
+            complete = complete or bool(result)
+            done.add(offset, length)
+            save_resume(state_path, remote_name, size, done)
+            moving.pop(offset, None)
+            if progress:
+                progress(done.covered(), size)
+
+        def piece_progress(offset):
+            if not progress:
+                return None
+
+            def update(n):
+                moving[offset] = n
+                progress(done.covered() + sum(moving.values()), size)
+            return update
+
+        if processes:
+            pool = ProcessPoolExecutor(max_workers=streams, initializer=start_worker,
+                                       initargs=(self.server_addr, self.profile, self.t.conn_id))
+
+            async def run(offset, length):
+                result = await asyncio.wrap_future(pool.submit(
+                    transfer_range, op, remote_name, local_path, size, offset, length))
+                finished(offset, length, result)
+            try:
+                await asyncio.gather(*(run(offset, length) for offset, length in pieces))
+            finally:
+                # waits for the workers to close their connections and exit
+                await self.loop.run_in_executor(None, pool.shutdown)
+            return complete
+
+        queue = list(reversed(pieces))
+
+        async def worker(client):
+            while queue and not complete:
+                offset, length = queue.pop()
+                if op == "get":
+                    result = await client.get_range(remote_name, local_path, offset, length,
+                                                    piece_progress(offset))
+                else:
+                    result = await client.put_range(local_path, remote_name, size, offset, length,
+                                                    piece_progress(offset))
+                finished(offset, length, result)
+
+        clients = [self]
+        try:
+            for i in range(min(streams, len(pieces)) - 1):
+                client = FTPClient(self.server_addr, codecs=self.codecs, profile=self.profile,
+                                   seed=None if self.seed is None else self.seed + 2*(i + 1),
+                                   conn_id=self.t.conn_id)
+                await client.start()
+                clients.append(client)
+            await asyncio.gather(*(worker(c) for c in clients))
+        finally:
+            for client in clients[1:]:
+                await client.close()
+        return complete
+
+async def plain_chunks(chunks):
+    for chunk in chunks:
+        yield len(chunk), chunk
+
+class open_basis:
+    """Read-only view of a local file for delta work; empty if it does not exist"""
+    def __init__(self, fpath):
+        self.mm = None
+        try:
+            with open(fpath, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            pass
+        self.view = memoryview(self.mm) if self.mm else memoryview(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.view.release()
+        if self.mm:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass  # slices still referenced; freed with them
+
+def load_resume(state_path, remote_name, size):
+    """Ranges already transferred, if state_path describes the same transfer"""
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return RangeSet()
+    if state.get("name") != remote_name or state.get("size") != size:
+        return RangeSet()
+    return RangeSet(state.get("done", []))
+
+def save_resume(state_path, remote_name, size, done):
+    tmp = state_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"name": remote_name, "size": size, "done": done.ranges}, f)
+    os.replace(tmp, state_path)
+
+_worker = None  # (loop, client) kept by each worker process across ranges
+
+def start_worker(server_addr, profile, conn_id):
+    """Worker-process initializer: the process's own loop and client, closed
+    when the pool shuts the process down"""
+    global _worker
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    _worker = (loop, FTPClient(server_addr, profile=profile, conn_id=conn_id))
+    # atexit does not run in forked workers, multiprocessing's finalizers do
+    multiprocessing.util.Finalize(None, stop_worker, exitpriority=10)
+
+def stop_worker():
+    global _worker
+    loop, client = _worker
+    _worker = None
+    try:
+        loop.run_until_complete(client.close())
+    finally:
+        loop.close()
+
+def transfer_range(op, remote_name, local_path, size, offset, length):
+    """Worker-process entry point: move one range over the process's own connection"""
+    loop, client = _worker
+    if op == "get":
+        return loop.run_until_complete(client.get_range(remote_name, local_path, offset, length))
+    return loop.run_until_complete(client.put_range(local_path, remote_name, size, offset, length))
 
 async def main():
     client = FTPClient()
@@ -68,6 +775,7 @@ async def main():
     await client.get_file("example.txt", "downloaded_example.txt", resume=True)
     await client.put_file("upload_me.txt", "uploaded_example.txt", resume=True)
     print(client.metrics.report())
+    await client.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
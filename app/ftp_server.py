@@ -1,65 +1,456 @@
-import asyncio, os, zlib, time
-from transport.transport import GBNTransport
-from app.fileops import iter_chunks, save_chunks
-from tools.metrics import Metrics
+import asyncio, os, time
+from urllib.parse import quote, unquote
+from transport.listener import Listener
+from transport.udpio import create_endpoint
+from transport import trace
+from app.fileops import StreamingSink, RangeSet
+from app.filecache import FileCache, CACHE_BYTES
+from app.delta import DeltaEncoder, Patcher, make_manifest, BLOCK_SIZE
+from app.dirindex import DirIndex
+from app.compression import CODECS, choose_codec, get_codec, encode_chunks, decode_chunk
+from app.protocol import (FrameDecoder, send_frame, MSG_CMD, MSG_OK, MSG_ERR, MSG_DATA, MSG_END)
+from tools.metrics import Metrics, MetricsExporter
 
 SERVER_DIR = "./server_files"
 os.makedirs(SERVER_DIR, exist_ok=True)
 
 metrics = Metrics()
-clients_state = {}
+file_cache = FileCache(CACHE_BYTES, metrics)
+clients_state = {}  # connection -> {"decoder": FrameDecoder, "uploads": {req_id: upload}}
+partial_uploads = {}  # path -> ranged upload shared by every connection sending pieces of it
+PARTIAL_TTL = 3600.0  # drop ranged uploads nobody has touched for this long
+dir_index = None  # DirIndex of SERVER_DIR, built by main() or the first LIST
+LIST_PAGE = 1000       # entries per LIST reply unless the client asks for fewer
+LIST_PAGE_MAX = 10000
 
-async def handle_command(client, data):
-    cmd = data.decode().strip()
+def resolve(name):
+    """Map a client-supplied name into SERVER_DIR, refusing to escape it"""
+    root = os.path.realpath(SERVER_DIR)
+    fpath = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, fpath]) != root or fpath == root:
+        raise ValueError(f"bad file name: {name}")
+    return fpath
+
+def split_args(args, count):
+    """Split "<name> [n1 [n2 ...]]" into the name and up to count integers.
+    The name is URL-quoted on the wire, so it is always the first word."""
+    name, *words = args.split(" ")
+    if not name or len(words) > count or not all(w.isdigit() for w in words):
+        raise ValueError(f"bad arguments: {args}")
+    return unquote(name), [int(w) for w in words]
+
+def split_opts(args):
+    """Split trailing "key=value" options off a command's arguments"""
+    opts = {}
+    while True:
+        head, _, last = args.rpartition(" ")
+        key, eq, value = last.partition("=")
+        if not head or not eq or not key.isalpha():
+            return args, opts
+        opts[key] = value
+        args = head
+
+async def handle_command(client, req_id, cmd, body=b""):
     print("[Server] Command:", cmd)
+    try:
+        if cmd == "LIST" or cmd.startswith("LIST "):
+            await handle_list(client, req_id, cmd)
 
-    if cmd == "LIST":
-        files = os.listdir(SERVER_DIR)
-        client.send(("\n".join(files)+"\n").encode())
+        elif cmd.startswith("GET "):
+            await handle_get(client, req_id, cmd[4:].strip())
 
-    elif cmd.startswith("GET "):
-        fname = cmd[4:].strip()
-        fpath = os.path.join(SERVER_DIR, fname)
-        if not os.path.exists(fpath):
-            client.send(b"ERROR: file not found\n")
-            return
-        start_time = time.time()
-        for chunk, crc in iter_chunks(fpath):
-            client.send(chunk)
-            metrics.record_bytes(len(chunk))
-        metrics.record_delay((time.time()-start_time)*1000)
-
-    elif cmd.startswith("PUT "):
-        fname = cmd[4:].strip()
-        fpath = os.path.join(SERVER_DIR, fname)
-        clients_state[client] = {"fpath": fpath, "chunks": []}
-        client.send(b"READY\n")
-
-    elif cmd.startswith("DATA "):
-        if client not in clients_state:
-            client.send(b"ERROR: unexpected data\n")
-            return
-        payload = data[5:]
-        clients_state[client]["chunks"].append((payload, zlib.crc32(payload) & 0xffffffff))
-        metrics.record_bytes(len(payload))
+        elif cmd.startswith("SYNC GET "):
+            await handle_sync_get(client, req_id, cmd[9:].strip(), body)
+
+        elif cmd.startswith("SYNC PUT "):
+            await start_sync_put(client, req_id, cmd[9:].strip())
+
+        elif cmd == "NOOP":
+            send_frame(client, MSG_OK, req_id)
+
+        elif cmd == "CODECS":
+            send_frame(client, MSG_OK, req_id, " ".join(CODECS).encode())
+
+        elif cmd.startswith("STAT "):
+            fpath = resolve(split_args(cmd[5:].strip(), 0)[0])
+            if not os.path.isfile(fpath):
+                send_frame(client, MSG_ERR, req_id, b"file not found")
+            else:
+                send_frame(client, MSG_OK, req_id, str(os.path.getsize(fpath)).encode())
+
+        else:
+            send_frame(client, MSG_ERR, req_id, b"Unknown command")
+    except (OSError, ValueError) as e:
+        if not client.closed:
+            send_frame(client, MSG_ERR, req_id, str(e).encode())
+
+def index():
+    global dir_index
+    if dir_index is None:
+        dir_index = DirIndex(SERVER_DIR)
+    return dir_index
+
+def list_line(entry):
+    digest = "-" if entry.digest is None else f"{entry.digest:08x}"
+    return f"{entry.size} {entry.mtime_ns} {digest} {quote(entry.name, safe='/ ')}"
+
+async def handle_list(client, req_id, cmd):
+    # LIST [prefix] [limit=N] [after=<name>] [digest=1]
+    #     -> OK "token=<T> next=<name or ->" + one "<size> <mtime_ns> <crc32 or -> <name>" line per file
+    # LIST since=<T> [limit=N]
+    #     -> OK "token=<T> more=0|1 [reset=1]" + "+ <size> <mtime_ns> - <name>" or "- <name>" lines
+    # Names are relative to the server root, "/"-separated and URL-quoted.
+    args, opts = split_opts(cmd)  # the whole line, as a LIST may be all options
+    args = args[4:].strip()
+    limit = min(int(opts.get("limit", LIST_PAGE)), LIST_PAGE_MAX)
+    if limit <= 0:
+        raise ValueError("bad limit")
+    dirs = index()
+    await dirs.refresh()
+    if "since" in opts:
+        changes, token, more, reset = dirs.changes_since(opts["since"], limit)
+        lines = [f"token={token} more={int(more)}" + (" reset=1" if reset else "")]
+        lines += [f"+ {list_line(entry)}" if entry else f"- {quote(name, safe='/ ')}"
+                  for name, entry in changes]
+    else:
+        after = unquote(opts["after"]) if "after" in opts else None
+        entries, cursor = dirs.page(unquote(args), after, limit)
+        entries = await dirs.revalidate(entries)  # files changed in place keep their dir's mtime
+        if opts.get("digest") == "1":
+            await dirs.fill_digests(entries)
+        # the token is taken with the page, so changes made while a client
+        # walks the pages are all returned by a LIST since=<first token>
+        lines = [f"token={dirs.token} next={quote(cursor, safe='/') if cursor else '-'}"]
+        lines += [list_line(entry) for entry in entries]
+    send_frame(client, MSG_OK, req_id, "\n".join(lines).encode())
+
+async def handle_get(client, req_id, args):
+    # GET <name> [offset [length]] [codec=<names>]; OK carries the whole file's
+    # size and the codec picked from the offered ones, END the range's crc
+    args, opts = split_opts(args)
+    name, nums = split_args(args, 2)
+    offset = nums[0] if nums else 0
+    length = nums[1] if len(nums) > 1 else None
+    fpath = resolve(name)
+    if not os.path.isfile(fpath):
+        send_frame(client, MSG_ERR, req_id, b"file not found")
+        return
+    start_time = time.time()
+    entry = file_cache.open(fpath)
+    try:
+        offset = min(offset, entry.size)
+        if length is None or offset + length > entry.size:
+            length = entry.size - offset
+        crc = entry.digest(offset, length)  # summed on an executor while we send
+        chosen = choose_codec(opts.get("codec", "").split(","))
+        reply = str(entry.size) + (f" codec={chosen}" if chosen else "")
+        send_frame(client, MSG_OK, req_id, reply.encode())
+        if chosen:
+            async for raw_len, payload in encode_chunks(get_codec(chosen), entry.chunks(offset, length)):
+                send_frame(client, MSG_DATA, req_id, payload)
+                metrics.record_bytes(raw_len)
+                metrics.record_wire(raw_len, len(payload))
+                await client.drain()
+        else:
+            for chunk in entry.chunks(offset, length):
+                send_frame(client, MSG_DATA, req_id, chunk)
+                metrics.record_bytes(len(chunk))
+                metrics.record_wire(len(chunk), len(chunk))
+                await client.drain()
+        send_frame(client, MSG_END, req_id, f"{await crc:08x}".encode())
+    finally:
+        file_cache.release(entry)
+    metrics.record_delay((time.time()-start_time)*1000, length)
+
+def new_upload(fpath, size, ranged):
+    return {"sink": StreamingSink(fpath, size), "size": size, "ranged": ranged,
+            "ranges": RangeSet(), "committed": None, "touched": time.monotonic()}
 
-    elif cmd == "END":
+def shared_upload(fpath, size):
+    """Find or start the ranged upload of fpath that pieces are written into"""
+    now = time.monotonic()
+    for path, upload in list(partial_uploads.items()):
+        if now - upload["touched"] > PARTIAL_TTL:
+            del partial_uploads[path]
+            asyncio.ensure_future(upload["sink"].abort())
+    upload = partial_uploads.get(fpath)
+    if upload is not None and upload["size"] != size:
+        del partial_uploads[fpath]
+        asyncio.ensure_future(upload["sink"].abort())
+        upload = None
+    if upload is None:
+        upload = partial_uploads[fpath] = new_upload(fpath, size, ranged=True)
+    upload["touched"] = now
+    return upload
+
+async def handle_sync_get(client, req_id, name, manifest):
+    # SYNC GET <name> + manifest of the client's copy -> OK <size>, delta ops as DATA, END <crc32 hex>
+    fpath = resolve(split_args(name, 0)[0])
+    if not os.path.isfile(fpath):
+        send_frame(client, MSG_ERR, req_id, b"file not found")
+        return
+    start_time = time.time()
+    loop = asyncio.get_running_loop()
+    entry = file_cache.open(fpath)
+    try:
+        encoder = DeltaEncoder(entry.view, manifest)
+        crc = entry.digest()
+        send_frame(client, MSG_OK, req_id, str(entry.size).encode())
+        while (ops := await loop.run_in_executor(None, encoder.step)) is not None:
+            for op in ops:
+                send_frame(client, MSG_DATA, req_id, op)
+                await client.drain()
+        send_frame(client, MSG_END, req_id, f"{await crc:08x}".encode())
+    finally:
+        file_cache.release(entry)
+    metrics.record_bytes(encoder.literal_bytes)
+    metrics.record_delay((time.time()-start_time)*1000, entry.size)
+
+async def start_sync_put(client, req_id, args):
+    # SYNC PUT <name> <size> -> OK + manifest of our copy; delta ops follow as DATA, then END <crc32 hex>
+    name, nums = split_args(args, 1)
+    if not nums:
+        raise ValueError("SYNC PUT needs the file size")
+    fpath = resolve(name)
+    entry = file_cache.open(fpath) if os.path.isfile(fpath) else None
+    basis = entry.view if entry else memoryview(b"")
+    try:
+        manifest = await asyncio.get_running_loop().run_in_executor(None, make_manifest, basis)
         if client not in clients_state:
+            raise ConnectionError("client went away")
+    except BaseException:
+        if entry:
+            file_cache.release(entry)
+        raise
+    upload = new_upload(fpath, nums[0], ranged=False)
+    clients_state[client]["uploads"][req_id] = {
+        "upload": upload, "start": 0, "offset": 0, "end": nums[0], "basis": entry,
+        "patch": Patcher(basis, BLOCK_SIZE, upload["sink"].write)}
+    send_frame(client, MSG_OK, req_id, manifest)
+
+def start_put(client, req_id, args):
+    # PUT <name> [size [offset length]] [codec=<name>]; DATA frames and END follow
+    # with the same request id. A ranged PUT writes one piece of the file; pieces
+    # may come over several connections and the file is committed once they
+    # cover all of it. The client picks the codec from our CODECS reply.
+    args, opts = split_opts(args)
+    codec = get_codec(opts.get("codec"))
+    name, nums = split_args(args, 3)
+    if len(nums) == 2:
+        raise ValueError("PUT takes a size, or a size, offset and length")
+    fpath = resolve(name)
+    size = nums[0] if nums else None
+    if len(nums) == 3:
+        offset, length = nums[1], nums[2]
+        if offset + length > size:
+            raise ValueError("range past end of file")
+        upload = shared_upload(fpath, size)
+    else:
+        offset, length = 0, size
+        upload = new_upload(fpath, size, ranged=False)
+    uploads = clients_state[client]["uploads"]
+    if req_id in uploads:
+        discard_upload(uploads.pop(req_id))
+    uploads[req_id] = {"upload": upload, "start": offset, "offset": offset,
+                       "end": None if length is None else offset + length, "codec": codec}
+
+def discard_upload(piece):
+    # Unranged uploads die with their request; ranged ones stay for a resume
+    if not piece["upload"]["ranged"]:
+        asyncio.ensure_future(abort_upload(piece))
+
+async def abort_upload(piece):
+    await piece["upload"]["sink"].abort()
+    if piece.get("basis"):
+        file_cache.release(piece["basis"])
+        piece["basis"] = None
+
+def handle_data(client, req_id, payload):
+    """Queue a PUT chunk for writing; the bytes count against the client's
+    receive window until they reach the disk"""
+    uploads = clients_state[client]["uploads"]
+    piece = uploads.get(req_id)
+    if piece is None:
+        return  # the PUT was refused, its ERR is already on the way
+    if "patch" in piece:
+        apply_delta(client, req_id, piece, payload)
+        return
+    wire_len = len(payload)
+    try:
+        if piece["codec"]:
+            payload = decode_chunk(piece["codec"], payload)
+        if piece["end"] is not None and piece["offset"] + len(payload) > piece["end"]:
+            raise ValueError("data past end of range")
+    except ValueError as e:
+        discard_upload(uploads.pop(req_id))
+        send_frame(client, MSG_ERR, req_id, str(e).encode())
+        return
+    upload = piece["upload"]
+    if upload["committed"] is None:
+        try:
+            fut = upload["sink"].write(piece["offset"], payload)
+        except OSError as e:
+            # an earlier write-behind failed (e.g. ENOSPC): the file is lost,
+            # ranged or not, so drop it and its temp file
+            uploads.pop(req_id)
+            if partial_uploads.get(upload["sink"].fpath) is upload:
+                del partial_uploads[upload["sink"].fpath]
+            asyncio.ensure_future(abort_upload(piece))
+            send_frame(client, MSG_ERR, req_id, str(e).encode())
             return
-        save_chunks(clients_state[client]["fpath"], clients_state[client]["chunks"])
-        client.send(b"OK\n")
-        del clients_state[client]
+        client.hold(len(payload))
+        fut.add_done_callback(lambda _: client.release(len(payload)))
+    # else the other pieces already completed the file
+    piece["offset"] += len(payload)
+    metrics.record_bytes(len(payload))
+    metrics.record_wire(len(payload), wire_len)
 
+def apply_delta(client, req_id, piece, op):
+    """Rebuild the next piece of a SYNC PUT from a delta op"""
+    try:
+        fut = piece["patch"].feed(op)
+        if piece["patch"].pos > piece["end"]:
+            raise ValueError("delta runs past the file size")
+    except (ValueError, OSError) as e:  # a malformed op, or a failed write-behind
+        discard_upload(clients_state[client]["uploads"].pop(req_id))
+        send_frame(client, MSG_ERR, req_id, str(e).encode())
+        return
+    client.hold(len(op))
+    fut.add_done_callback(lambda _: client.release(len(op)))
+    metrics.record_bytes(len(op))
+
+async def finish_sync_put(client, req_id, piece, crc):
+    patch, sink = piece["patch"], piece["upload"]["sink"]
+    if patch.pos != piece["end"] or f"{patch.crc:08x}" != crc.decode(errors="replace"):
+        discard_upload(piece)
+        send_frame(client, MSG_ERR, req_id, b"delta does not reproduce the file")
+        return
+    try:
+        await sink.commit()
+    except OSError as e:
+        await abort_upload(piece)
+        send_frame(client, MSG_ERR, req_id, str(e).encode())
+        return
+    if piece["basis"]:
+        file_cache.release(piece["basis"])
+    file_cache.invalidate(sink.fpath)
+    index().update(sink.fpath)
+    send_frame(client, MSG_OK, req_id, b"done")
+
+async def finish_put(client, req_id, payload=b""):
+    """Replies OK "done" once the file is in place, or OK "partial <bytes>"
+    while a ranged upload still misses pieces"""
+    piece = clients_state[client]["uploads"].pop(req_id, None)
+    if piece is None:
+        return
+    if "patch" in piece:
+        await finish_sync_put(client, req_id, piece, payload)
+        return
+    upload = piece["upload"]
+    sink = upload["sink"]
+    if piece["end"] is not None and piece["offset"] != piece["end"]:
+        discard_upload(piece)
+        send_frame(client, MSG_ERR, req_id, b"short upload")
+        return
+    try:
+        if upload["committed"] is None:
+            await sink.wait()
+        upload["ranges"].add(piece["start"], piece["offset"] - piece["start"])
+        complete = not upload["ranged"] or upload["ranges"].covered() == upload["size"]
+        if complete and upload["committed"] is None:
+            upload["committed"] = asyncio.ensure_future(sink.commit())
+            if partial_uploads.get(sink.fpath) is upload:
+                del partial_uploads[sink.fpath]
+        if complete:
+            await asyncio.shield(upload["committed"])
+            file_cache.invalidate(sink.fpath)
+            index().update(sink.fpath)
+    except OSError as e:
+        if upload["ranged"]:
+            partial_uploads.pop(sink.fpath, None)
+        await sink.abort()
+        send_frame(client, MSG_ERR, req_id, str(e).encode())
+        return
+    if complete:
+        send_frame(client, MSG_OK, req_id, b"done")
     else:
-        client.send(b"Unknown command\n")
+        send_frame(client, MSG_OK, req_id, f"partial {upload['ranges'].covered()}".encode())
 
-async def main():
-    t = GBNTransport(local_port=9000)
-    t.on_receive_cb = lambda data: asyncio.create_task(handle_command(t, data))
-    loop = asyncio.get_running_loop()
-    await loop.create_datagram_endpoint(lambda: t, local_addr=('0.0.0.0', 9000))
+def handle_frame(client, mtype, req_id, payload):
+    # PUT setup and DATA are handled inline so they keep stream order
+    if mtype == MSG_DATA:
+        handle_data(client, req_id, payload)
+    elif mtype == MSG_END:
+        asyncio.create_task(finish_put(client, req_id, payload))
+    elif mtype == MSG_CMD:
+        # a command line, optionally followed by a binary body (SYNC GET's manifest)
+        line, _, body = payload.partition(b"\n")
+        try:
+            cmd = line.decode().strip()
+        except UnicodeDecodeError:
+            send_frame(client, MSG_ERR, req_id, b"command is not valid UTF-8")
+            return
+        if cmd.startswith("PUT "):
+            print("[Server] Command:", cmd)
+            try:
+                start_put(client, req_id, cmd[4:].strip())
+            except (OSError, ValueError) as e:
+                send_frame(client, MSG_ERR, req_id, str(e).encode())
+        else:
+            asyncio.create_task(handle_command(client, req_id, cmd, body))
+
+def on_receive(client, data):
+    try:
+        frames = clients_state[client]["decoder"].feed(data)
+    except ValueError as e:
+        print("[Server] Protocol error:", e)
+        send_frame(client, MSG_ERR, 0, str(e).encode())
+        asyncio.ensure_future(client.close())
+        return
+    for frame in frames:
+        handle_frame(client, *frame)
+
+def on_connection(conn):
+    clients_state[conn] = {"decoder": FrameDecoder(), "uploads": {}}
+    conn.on_receive_cb = lambda data: on_receive(conn, data)
+
+def on_disconnect(conn):
+    state = clients_state.pop(conn, None)
+    if state:
+        for piece in state["uploads"].values():
+            discard_upload(piece)
+
+async def main(port=9000, max_connections=1024, idle_timeout=60.0, cache_bytes=CACHE_BYTES,
+               sndbuf=4*1024*1024, rcvbuf=4*1024*1024, window_size=256, metrics_port=None,
+               fec=False, sock=None, stop=None, grace=10.0):
+    """Serve until cancelled or, given an asyncio.Event, until stop is set:
+    then new connections are refused and open ones get grace seconds to end.
+    sock is an already bound UDP socket to serve on instead of port (see
+    app/multiserver.py)."""
+    file_cache.max_bytes = cache_bytes
+    await index().refresh(force=True)  # the first LIST should not pay for the full scan
+    listener = Listener(port, on_connection=on_connection, on_disconnect=on_disconnect,
+                        max_connections=max_connections, idle_timeout=idle_timeout,
+                        window_size=window_size, metrics=metrics, fec=fec)
+    endpoint, _ = await create_endpoint(lambda: listener, local_addr=('0.0.0.0', port), sock=sock,
+                                        sndbuf=sndbuf, rcvbuf=rcvbuf)
+    exporter = None
+    if metrics_port is not None:
+        # scrape with: curl localhost:<metrics_port>/metrics (or /snapshot for JSON)
+        exporter = MetricsExporter(metrics, metrics_port).start()
+    if trace.DEFAULT:
+        trace.DEFAULT.dump_on_signal()  # MINIFTP_TRACE is set: kill -USR1 writes a trace dump
     print("[Server] Running...")
-    await asyncio.Future()
+    try:
+        if stop is None:
+            await asyncio.Future()
+        await stop.wait()
+        if not await listener.drain(grace):
+            print(f"[Server] {len(listener.connections)} connections still open after {grace}s, closing")
+    finally:
+        endpoint.close()
+        if exporter:
+            exporter.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,206 @@
+"""Multi-process server: N workers serve one UDP port.
+
+    python -m app.multiserver --workers 4 [--port 9000] [--metrics-port 9100]
+
+The supervisor binds one SO_REUSEPORT socket per worker (see
+transport/udpio.reuseport_group) and forks a worker process for each; a
+worker runs the ordinary app.ftp_server on its socket. The kernel steers
+every datagram by conn_id, so a connection (and every connection of a
+parallel transfer, which share their conn_id) always reaches the same
+worker and its upload state.
+
+The supervisor keeps all the sockets open itself, so the steering does not
+change when a worker dies: the replacement takes over the same socket and
+whatever queued up in it meanwhile. SIGTERM or SIGINT shuts down
+gracefully: workers refuse new connections, give open ones up to --grace
+seconds, and exit.
+
+Workers report their metrics over a pipe every REPORT_INTERVAL seconds;
+the supervisor sums them and, with --metrics-port, exports the total with
+one "connection" per worker.
+"""
+import argparse, asyncio, multiprocessing, os, signal, sys, time
+from multiprocessing.connection import wait
+from transport.udpio import reuseport_group
+from tools.metrics import Metrics, MetricsExporter
+
+REPORT_INTERVAL = 1.0
+MIN_UPTIME = 1.0      # a worker dying sooner than this is restarted after a pause
+
+def worker_main(index, sock, pipe, server_dir, server_opts):
+    """Worker process: serve on sock until SIGTERM, reporting metrics over pipe"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # until the event loop takes it over
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the supervisor decides when to stop
+    from app import ftp_server
+    if server_dir is not None:
+        ftp_server.SERVER_DIR = server_dir
+        os.makedirs(server_dir, exist_ok=True)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+        async def report():
+            while True:
+                pipe.send(ftp_server.metrics.export_state())
+                await asyncio.sleep(REPORT_INTERVAL)
+
+        reporter = asyncio.create_task(report())
+        try:
+            await ftp_server.main(sock=sock, stop=stop, **server_opts)
+        finally:
+            reporter.cancel()
+            pipe.send(ftp_server.metrics.export_state())
+
+    print(f"[Worker {index}] pid {os.getpid()}")
+    try:
+        asyncio.run(run())
+    except (BrokenPipeError, EOFError):
+        pass  # the supervisor is gone
+    finally:
+        pipe.close()
+
+class Supervisor:
+    def __init__(self, workers, port=9000, host="0.0.0.0", metrics_port=None, grace=10.0,
+                 server_dir=None, **server_opts):
+        self.count = workers
+        self.address = (host, port)
+        self.metrics_port = metrics_port
+        self.grace = grace
+        self.server_dir = server_dir
+        self.server_opts = dict(server_opts, port=port, grace=grace)
+        self.ctx = multiprocessing.get_context("fork")  # workers inherit their socket
+        self.sockets = []
+        self.workers = {}         # index -> (Process, pipe, started)
+        self.restart_at = {}      # index -> when to restart a worker that died
+        self.states = {}          # index -> last reported metrics state
+        self.retired = []         # final states of workers that were replaced
+        self.metrics = Metrics()
+        self.worker_metrics = {}  # index -> child Metrics shown per worker
+        self.exporter = None
+        self.stopping = False
+
+    def start(self):
+        self.sockets, sharded = reuseport_group(self.address, self.count,
+                                                rcvbuf=self.server_opts.get("rcvbuf"),
+                                                sndbuf=self.server_opts.get("sndbuf"))
+        self.address = self.sockets[0].getsockname()
+        self.server_opts["port"] = self.address[1]
+        if not sharded and self.count > 1:
+            print("[Supervisor] No conn_id steering on this kernel; ranged uploads over "
+                  "several connections may be split between workers")
+        for index in range(self.count):
+            self.worker_metrics[index] = Metrics(self.metrics, label=f"worker {index}")
+            self.spawn(index)
+        if self.metrics_port is not None:
+            self.exporter = MetricsExporter(self.metrics, self.metrics_port).start()
+        print(f"[Supervisor] {self.count} workers on UDP port {self.address[1]}")
+        return self
+
+    def spawn(self, index):
+        parent, child = self.ctx.Pipe(duplex=False)
+        proc = self.ctx.Process(target=worker_main, name=f"ftp-worker-{index}",
+                                args=(index, self.sockets[index], child, self.server_dir,
+                                      self.server_opts))
+        proc.start()
+        child.close()
+        self.workers[index] = (proc, parent, time.monotonic())
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        """Supervise until stop() (SIGTERM/SIGINT), then shut the workers down"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            while not self.stopping:
+                self.poll(0.5)
+        finally:
+            self.shutdown()
+
+    def poll(self, timeout):
+        """Collect metric reports, notice dead workers and restart them when due"""
+        now = time.monotonic()
+        for index, when in list(self.restart_at.items()):
+            if when <= now:
+                del self.restart_at[index]
+                self.spawn(index)
+        waitables = {}
+        for index, (proc, pipe, _) in self.workers.items():
+            waitables[pipe] = index
+            waitables[proc.sentinel] = index
+        for ready in wait(list(waitables), timeout):
+            index = waitables[ready]
+            if index not in self.workers:
+                continue  # reaped already, through its other waitable
+            if ready is self.workers[index][1]:
+                self.receive(index)
+            else:
+                self.reap(index)
+
+    def receive(self, index):
+        pipe = self.workers[index][1]
+        try:
+            while pipe.poll():
+                self.states[index] = pipe.recv()
+        except (EOFError, OSError):
+            return  # the worker is exiting; its sentinel fires next
+        self.worker_metrics[index].load_state(self.states[index])
+        self.metrics.load_state(*self.retired, *self.states.values())
+
+    def reap(self, index):
+        self.receive(index)
+        proc, pipe, started = self.workers.pop(index)
+        proc.join()
+        pipe.close()
+        if self.stopping:
+            return
+        # its counts stay in the total, the replacement starts from zero
+        if index in self.states:
+            self.retired.append(self.states.pop(index))
+        pause = MIN_UPTIME if time.monotonic() - started < MIN_UPTIME else 0.0
+        print(f"[Supervisor] Worker {index} exited with {proc.exitcode}, restarting")
+        self.restart_at[index] = time.monotonic() + pause
+
+    def shutdown(self):
+        print("[Supervisor] Shutting down")
+        for proc, _, _ in self.workers.values():
+            if proc.is_alive():
+                proc.terminate()  # SIGTERM: drain and exit
+        deadline = time.monotonic() + self.grace + 5.0
+        while self.workers and time.monotonic() < deadline:
+            for ready in wait([proc.sentinel for proc, _, _ in self.workers.values()], 0.2):
+                for index, (proc, pipe, _) in list(self.workers.items()):
+                    if proc.sentinel == ready:
+                        self.receive(index)
+                        proc.join()
+                        pipe.close()
+                        del self.workers[index]
+        for proc, pipe, _ in self.workers.values():
+            print(f"[Supervisor] Killing worker {proc.name}")
+            proc.kill()
+            proc.join()
+            pipe.close()
+        self.workers = {}
+        for sock in self.sockets:
+            sock.close()
+        if self.exporter:
+            self.exporter.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--metrics-port", type=int)
+    parser.add_argument("--grace", type=float, default=10.0,
+                        help="seconds open connections get to finish on shutdown")
+    parser.add_argument("--dir", help="directory to serve (default ./server_files)")
+    args = parser.parse_args(argv)
+    Supervisor(args.workers, port=args.port, metrics_port=args.metrics_port,
+               grace=args.grace, server_dir=args.dir).start().run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
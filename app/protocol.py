@@ -0,0 +1,87 @@
+"""Length-prefixed message framing on top of GBNTransport's byte stream.
+
+Every message is a frame: type (1 byte), request id (2 bytes), payload
+length (4 bytes), then the payload. The request id ties responses to the
+command that caused them, so several requests can share a connection.
+
+    GET <name> [offset [length]] [codec=<a,b>]
+                                  -> OK <size> [codec=<a>], DATA..., END <crc32 hex>  (or ERR)
+    PUT <name> <size> [offset length] [codec=<a>]
+                                  <- DATA..., END from the client;
+                                  -> OK done | OK partial <bytes>  (or ERR)
+    SYNC GET <name> + manifest    -> OK <size>, delta ops as DATA..., END <crc32 hex>
+    SYNC PUT <name> <size>        -> OK + manifest; <- delta ops as DATA..., END <crc32 hex>;
+                                  -> OK done  (or ERR)
+    STAT <name>                   -> OK <size>
+    CODECS                        -> OK <codec names>
+    LIST [prefix] [limit=N] [after=<name>] [digest=1]
+                                  -> OK token=<T> next=<name|-> + "<size> <mtime_ns> <crc32|-> <name>" lines
+    LIST since=<T> [limit=N]      -> OK token=<T> more=0|1 [reset=1] + "+ <size> <mtime_ns> - <name>"
+                                     or "- <name>" lines
+    NOOP                          -> OK  (client keepalive)
+
+A <name> is URL-quoted in every command (see urllib.parse.quote, with
+"/" left as is), so spaces or numbers in it never read as arguments.
+
+A ranged PUT carries one piece of the file; the server commits the file
+once the pieces, possibly sent over several connections, cover all of it.
+With a codec, every DATA payload of the transfer is one chunk behind a
+flag byte saying whether it is compressed (see app/compression.py); the
+crc in END is always over the raw bytes. A command may carry a binary
+body after its first newline; SYNC uses it for the manifest (see
+app/delta.py).
+
+LIST pages through every file under the server root, subdirectories
+included, in name order; names are "/"-separated and URL-quoted, and
+next= is the after= of the following page. The token names the listing's
+state: LIST since=<token> returns the files changed or removed after it,
+or reset=1 when the server no longer knows (restarted, or too long ago)
+and the client must list again (see app/dirindex.py).
+
+Batches (FTPClient.mget/mput) need no command of their own: they are
+many GETs or PUTs outstanding at once, their frames interleaved on the
+connection and told apart by request id.
+"""
+import struct
+
+FRAME_HDR = struct.Struct("!BHI")  # type, request id, payload length
+MAX_FRAME = 16*1024*1024
+
+# frame types
+MSG_CMD = 1    # text command
+MSG_OK = 2     # success, text detail
+MSG_ERR = 3    # failure, text reason; ends the request
+MSG_DATA = 4   # file bytes
+MSG_END = 5    # end of data for a request
+
+class RemoteError(Exception):
+    """The peer answered a request with ERR"""
+
+def send_frame(transport, mtype, req_id, payload=b''):
+    # two sends: the transport copies into its queue anyway, no need to concatenate
+    transport.send(FRAME_HDR.pack(mtype, req_id, len(payload)))
+    if payload:
+        transport.send(payload)
+
+class FrameDecoder:
+    """Reassembles frames from arbitrarily split or coalesced deliveries"""
+    def __init__(self, max_frame=MAX_FRAME):
+        self.buf = bytearray()
+        self.max_frame = max_frame
+
+    def feed(self, data):
+        """Add received bytes; returns the list of complete (type, req_id, payload)"""
+        self.buf += data
+        frames = []
+        off = 0
+        while len(self.buf) - off >= FRAME_HDR.size:
+            mtype, req_id, length = FRAME_HDR.unpack_from(self.buf, off)
+            if length > self.max_frame:
+                raise ValueError(f"Frame too large: {length} bytes")
+            end = off + FRAME_HDR.size + length
+            if end > len(self.buf):
+                break
+            frames.append((mtype, req_id, bytes(self.buf[off + FRAME_HDR.size:end])))
+            off = end
+        del self.buf[:off]
+        return frames
@@ -0,0 +1,118 @@
+"""A queue of transfers run concurrently over one FTPClient session.
+
+Everything here runs on the client's event loop. Callers on other threads
+(the GUI) hand work over with loop.call_soon_threadsafe() and get their
+reports back through the callbacks, which must not block: the GUI's
+callbacks only post a Qt signal.
+
+    queue = TransferQueue(client, concurrency=4, on_progress=..., on_state=...)
+    queue.add("put", "/tmp/a.bin", "a.bin")
+
+Progress comes from the transfer's own data callbacks, so it costs nothing
+to wait for; it is rate-limited to one report per transfer every
+PROGRESS_INTERVAL seconds (plus the final one), so a fast transfer cannot
+flood the receiver with updates.
+"""
+import asyncio, itertools, time
+
+PROGRESS_INTERVAL = 0.1
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class Transfer:
+    def __init__(self, transfer_id, op, local_path, remote_name):
+        self.id = transfer_id
+        self.op = op                  # "put" or "get"
+        self.local_path = local_path
+        self.remote_name = remote_name
+        self.state = QUEUED
+        self.error = None
+        self.done = 0                 # bytes moved
+        self.total = None             # file size, once known
+        self.started = None
+        self.finished = None
+        self.reported = 0.0           # time of the last progress report
+
+    def rate(self):
+        """Average bytes per second since the transfer started"""
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+class TransferQueue:
+    """Runs added transfers, at most concurrency at a time, in the order added.
+
+    on_progress(transfer) is called at most every interval seconds per
+    transfer while it moves data; on_state(transfer) on every state change.
+    """
+    def __init__(self, client, concurrency=4, on_progress=None, on_state=None,
+                 interval=PROGRESS_INTERVAL, resume=True):
+        self.client = client
+        self.slots = asyncio.Semaphore(concurrency)
+        self.on_progress = on_progress
+        self.on_state = on_state
+        self.interval = interval
+        self.resume = resume
+        self.tasks = {}               # transfer id -> task, until it finishes
+        self.ids = itertools.count(1)
+
+    def add(self, op, local_path, remote_name):
+        """Queue a transfer; returns it (call on the event loop's thread)"""
+        if op not in ("put", "get"):
+            raise ValueError(f"unknown transfer: {op}")
+        transfer = Transfer(next(self.ids), op, local_path, remote_name)
+        self.set_state(transfer, QUEUED)
+        task = asyncio.get_running_loop().create_task(self.run(transfer))
+        self.tasks[transfer.id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(transfer.id, None))
+        return transfer
+
+    def cancel(self, transfer_id):
+        task = self.tasks.get(transfer_id)
+        if task:
+            task.cancel()
+
+    async def run(self, transfer):
+        try:
+            async with self.slots:
+                transfer.started = time.monotonic()
+                self.set_state(transfer, RUNNING)
+                progress = lambda done, total: self.progress(transfer, done, total)
+                if transfer.op == "put":
+                    await self.client.put_file(transfer.local_path, transfer.remote_name,
+                                               resume=self.resume, progress=progress)
+                else:
+                    await self.client.get_file(transfer.remote_name, transfer.local_path,
+                                               resume=self.resume, progress=progress)
+        except asyncio.CancelledError:
+            transfer.error = "cancelled"
+            self.finish(transfer, FAILED)
+        except Exception as e:
+            transfer.error = str(e) or type(e).__name__
+            self.finish(transfer, FAILED)
+        else:
+            if transfer.total is not None:
+                transfer.done = transfer.total
+            self.finish(transfer, DONE)
+
+    def progress(self, transfer, done, total):
+        transfer.done = done
+        transfer.total = total
+        now = time.monotonic()
+        if self.on_progress and (now - transfer.reported >= self.interval or done == total):
+            transfer.reported = now
+            self.on_progress(transfer)
+
+    def finish(self, transfer, state):
+        transfer.finished = time.monotonic()
+        self.set_state(transfer, state)
+
+    def set_state(self, transfer, state):
+        transfer.state = state
+        if self.on_state:
+            self.on_state(transfer)
+
+    async def join(self):
+        """Wait until every transfer added so far has finished"""
+        while self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
@@ -0,0 +1,100 @@
+"""The GUI's networking thread and the signals that carry its news back.
+
+All networking (the FTPClient session and its TransferQueue) lives on an
+asyncio loop running in a thread of its own, so packets are handled as
+they arrive whatever the UI is doing, and a slow repaint never stalls a
+transfer. The two sides only meet here:
+
+- UI -> loop: LoopThread.call() / submit() schedule work with
+  call_soon_threadsafe / run_coroutine_threadsafe; they never wait.
+- loop -> UI: TransferSignals are emitted on the loop thread. Their
+  receivers live in the UI thread, so Qt queues each emission and runs the
+  slot there; emitting costs the loop thread next to nothing.
+"""
+import asyncio, threading
+from PySide6.QtCore import QObject, Signal
+from app.ftp_client import FTPClient
+from app.transfers import TransferQueue
+
+class TransferSignals(QObject):
+    # transfer id, op, local path, remote name
+    added = Signal(int, str, str, str)
+    # transfer id, bytes done, total bytes (-1 while unknown), bytes per second
+    progress = Signal(int, "qlonglong", "qlonglong", float)
+    # transfer id, state (see app/transfers.py), error message or ""
+    state = Signal(int, str, str)
+    # FTPClient.metrics.report()
+    metrics = Signal(dict)
+
+class LoopThread:
+    """An asyncio event loop on a daemon thread, owning the client session"""
+    def __init__(self, signals, client_opts=None, concurrency=4):
+        self.signals = signals
+        self.client_opts = client_opts or {}
+        self.concurrency = concurrency
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, name="network", daemon=True)
+        self.ready = threading.Event()
+        self.client = None
+        self.queue = None
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.client = FTPClient(**self.client_opts)
+        self.queue = TransferQueue(self.client, self.concurrency,
+                                   on_progress=self.report_progress, on_state=self.report_state)
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+        self.loop.close()
+
+    # ------------------------
+    # Called from the UI thread
+    def call(self, fn, *args):
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def submit(self, coro):
+        """Run a coroutine on the loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def add_transfer(self, op, local_path, remote_name):
+        self.call(self.queue.add, op, local_path, remote_name)
+
+    def cancel_transfer(self, transfer_id):
+        self.call(self.queue.cancel, transfer_id)
+
+    def request_metrics(self):
+        self.call(lambda: self.signals.metrics.emit(self.client.metrics.report()))
+
+    def stop(self, timeout=5.0):
+        """Close the session and stop the loop, waiting up to timeout seconds"""
+        async def shutdown():
+            for task in list(self.queue.tasks.values()):
+                task.cancel()
+            await self.queue.join()
+            await asyncio.wait_for(self.client.close(), timeout)
+
+        try:
+            self.submit(shutdown()).result(timeout + 1)
+        except Exception:
+            pass  # closing anyway
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+    # ------------------------
+    # Called on the loop thread (TransferQueue callbacks)
+    def report_state(self, transfer):
+        if transfer.state == "queued":
+            self.signals.added.emit(transfer.id, transfer.op, transfer.local_path,
+                                    transfer.remote_name)
+        self.signals.state.emit(transfer.id, transfer.state, transfer.error or "")
+        if transfer.state in ("done", "failed"):
+            self.report_progress(transfer)
+
+    def report_progress(self, transfer):
+        total = transfer.total if transfer.total is not None else -1
+        self.signals.progress.emit(transfer.id, transfer.done, total, transfer.rate())
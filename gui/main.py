@@ -1,127 +1,115 @@
-import sys, asyncio, time
-from PySide6.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QProgressBar
-from PySide6.QtCore import QTimer, Qt
-from app.ftp_client import FTPClient
-
-# Minimal widget instead of importing from widgets.py (simplified)
-class FileTransferWidget(QWidget):
-    def __init__(self, title="File Transfer"):
-        super().__init__()
-        self.label_status = QLabel(f"{title}: Idle")
-        self.progress_bar = QProgressBar()
-        self.btn_select = QPushButton("Select File")
-        self.btn_put = QPushButton("PUT")
-        self.btn_get = QPushButton("GET")
-
-        layout = QVBoxLayout()
-        layout.addWidget(self.label_status)
-        layout.addWidget(self.progress_bar)
-        layout.addWidget(self.btn_select)
-        layout.addWidget(self.btn_put)
-        layout.addWidget(self.btn_get)
-        self.setLayout(layout)
-
-        self.selected_file = None
-        self.remote_name = None
-
-        self.btn_select.clicked.connect(self.select_file)
-
-    def select_file(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Select File")
-        if path:
-            self.selected_file = path
-            self.remote_name = path.split("/")[-1]
-            self.label_status.setText(f"Selected: {self.remote_name}")
+import sys, time
+from PySide6.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel
+from PySide6.QtCore import QTimer
+from gui.widgets import FileTransferWidget, TransferTable
+from gui.bridge import LoopThread, TransferSignals
 
-    def update_progress(self, value, max_value=100):
-        self.progress_bar.setMaximum(max_value)
-        self.progress_bar.setValue(value)
-
-    def update_status(self, text):
-        self.label_status.setText(text)
+METRICS_INTERVAL_MS = 500
+CONCURRENT_TRANSFERS = 4
 
 # ------------------------
 class MainWindow(QWidget):
+    """The UI thread only builds requests and paints; the client session runs
+    on the network thread (gui/bridge.py) and reports back through signals"""
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Mini-FTP GUI")
-        self.client = FTPClient(loss_rate=0.05)
-        self.loop = asyncio.get_event_loop()
+        self.signals = TransferSignals()
+        self.net = LoopThread(self.signals, client_opts={"loss_rate": 0.05},
+                              concurrency=CONCURRENT_TRANSFERS).start()
 
         self.transfer_widget = FileTransferWidget()
+        self.table = TransferTable()
         self.label_metrics = QLabel("Metrics: N/A")
 
         layout = QVBoxLayout()
         layout.addWidget(self.transfer_widget)
+        layout.addWidget(self.table)
         layout.addWidget(self.label_metrics)
         self.setLayout(layout)
 
         # Hook buttons
-        self.transfer_widget.btn_put.clicked.connect(self.start_put)
-        self.transfer_widget.btn_get.clicked.connect(self.start_get)
+        self.transfer_widget.btn_start_put.clicked.connect(self.start_put)
+        self.transfer_widget.btn_start_get.clicked.connect(self.start_get)
 
-        # Timer to integrate asyncio with PySide6
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.loop_iteration)
-        self.timer.start(50)  # 20Hz
+        # Network thread -> UI (queued connections, run on this thread)
+        self.signals.added.connect(self.table.add_transfer)
+        self.signals.progress.connect(self.on_progress)
+        self.signals.state.connect(self.on_state)
+        self.signals.metrics.connect(self.update_metrics)
+
+        self.progress = {}   # transfer id -> (done, total) of the unfinished ones
+        self.started = {}    # transfer id -> start time, for the status line
 
-    def loop_iteration(self):
-        self.loop.call_soon(self.loop.stop)
-        self.loop.run_forever()
+        # Metrics are polled, not pushed on every packet
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.net.request_metrics)
+        self.timer.start(METRICS_INTERVAL_MS)
 
     # ------------------------
     def start_put(self):
-        if not self.transfer_widget.selected_file:
+        if not self.transfer_widget.selected_files:
             self.transfer_widget.update_status("No file selected for PUT")
             return
-        self.transfer_widget.update_status("Starting PUT...")
-        self.loop.create_task(self.put_task())
-
-    async def put_task(self):
-        await self.client.start()
-        start_time = time.time()
-        await self.client.put_file(
-            self.transfer_widget.selected_file,
-            self.transfer_widget.remote_name,
-            resume=True
-        )
-        duration = time.time() - start_time
-        self.transfer_widget.update_status(f"PUT complete in {duration:.2f}s")
-        self.update_metrics()
+        for path in self.transfer_widget.selected_files:
+            self.net.add_transfer("put", path, path.replace("\\", "/").split("/")[-1])
+        self.transfer_widget.update_status(
+            f"Queued {len(self.transfer_widget.selected_files)} PUT(s)")
 
-    # ------------------------
     def start_get(self):
-        if not self.transfer_widget.remote_name:
+        names = self.transfer_widget.remote_names()
+        if not names:
             self.transfer_widget.update_status("No file selected for GET")
             return
-        self.transfer_widget.update_status("Starting GET...")
-        self.loop.create_task(self.get_task())
-
-    async def get_task(self):
-        await self.client.start()
-        start_time = time.time()
-        await self.client.get_file(
-            self.transfer_widget.remote_name,
-            self.transfer_widget.remote_name,
-            resume=True
-        )
-        duration = time.time() - start_time
-        self.transfer_widget.update_status(f"GET complete in {duration:.2f}s")
-        self.update_metrics()
+        for name in names:
+            self.net.add_transfer("get", name, name)
+        self.transfer_widget.update_status(f"Queued {len(names)} GET(s)")
 
     # ------------------------
-    def update_metrics(self):
-        m = self.client.metrics.report()
+    def on_progress(self, transfer_id, done, total, rate):
+        self.table.update_progress(transfer_id, done, total, rate)
+        if transfer_id in self.progress:
+            self.progress[transfer_id] = (done, max(total, 0))
+            self.update_overall()
+
+    def on_state(self, transfer_id, state, error):
+        self.table.update_state(transfer_id, state, error)
+        if state == "queued":
+            self.progress[transfer_id] = (0, 0)
+        elif state == "running":
+            self.started[transfer_id] = time.time()
+        else:
+            self.progress.pop(transfer_id, None)
+            duration = time.time() - self.started.pop(transfer_id, time.time())
+            text = f"Transfer {transfer_id} {state} in {duration:.2f}s"
+            self.transfer_widget.update_status(text + (f": {error}" if error else ""))
+            self.update_overall()
+
+    def update_overall(self):
+        """The top progress bar covers every unfinished transfer"""
+        done = sum(d for d, _ in self.progress.values())
+        total = sum(t for _, t in self.progress.values())
+        if not self.progress:
+            self.transfer_widget.update_progress(100, 100)
+        elif total:
+            self.transfer_widget.update_progress(done * 100 // total, 100)
+
+    def update_metrics(self, m):
         text = (f"Bytes sent: {m['total_bytes']}, "
                 f"Retransmissions: {m['retransmissions']}, "
                 f"Avg latency: {m['avg_latency_ms']:.2f}ms, "
                 f"p95 latency: {m['p95_latency_ms']:.2f}ms")
         self.label_metrics.setText(text)
 
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.net.stop()
+        super().closeEvent(event)
+
 # ------------------------
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     win = MainWindow()
-    win.resize(400, 300)
+    win.resize(600, 450)
     win.show()
     sys.exit(app.exec())
@@ -1,34 +1,45 @@
-from PySide6.QtWidgets import QWidget, QLabel, QPushButton, QVBoxLayout, QProgressBar, QFileDialog
+import os
+from PySide6.QtWidgets import (QWidget, QLabel, QPushButton, QVBoxLayout, QHBoxLayout, QProgressBar,
+                               QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView, QLineEdit)
 
 class FileTransferWidget(QWidget):
-    """Widget to handle file transfer with progress and metrics"""
+    """Widget to pick files and start transfers, with overall progress"""
     def __init__(self, title="File Transfer"):
         super().__init__()
+        self.title = title
         self.label_status = QLabel(f"{title}: Idle")
         self.progress_bar = QProgressBar()
-        self.btn_select = QPushButton("Select File")
+        self.btn_select = QPushButton("Select Files")
+        self.remote_edit = QLineEdit()
+        self.remote_edit.setPlaceholderText("Remote file names for GET, separated by spaces")
         self.btn_start_put = QPushButton("PUT")
         self.btn_start_get = QPushButton("GET")
 
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.btn_start_put)
+        buttons.addWidget(self.btn_start_get)
         layout = QVBoxLayout()
         layout.addWidget(self.label_status)
         layout.addWidget(self.progress_bar)
         layout.addWidget(self.btn_select)
-        layout.addWidget(self.btn_start_put)
-        layout.addWidget(self.btn_start_get)
+        layout.addWidget(self.remote_edit)
+        layout.addLayout(buttons)
         self.setLayout(layout)
 
-        self.selected_file = None
-        self.remote_name = None
+        self.selected_files = []
 
-        self.btn_select.clicked.connect(self.select_file)
+        self.btn_select.clicked.connect(self.select_files)
 
-    def select_file(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Select File")
-        if path:
-            self.selected_file = path
-            self.remote_name = path.split("/")[-1]
-            self.label_status.setText(f"Selected: {self.remote_name}")
+    def select_files(self):
+        paths, _ = QFileDialog.getOpenFileNames(self, "Select Files")
+        if paths:
+            self.selected_files = paths
+            names = [os.path.basename(p) for p in paths]
+            self.remote_edit.setText(" ".join(names))
+            self.label_status.setText(f"Selected: {', '.join(names)}")
+
+    def remote_names(self):
+        return self.remote_edit.text().split()
 
     def update_progress(self, value, max_value=100):
         self.progress_bar.setMaximum(max_value)
@@ -36,3 +47,45 @@ class FileTransferWidget(QWidget):
 
     def update_status(self, text):
         self.label_status.setText(text)
+
+class TransferTable(QTableWidget):
+    """One row per queued, running or finished transfer"""
+    COLUMNS = ("Op", "File", "Progress", "Rate", "State")
+
+    def __init__(self):
+        super().__init__(0, len(self.COLUMNS))
+        self.setHorizontalHeaderLabels(self.COLUMNS)
+        self.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.verticalHeader().setVisible(False)
+        self.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.rows = {}   # transfer id -> (row, progress bar)
+
+    def add_transfer(self, transfer_id, op, local_path, remote_name):
+        row = self.rowCount()
+        self.insertRow(row)
+        bar = QProgressBar()
+        bar.setRange(0, 0)  # busy until the size is known
+        self.setItem(row, 0, QTableWidgetItem(op.upper()))
+        self.setItem(row, 1, QTableWidgetItem(remote_name))
+        self.setCellWidget(row, 2, bar)
+        self.setItem(row, 3, QTableWidgetItem(""))
+        self.setItem(row, 4, QTableWidgetItem("queued"))
+        self.rows[transfer_id] = (row, bar)
+
+    def update_progress(self, transfer_id, done, total, rate):
+        if transfer_id not in self.rows:
+            return
+        row, bar = self.rows[transfer_id]
+        if total > 0:
+            # QProgressBar takes ints: show KB so multi-GB files fit
+            bar.setRange(0, max(1, total // 1024))
+            bar.setValue(done // 1024)
+        elif total == 0:
+            bar.setRange(0, 1)
+            bar.setValue(1)
+        self.item(row, 3).setText(f"{rate / 1e6:.2f} MB/s")
+
+    def update_state(self, transfer_id, state, error):
+        if transfer_id in self.rows:
+            row, _ = self.rows[transfer_id]
+            self.item(row, 4).setText(f"{state}: {error}" if error else state)
@@ -0,0 +1,63 @@
+"""Packets/second for building and parsing 1200-byte segments, before and after
+the buffer-oriented API in transport/header.py.
+
+    python -m tests.bench_header
+"""
+import os, struct, time, zlib
+from transport.header import HEADER_FMT, build_packet, parse_packet
+from transport.transport import MSS
+
+# ------------------------
+# The original implementation, kept here as the "before" baseline
+def legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, checksum=0):
+    return struct.pack(HEADER_FMT, ver, flags, conn_id, seq, ack, win, length, checksum)
+
+def legacy_make_packet(ver, flags, conn_id, seq, ack, win, payload):
+    length = len(payload)
+    h0 = legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
+    chk = zlib.crc32(h0 + payload) & 0xffffffff
+    return legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, chk) + payload
+
+def legacy_unpack_packet(packet):
+    header = packet[:20]
+    payload = packet[20:]
+    ver, flags, conn_id, seq, ack, win, length, chk = struct.unpack(HEADER_FMT, header)
+    h0 = legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
+    if zlib.crc32(h0 + payload) & 0xffffffff != chk:
+        raise ValueError("Checksum mismatch")
+    return dict(ver=ver, flags=flags, conn_id=conn_id, seq=seq, ack=ack,
+                win=win, length=length, checksum=chk), payload
+
+# ------------------------
+def rate(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - start)
+
+def main(n=200_000):
+    stream = bytearray(os.urandom(MSS * 64))
+    packet = legacy_make_packet(1, 0, 1, 0, 0, 4096, bytes(stream[:MSS]))
+
+    def legacy_build(i):
+        # the old try_send sliced a copy out of send_buffer first
+        off = (i % 64) * MSS
+        legacy_make_packet(1, 0, 1, off, 0, 4096, bytes(stream[off:off + MSS]))
+
+    view = memoryview(stream)  # try_send holds one view per batch of segments
+
+    def new_build(i):
+        off = (i % 64) * MSS
+        build_packet(1, 0, 1, off, 0, 4096, view[off:off + MSS])
+
+    results = [
+        ("build", rate(legacy_build, n), rate(new_build, n)),
+        ("parse", rate(lambda i: legacy_unpack_packet(packet), n),
+                  rate(lambda i: parse_packet(packet), n)),
+    ]
+    print(f"{'':>6} {'before pkt/s':>14} {'after pkt/s':>14} {'speedup':>8}")
+    for name, before, after in results:
+        print(f"{name:>6} {before:>14,.0f} {after:>14,.0f} {after / before:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Loopback throughput of the stock asyncio datagram transport against the
+batched endpoint in transport/udpio.py, with and without UDP GSO.
+
+Two measurements per path: a raw blast of MSS-sized datagrams (packets
+per second and send syscalls) and a GBNTransport bulk transfer.
+
+    python -m tests.bench_udpio
+"""
+import asyncio, time
+from transport.transport import GBNTransport, MSS
+from transport.udpio import create_endpoint
+
+PATHS = [
+    ("asyncio", dict(batched=False)),
+    ("batched", dict(batched=True, gso=False)),
+    ("batched+gso", dict(batched=True, gso=None)),
+]
+SOCK_BUF = 8*1024*1024
+
+class Sink(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.count = 0
+
+    def datagram_received(self, data, addr):
+        self.count += 1
+
+async def blast(opts, count=200_000, burst=256):
+    """Send count datagrams in bursts of one loop tick; returns (pkt/s sent, share delivered, syscalls)"""
+    sink = Sink()
+    rx, _ = await create_endpoint(lambda: sink, local_addr=('127.0.0.1', 0), rcvbuf=SOCK_BUF, **opts)
+    tx, _ = await create_endpoint(asyncio.DatagramProtocol, local_addr=('127.0.0.1', 0),
+                                  sndbuf=SOCK_BUF, **opts)
+    addr = rx.get_extra_info('sockname')
+    packet = bytes(MSS + 20)
+    start = time.perf_counter()
+    for i in range(0, count, burst):
+        for _ in range(burst):
+            tx.sendto(packet, addr)
+        await asyncio.sleep(0)   # end of the tick: the batched path flushes here
+    while getattr(tx, "queue", None) or tx.get_write_buffer_size():
+        await asyncio.sleep(0.001)
+    sent = time.perf_counter() - start
+    await asyncio.sleep(0.2)
+    syscalls = getattr(tx, "sends", count)
+    tx.close()
+    rx.close()
+    return count / sent, sink.count / count, syscalls
+
+async def bulk(opts, size=32*1024*1024):
+    """GBNTransport transfer of size bytes; returns MB/s"""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    got = 0
+
+    def on_receive(data):
+        nonlocal got
+        got += len(data)
+        if got >= size and not done.done():
+            done.set_result(None)
+
+    receiver = GBNTransport(0, window_size=4096, recv_window=16*1024*1024)
+    receiver.on_receive_cb = on_receive
+    rx, _ = await create_endpoint(lambda: receiver, local_addr=('127.0.0.1', 0),
+                                  sndbuf=SOCK_BUF, rcvbuf=SOCK_BUF, **opts)
+    sender = GBNTransport(0, remote_addr=rx.get_extra_info('sockname'), window_size=4096)
+    tx, _ = await create_endpoint(lambda: sender, local_addr=('127.0.0.1', 0),
+                                  sndbuf=SOCK_BUF, rcvbuf=SOCK_BUF, **opts)
+    block = bytes(1024*1024)
+    start = time.perf_counter()
+    for _ in range(size // len(block)):
+        sender.send(block)
+        await sender.drain()
+    await done
+    elapsed = time.perf_counter() - start
+    sender.shutdown()
+    receiver.shutdown()
+    tx.close()
+    rx.close()
+    return size / elapsed / 1e6
+
+async def main():
+    print(f"{'path':>12} {'sent pkt/s':>12} {'delivered':>10} {'syscalls':>10} {'bulk MB/s':>10}")
+    for name, opts in PATHS:
+        sent, delivered, syscalls = await blast(opts)
+        mbps = await bulk(opts)
+        print(f"{name:>12} {sent:>12,.0f} {delivered:>10.1%} {syscalls:>10,} {mbps:>10.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
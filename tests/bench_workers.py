@@ -0,0 +1,79 @@
+"""Aggregate throughput of the multi-process server (app/multiserver.py)
+against its worker count.
+
+For every worker count a supervisor serves a temporary directory and
+--clients client processes each PUT a file and GET it back at the same
+time, over clean loopback. Scaling is only near-linear while there are
+cores for the workers and the clients alike.
+
+    python -m tests.bench_workers --workers 1,2,4 --clients 8 --size 4M
+"""
+import argparse, asyncio, multiprocessing, os, tempfile, time, zlib
+from concurrent.futures import ProcessPoolExecutor
+from app.multiserver import Supervisor
+from tests.benchmark import parse_size, free_port
+
+def serve(workers, port, server_dir):
+    Supervisor(workers, port=port, host="127.0.0.1", server_dir=server_dir, grace=2.0).start().run()
+
+def client_main(port, index, source, workdir):
+    """Client process: PUT then GET one file; returns (put seconds, get seconds)"""
+    from app.ftp_client import FTPClient
+
+    async def run():
+        client = FTPClient(("127.0.0.1", port), profile={"loss_rate": 0.0})
+        await client.start()
+        try:
+            start = time.perf_counter()
+            await client.put_file(source, f"bench_{index}.bin")
+            put = time.perf_counter() - start
+            target = os.path.join(workdir, f"download_{index}.bin")
+            start = time.perf_counter()
+            await client.get_file(f"bench_{index}.bin", target)
+            get = time.perf_counter() - start
+        finally:
+            await client.close()
+        with open(source, "rb") as a, open(target, "rb") as b:
+            if zlib.crc32(a.read()) != zlib.crc32(b.read()):
+                raise RuntimeError(f"client {index}: downloaded file differs from the source")
+        return put, get
+
+    return asyncio.run(run())
+
+def run(workers, clients, size):
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source.bin")
+        with open(source, "wb") as f:
+            f.write(os.urandom(size))
+        port = free_port()
+        server = multiprocessing.get_context("fork").Process(
+            target=serve, args=(workers, port, os.path.join(workdir, "server")))
+        server.start()
+        time.sleep(0.5 + 0.1 * workers)
+        try:
+            with ProcessPoolExecutor(clients, mp_context=multiprocessing.get_context("spawn")) as pool:
+                start = time.perf_counter()
+                futures = [pool.submit(client_main, port, i, source, workdir) for i in range(clients)]
+                times = [f.result() for f in futures]
+                wall = time.perf_counter() - start
+        finally:
+            server.terminate()  # SIGTERM: graceful shutdown
+            server.join(10)
+    return 2 * size * clients / wall / 1e6, max(p for p, _ in times), max(g for _, g in times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--size", type=parse_size, default=4*1024*1024)
+    args = parser.parse_args(argv)
+    print(f"{os.cpu_count()} cpus, {args.clients} clients x {args.size} bytes, PUT + GET each")
+    base = None
+    for workers in (int(w) for w in args.workers.split(",")):
+        mbps, put, get = run(workers, args.clients, args.size)
+        base = base or mbps
+        print(f"{workers:3} workers: {mbps:8.2f} MB/s aggregate ({mbps / base:.2f}x), "
+              f"slowest PUT {put:.2f}s, slowest GET {get:.2f}s")
+
+if __name__ == "__main__":
+    main()
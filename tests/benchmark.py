@@ -0,0 +1,304 @@
+"""Reproducible transfer benchmark: in-process server, loopback, impaired client links.
+
+Sweeps file size, window size, loss profile (tests/profiles.json) and the
+number of concurrent clients. Every configuration runs in a fresh process
+so its CPU time and peak RSS are its own. Each client PUTs its own file and
+then GETs it back; per direction we report
+
+    goodput_MBps      file bytes moved by all clients / wall time, in MB/s
+    p50/p95/p99_ms    per-transfer latency over all clients and repeats
+    retransmit_ratio  bytes retransmitted / bytes sent, both ends of every connection
+
+and per configuration the CPU time and peak RSS of the whole process.
+
+    python -m tests.benchmark --sizes 64K,1M,16M --windows 64,256 --clients 1,4 --out bench.json
+    python -m tests.benchmark --sizes 1G --profiles clean --repeat 1
+    python -m tests.benchmark --compare baseline.json           # run, then compare
+    python -m tests.benchmark --results bench.json --compare baseline.json
+
+--compare flags metrics that got worse than the baseline by more than
+--threshold and exits with status 1 if any did.
+"""
+import argparse, asyncio, contextlib, itertools, json, os, platform, random
+import socket, subprocess, sys, tempfile, time, zlib
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILES_PATH = os.path.join(os.path.dirname(__file__), "profiles.json")
+BLOCK = 1024*1024
+TRANSFER_TIMEOUT = 600.0
+
+# metric -> (+1 if higher is better else -1, floor under which changes are noise)
+COMPARED = {
+    "goodput_MBps": (+1, 0.01),
+    "p50_ms": (-1, 1.0),
+    "p95_ms": (-1, 1.0),
+    "p99_ms": (-1, 1.0),
+    "retransmit_ratio": (-1, 0.01),
+    "cpu_s": (-1, 0.05),
+    "peak_rss_mb": (-1, 1.0),
+}
+
+def parse_size(text):
+    """"64K", "16M", "1G" or plain bytes"""
+    text = text.strip().upper()
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def write_file(path, size, seed):
+    """Deterministic incompressible content; returns its crc32"""
+    rng = random.Random(seed)
+    crc = 0
+    with open(path, "wb") as f:
+        for off in range(0, size, BLOCK):
+            block = rng.randbytes(min(BLOCK, size - off))
+            crc = zlib.crc32(block, crc)
+            f.write(block)
+    return crc
+
+def file_crc(path):
+    crc = 0
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+
+# ------------------------
+# One configuration, run in its own process
+def sent_and_retransmitted(transports):
+    return (sum(t.next_seq for t in transports),
+            sum(t.bytes_retransmitted for t in transports))
+
+async def timed_phase(clients, server_conns, transfer):
+    """Run transfer(i, client) on every client at once; returns the wall time,
+    the per-transfer latencies and the retransmit ratio of the phase"""
+    transports = [c.t for c in clients] + server_conns()
+    sent0, retx0 = sent_and_retransmitted(transports)
+
+    async def timed(i, client):
+        start = time.perf_counter()
+        await asyncio.wait_for(transfer(i, client), TRANSFER_TIMEOUT)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(i, c) for i, c in enumerate(clients)))
+    wall = time.perf_counter() - start
+    transports = [c.t for c in clients] + server_conns()
+    sent1, retx1 = sent_and_retransmitted(transports)
+    sent = sent1 - sent0
+    return wall, latencies, (retx1 - retx0) / sent if sent else 0.0
+
+async def run_config_async(cfg, workdir):
+    from app import ftp_server
+    from app.ftp_client import FTPClient
+
+    ftp_server.SERVER_DIR = os.path.join(workdir, "server")
+    os.makedirs(ftp_server.SERVER_DIR, exist_ok=True)
+    port = free_port()
+    server = asyncio.create_task(ftp_server.main(port=port, window_size=cfg["window"]))
+    await asyncio.sleep(0.2)
+
+    size, count = cfg["size"], cfg["clients"]
+    sources, crcs = [], []
+    for i in range(count):
+        path = os.path.join(workdir, f"source_{i}.bin")
+        crcs.append(write_file(path, size, seed=cfg["seed"] * 1000 + i))
+        sources.append(path)
+
+    phases = {op: {"wall": 0.0, "latencies": [], "ratios": []} for op in ("put", "get")}
+    try:
+        for rep in range(cfg["repeat"]):
+            clients = []
+            for i in range(count):
+                profile = dict(cfg["profile"], seed=cfg["seed"] + 2*(rep*count + i))
+                client = FTPClient(("127.0.0.1", port), profile=profile, window_size=cfg["window"])
+                await client.start()
+                clients.append(client)
+            server_conns = lambda: list(ftp_server.clients_state)
+
+            async def put(i, client):
+                await client.put_file(sources[i], f"bench_{i}.bin")
+
+            async def get(i, client):
+                target = os.path.join(workdir, f"download_{i}.bin")
+                await client.get_file(f"bench_{i}.bin", target)
+                if file_crc(target) != crcs[i]:
+                    raise RuntimeError(f"client {i}: downloaded file differs from the source")
+
+            for op, transfer in (("put", put), ("get", get)):
+                wall, latencies, ratio = await timed_phase(clients, server_conns, transfer)
+                phases[op]["wall"] += wall
+                phases[op]["latencies"] += latencies
+                phases[op]["ratios"].append(ratio)
+            for client in clients:
+                with contextlib.suppress(Exception):
+                    await asyncio.wait_for(client.close(), 5)
+    finally:
+        server.cancel()
+        with contextlib.suppress(BaseException):
+            await server
+
+    results = []
+    for op, phase in phases.items():
+        latencies = phase["latencies"]
+        results.append({
+            "op": op,
+            "goodput_MBps": size * len(latencies) / phase["wall"] / 1e6,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "retransmit_ratio": sum(phase["ratios"]) / len(phase["ratios"]),
+        })
+    return results
+
+def run_config(cfg, verbose=False):
+    """Entry point of the worker process"""
+    cpu0 = time.process_time()
+    with tempfile.TemporaryDirectory(prefix="miniftp-bench-") as workdir:
+        out = sys.stdout if verbose else open(os.devnull, "w")
+        with contextlib.redirect_stdout(out):
+            results = asyncio.run(run_config_async(cfg, workdir))
+        if out is not sys.stdout:
+            out.close()
+    cpu = time.process_time() - cpu0
+    rss = peak_rss_mb()
+    key = {k: cfg[k] for k in ("size", "window", "profile_name", "clients")}
+    return [dict(key, **r, cpu_s=cpu, peak_rss_mb=rss) for r in results]
+
+# ------------------------
+def sweep(args, profiles):
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    print(f"{'op':>4} {'size':>10} {'win':>5} {'profile':>12} {'cli':>4} {'MB/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'retx':>7} {'cpu s':>7} {'rss MB':>7}")
+    for size, window, name, clients in itertools.product(
+            args.sizes, args.windows, args.profiles, args.clients):
+        cfg = {"size": size, "window": window, "profile_name": name, "profile": profiles[name],
+               "clients": clients, "repeat": args.repeat, "seed": profiles[name].get("seed", 1)}
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                rows = pool.submit(run_config, cfg, args.verbose).result()
+            except Exception as e:
+                print(f"[FAIL] size={size} window={window} profile={name} clients={clients}: {e!r}")
+                results.append({"size": size, "window": window, "profile_name": name,
+                                "clients": clients, "error": repr(e)})
+                continue
+        for r in rows:
+            rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+            print(f"{r['op']:>4} {size:>10} {window:>5} {name:>12} {clients:>4} "
+                  f"{r['goodput_MBps']:>9.2f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                  f"{r['p99_ms']:>9.1f} {r['retransmit_ratio']:>7.3f} {r['cpu_s']:>7.2f} {rss:>7}")
+        results += rows
+    return results
+
+def environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, cwd=os.path.dirname(PROFILES_PATH)).stdout.strip() or None
+    except OSError:
+        rev = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": rev,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+def result_key(r):
+    return (r.get("op"), r["size"], r["window"], r["profile_name"], r["clients"])
+
+def compare(results, baseline, threshold):
+    """Print changes against the baseline; returns the regressions found"""
+    old = {result_key(r): r for r in baseline if "error" not in r}
+    regressions = []
+    for r in results:
+        if "error" in r:
+            regressions.append((result_key(r), "error", None, r["error"]))
+            continue
+        base = old.get(result_key(r))
+        if base is None:
+            continue
+        for metric, (sign, floor) in COMPARED.items():
+            a, b = base.get(metric), r.get(metric)
+            if a is None or b is None:
+                continue
+            change = (b - a) / max(abs(a), floor)
+            if -sign * change > threshold:
+                regressions.append((result_key(r), metric, a, b))
+    for key, metric, a, b in regressions:
+        op, size, window, name, clients = key
+        where = f"{op} size={size} window={window} profile={name} clients={clients}"
+        if metric == "error":
+            print(f"[REGRESSION] {where}: failed ({b})")
+        else:
+            print(f"[REGRESSION] {where}: {metric} {a:.3f} -> {b:.3f}")
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%} against the baseline")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    csv = lambda conv: lambda text: [conv(x) for x in text.split(",") if x]
+    parser.add_argument("--sizes", type=csv(parse_size), default=[64*1024, 1024*1024])
+    parser.add_argument("--windows", type=csv(int), default=[256])
+    parser.add_argument("--profiles", type=csv(str), default=None,
+                        help="profile names from tests/profiles.json (default: all)")
+    parser.add_argument("--clients", type=csv(int), default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--results", help="compare an earlier results file instead of running")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file to check against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative change counted as a regression (default 0.10)")
+    parser.add_argument("--verbose", action="store_true", help="show client and server output")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        with open(args.results) as f:
+            report = json.load(f)
+    else:
+        with open(PROFILES_PATH) as f:
+            profiles = json.load(f)
+        args.profiles = args.profiles or list(profiles)
+        unknown = set(args.profiles) - set(profiles)
+        if unknown:
+            parser.error(f"unknown profiles: {', '.join(sorted(unknown))}")
+        report = {"environment": environment(),
+                  "sweep": {"sizes": args.sizes, "windows": args.windows, "profiles": args.profiles,
+                            "clients": args.clients, "repeat": args.repeat},
+                  "results": sweep(args, profiles)}
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {args.out}")
+
+    failed = any("error" in r for r in report["results"])
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failed = bool(compare(report["results"], baseline["results"], args.threshold)) or failed
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import asyncio, json, os, time
-from transport.lossy_shim import LossySocket
+from transport.netem import ImpairedLink
+from transport.transport import GBNTransport
 from app.ftp_client import FTPClient
 from app.ftp_server import main as start_server
 
@@ -13,40 +14,42 @@ async def run_profile(profile_name, profile_config):
 
     await asyncio.sleep(1)  # let server start
 
-    client = FTPClient(loss_rate=profile_config['loss_rate'])
+    client = FTPClient(profile=profile_config)
     await client.start()
+    try:
+        # Create a test file to upload
+        test_file = os.path.join(TEST_FILES_DIR, f"upload_{profile_name}.bin")
+        with open(test_file, "wb") as f:
+            f.write(os.urandom(256*1024))  # 256 KB test file
 
-    # Create a test file to upload
-    test_file = os.path.join(TEST_FILES_DIR, f"upload_{profile_name}.bin")
-    with open(test_file, "wb") as f:
-        f.write(os.urandom(256*1024))  # 256 KB test file
+        remote_name = f"test_{profile_name}.bin"
 
-    remote_name = f"test_{profile_name}.bin"
+        # Run PUT with resume enabled
+        start_time = time.time()
+        await client.put_file(test_file, remote_name, resume=True)
+        put_duration = time.time() - start_time
 
-    # Run PUT with resume enabled
-    start_time = time.time()
-    await client.put_file(test_file, remote_name, resume=True)
-    put_duration = time.time() - start_time
+        # Run GET with resume enabled
+        download_file = os.path.join(TEST_FILES_DIR, f"download_{profile_name}.bin")
+        start_time = time.time()
+        await client.get_file(remote_name, download_file, resume=True)
+        get_duration = time.time() - start_time
 
-    # Run GET with resume enabled
-    download_file = os.path.join(TEST_FILES_DIR, f"download_{profile_name}.bin")
-    start_time = time.time()
-    await client.get_file(remote_name, download_file, resume=True)
-    get_duration = time.time() - start_time
-
-    metrics = client.metrics.report()
-    print(f"PUT duration: {put_duration:.2f}s")
-    print(f"GET duration: {get_duration:.2f}s")
-    print(f"Metrics: {metrics}")
-
-    # Verify integrity
-    with open(test_file, "rb") as f1, open(download_file, "rb") as f2:
-        original = f1.read()
-        downloaded = f2.read()
-        if original == downloaded:
-            print("[PASS] File integrity verified")
-        else:
-            print("[FAIL] File mismatch!")
+        metrics = client.metrics.report()
+        print(f"PUT duration: {put_duration:.2f}s")
+        print(f"GET duration: {get_duration:.2f}s")
+        print(f"Metrics: {metrics}")
+
+        # Verify integrity
+        with open(test_file, "rb") as f1, open(download_file, "rb") as f2:
+            original = f1.read()
+            downloaded = f2.read()
+            if original == downloaded:
+                print("[PASS] File integrity verified")
+            else:
+                print("[FAIL] File mismatch!")
+    finally:
+        await client.close()  # stops its keepalive before the server goes away
 
     # Cancel server
     server_task.cancel()
@@ -55,11 +58,66 @@ async def run_profile(profile_name, profile_config):
     except:
         pass
 
+# ------------------------
+async def transfer(profile_config, size=256*1024, **transport_opts):
+    """Push `size` bytes over an impaired loopback link (data and ACKs alike),
+    return the sender and stats"""
+    loop = asyncio.get_running_loop()
+    receiver = GBNTransport(local_port=0, **transport_opts)
+    received = bytearray()
+    receiver.on_receive_cb = received.extend
+    rx, _ = await loop.create_datagram_endpoint(lambda: receiver, local_addr=('127.0.0.1', 0))
+
+    sender = GBNTransport(local_port=0, remote_addr=rx.get_extra_info('sockname'), **transport_opts)
+    tx, _ = await loop.create_datagram_endpoint(
+        lambda: ImpairedLink(sender, profile_config, seed=profile_config.get('seed')),
+        local_addr=('127.0.0.1', 0))
+
+    start_time = time.time()
+    sender.send(os.urandom(size))
+    while (len(received) < size or sender.unacked) and time.time() - start_time < 60:
+        await asyncio.sleep(0.01)
+    duration = time.time() - start_time
+    sender.stop_timer()
+    await asyncio.sleep(profile_config.get('jitter_ms', 0) / 1000 + 0.1)  # let delayed packets drain
+    tx.close()
+    rx.close()
+    return sender, duration, len(received) == size
+
+async def run_retransmit_benchmark(profile_name, profile_config):
+    print(f"\n=== Retransmission benchmark: {profile_name} ===")
+    for label, sack in (("go-back-n", False), ("selective-repeat", True)):
+        sender, duration, ok = await transfer(profile_config, sack=sack, cc="fixed", window_size=16)
+        status = "PASS" if ok else "FAIL"
+        print(f"[{status}] {label:>16}: {sender.bytes_retransmitted} bytes retransmitted in {duration:.2f}s")
+
+async def run_congestion_benchmark(profile_name, profile_config, size=1024*1024):
+    print(f"\n=== Congestion control benchmark: {profile_name} ===")
+    for cc in ("fixed", "reno", "vegas"):
+        sender, duration, ok = await transfer(profile_config, size=size, cc=cc, window_size=64)
+        status = "PASS" if ok else "FAIL"
+        print(f"[{status}] {cc:>6}: {size/duration/1024:.0f} KB/s, "
+              f"{sender.bytes_retransmitted} bytes retransmitted, final cwnd {sender.cc.cwnd}")
+
+async def run_fec_benchmark(profile_name, profile_config, size=1024*1024):
+    print(f"\n=== FEC benchmark: {profile_name} ===")
+    for label, opts in (("off", {}), ("adaptive", {"fec": True}), ("group=4", {"fec": True, "fec_group": 4})):
+        sender, duration, ok = await transfer(profile_config, size=size, cc="reno", window_size=64, **opts)
+        status = "PASS" if ok else "FAIL"
+        counters = sender.metrics.counters
+        print(f"[{status}] {label:>8}: {size/duration/1024:.0f} KB/s, "
+              f"{sender.retransmissions} retransmissions, {counters['timeouts']} timeouts, "
+              f"{counters['fec_parity_sent']} parity packets")
+
 async def main():
     with open("tests/profiles.json") as f:
         profiles = json.load(f)
     for name, cfg in profiles.items():
         await run_profile(name, cfg)
+    for name, cfg in profiles.items():
+        await run_retransmit_benchmark(name, cfg)
+        await run_congestion_benchmark(name, cfg)
+        await run_fec_benchmark(name, cfg)
 
 if __name__ == "__main__":
     asyncio.run(main())
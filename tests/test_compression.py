@@ -0,0 +1,91 @@
+import asyncio, os, random
+import pytest
+from app.compression import (CODECS, RAW, PACKED, get_codec, choose_codec, encode_chunk,
+                             decode_chunk, encode_chunks)
+
+TEXT = b"the quick brown fox jumps over the lazy dog\n" * 400
+
+def test_compressible_chunk_round_trip():
+    codec = get_codec("zlib")
+    payload = encode_chunk(codec, TEXT)
+    assert payload[0] == PACKED and len(payload) < len(TEXT)
+    assert decode_chunk(codec, payload) == TEXT
+
+def test_incompressible_chunk_is_sent_raw():
+    codec = get_codec("zlib")
+    data = os.urandom(16 * 1024)
+    payload = encode_chunk(codec, data)
+    assert payload[0] == RAW and payload[1:] == data
+    assert decode_chunk(codec, payload) == data
+
+@pytest.mark.parametrize("payload", [b"", bytes([7]) + b"x", bytes([PACKED]) + b"not zlib"])
+def test_bad_payload_is_rejected(payload):
+    with pytest.raises(ValueError):
+        decode_chunk(get_codec("zlib"), payload)
+
+def test_negotiation():
+    assert choose_codec(["lz4", "zlib"]) == "zlib"
+    assert choose_codec(["lz4"]) is None
+    assert choose_codec([""]) is None
+    assert get_codec("none") is None and get_codec(None) is None
+    with pytest.raises(ValueError):
+        get_codec("lz4")
+
+def test_encode_chunks_keeps_order():
+    chunks = [TEXT, os.urandom(5000), TEXT[:100]] * 5
+
+    async def run():
+        return [item async for item in encode_chunks(get_codec("zlib"), chunks)]
+
+    out = asyncio.run(run())
+    assert [raw for raw, _ in out] == [len(c) for c in chunks]
+    assert [decode_chunk(get_codec("zlib"), p) for _, p in out] == chunks
+
+# ------------------------
+# end to end over a loopback connection
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # importing the server creates ./server_files
+    from app import ftp_server
+    monkeypatch.setattr(ftp_server, "SERVER_DIR", str(tmp_path / "served"))
+    monkeypatch.setattr(ftp_server, "dir_index", None)
+    os.makedirs(ftp_server.SERVER_DIR)
+    return ftp_server
+
+def transfer(server, tmp_path, codecs):
+    """PUT then GET a compressible file; returns the client's raw and wire byte counts"""
+    from app.ftp_client import FTPClient
+    port = random.randint(20000, 60000)
+    src, dst = tmp_path / "src.txt", tmp_path / "dst.txt"
+    src.write_bytes(TEXT * 50)
+
+    async def run():
+        task = asyncio.create_task(server.main(port=port))
+        await asyncio.sleep(0.2)
+        client = FTPClient(("127.0.0.1", port), loss_rate=0.0, codecs=codecs)
+        try:
+            await client.put_file(str(src), "file.txt")
+            await client.get_file("file.txt", str(dst))
+        finally:
+            await client.close()
+            task.cancel()
+        return client.metrics.counters
+
+    counters = asyncio.run(run())
+    assert dst.read_bytes() == src.read_bytes()
+    assert (tmp_path / "served" / "file.txt").read_bytes() == src.read_bytes()
+    return counters["raw_bytes"], counters["wire_bytes"]
+
+def test_transfer_compressed(server, tmp_path):
+    raw, wire = transfer(server, tmp_path, ("zlib",))
+    assert wire < raw / 10
+
+def test_client_without_compression(server, tmp_path):
+    raw, wire = transfer(server, tmp_path, ())
+    assert wire == raw
+
+def test_server_without_compression(server, tmp_path, monkeypatch):
+    monkeypatch.delitem(CODECS, "zlib")
+    raw, wire = transfer(server, tmp_path, ("zlib",))
+    assert wire == raw
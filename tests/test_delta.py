@@ -0,0 +1,79 @@
+import random, zlib
+import pytest
+from app.delta import (DeltaEncoder, Patcher, make_manifest, parse_manifest, COPY, OP_COPY,
+                       BLOCK_SIZE, SEGMENT)
+
+def sync(basis, new, block_size=BLOCK_SIZE):
+    """Run the encoder and patcher end to end; returns (rebuilt, encoder, largest step in bytes)"""
+    encoder = DeltaEncoder(new, make_manifest(basis, block_size))
+    out = bytearray()
+    patcher = Patcher(basis, block_size, lambda offset, data: out.extend(data))
+    largest = 0
+    while (ops := encoder.step()) is not None:
+        largest = max(largest, sum(map(len, ops)))
+        for op in ops:
+            patcher.feed(op)
+    assert patcher.crc == zlib.crc32(new)
+    return bytes(out), encoder, largest
+
+def data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+def test_manifest_round_trip():
+    basis = data(3 * BLOCK_SIZE + 100)
+    block_size, size, sigs = parse_manifest(make_manifest(basis))
+    assert (block_size, size, len(sigs)) == (BLOCK_SIZE, len(basis), 4)
+
+def test_identical_files_are_all_copies():
+    basis = data(20 * BLOCK_SIZE + 123)
+    out, encoder, _ = sync(basis, basis)
+    assert out == basis
+    assert encoder.literal_bytes == 0
+    assert encoder.copied_bytes == len(basis)
+
+def test_insert_in_the_middle():
+    basis = data(20 * BLOCK_SIZE)
+    new = basis[:10 * BLOCK_SIZE + 7] + b"inserted bytes" + basis[10 * BLOCK_SIZE + 7:]
+    out, encoder, _ = sync(basis, new)
+    assert out == new
+    assert encoder.literal_bytes < 2 * BLOCK_SIZE  # only the block around the insert
+
+def test_delete_in_the_middle():
+    basis = data(20 * BLOCK_SIZE)
+    new = basis[:5 * BLOCK_SIZE + 300] + basis[7 * BLOCK_SIZE:]
+    out, encoder, _ = sync(basis, new)
+    assert out == new
+    assert encoder.literal_bytes < 2 * BLOCK_SIZE
+
+def test_file_shorter_than_a_block():
+    basis = data(100)
+    assert sync(basis, basis)[0] == basis
+    new = data(50, seed=2)
+    assert sync(basis, new)[0] == new
+    assert sync(data(5 * BLOCK_SIZE), new)[0] == new
+
+def test_empty_basis():
+    new = data(3 * BLOCK_SIZE + 5)
+    out, encoder, _ = sync(b"", new)
+    assert out == new
+    assert encoder.copied_bytes == 0
+    assert sync(b"", b"")[0] == b""
+
+def test_literal_only_steps_are_bounded():
+    # nothing to match against: the file still goes out a segment at a time
+    new = data(3 * SEGMENT + 12345)
+    out, encoder, largest = sync(b"", new)
+    assert out == new
+    assert largest <= SEGMENT + BLOCK_SIZE
+
+@pytest.mark.parametrize("op", [b"C", COPY.pack(OP_COPY, 0, 1)[:-1], COPY.pack(OP_COPY, 0, 1) + b"x"])
+def test_malformed_copy_op_is_rejected(op):
+    with pytest.raises(ValueError):
+        Patcher(data(4 * BLOCK_SIZE), BLOCK_SIZE, lambda offset, data: None).feed(op)
+
+def test_copy_outside_the_basis_is_rejected():
+    patcher = Patcher(data(4 * BLOCK_SIZE), BLOCK_SIZE, lambda offset, data: None)
+    with pytest.raises(ValueError):
+        patcher.feed(COPY.pack(OP_COPY, 4, 1))
+    with pytest.raises(ValueError):
+        patcher.feed(COPY.pack(OP_COPY, 0, 0))
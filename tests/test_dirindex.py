@@ -0,0 +1,144 @@
+import asyncio, os, random, shutil
+import pytest
+from app.dirindex import DirIndex, SortedNames
+
+def write(root, name, data=b"x"):
+    path = os.path.join(root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def bump_mtime(path):
+    """Make sure a change is visible even on coarse mtime clocks"""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+def refresh(index):
+    asyncio.run(index.refresh(force=True))
+
+@pytest.fixture
+def tree(tmp_path):
+    root = str(tmp_path)
+    for d in ("a", "b", "b/sub"):
+        for i in range(5):
+            write(root, f"{d}/f{i}")
+    write(root, "top")
+    write(root, ".hidden")
+    write(root, "a/.part")
+    return root
+
+def all_pages(index, prefix="", limit=3):
+    names, after = [], None
+    while True:
+        entries, after = index.page(prefix, after, limit)
+        names += [e.name for e in entries]
+        if after is None:
+            return names
+
+def test_sorted_names_blocks():
+    names = SortedNames()
+    SortedNames.BLOCK, old = 4, SortedNames.BLOCK
+    try:
+        words = [f"n{i:04d}" for i in range(200)]
+        random.Random(1).shuffle(words)
+        for w in words:
+            names.add(w)
+        assert max(map(len, names.blocks)) <= 8 and len(names.blocks) > 1
+        assert list(names.irange("")) == sorted(words)
+        for w in words[:150]:
+            names.remove(w)
+        rest = sorted(words[150:])
+        assert list(names.irange("")) == rest
+        assert names.maxes == [b[-1] for b in names.blocks]
+        assert list(names.irange(rest[10], inclusive=False)) == rest[11:]
+        assert list(names.irange("z")) == []
+    finally:
+        SortedNames.BLOCK = old
+
+def test_initial_scan_skips_dotfiles(tree):
+    index = DirIndex(tree)
+    refresh(index)
+    assert len(index.entries) == 16
+    assert "top" in index.entries and "b/sub/f4" in index.entries
+    assert not any(os.path.basename(n).startswith(".") for n in index.entries)
+
+def test_pagination_and_prefix(tree):
+    index = DirIndex(tree)
+    refresh(index)
+    assert all_pages(index) == sorted(index.entries)
+    assert all_pages(index, "b/") == [f"b/f{i}" for i in range(5)] + [f"b/sub/f{i}" for i in range(5)]
+    assert all_pages(index, "b/sub/", limit=5) == [f"b/sub/f{i}" for i in range(5)]
+    entries, after = index.page("a/", None, 5)
+    assert len(entries) == 5 and after is None  # exactly one page: no cursor
+    assert index.page("nothing/", None, 5) == ([], None)
+
+def test_changes_since_tokens(tree):
+    index = DirIndex(tree)
+    refresh(index)
+    token = index.token
+    assert index.changes_since(token) == ([], token, False, False)
+
+    index.update(write(tree, "new/one"))
+    os.remove(os.path.join(tree, "a/f0"))
+    bump_mtime(os.path.join(tree, "a"))
+    refresh(index)
+    changes, token2, more, reset = index.changes_since(token)
+    assert not more and not reset and token2 == index.token
+    assert dict((n, e is not None) for n, e in changes) == {"new/one": True, "a/f0": False}
+
+    # paged: the returned token resumes where the page stopped
+    first, mid, more, _ = index.changes_since(token, limit=1)
+    assert more and len(first) == 1
+    rest, _, more, _ = index.changes_since(mid, limit=1)
+    assert not more and {first[0][0], rest[0][0]} == {"new/one", "a/f0"}
+
+def test_unusable_tokens_reset(tree):
+    index = DirIndex(tree, max_changes=4)
+    refresh(index)
+    assert index.changes_since("other.1")[3]
+    assert index.changes_since(f"{index.epoch}.x")[3]
+    assert index.changes_since(f"{index.epoch}.{index.version + 1}")[3]
+    old = index.token
+    for i in range(10):
+        index.update(write(tree, f"c/{i}"))
+    assert index.changes_since(old)[3]  # older than the log
+    assert not index.changes_since(f"{index.epoch}.{index.version - 3}")[3]
+
+def test_in_place_edit_is_seen(tree):
+    index = DirIndex(tree)
+    refresh(index)
+    entries, _ = index.page("top", None, 1)
+    asyncio.run(index.fill_digests(entries))
+    token = index.token
+    path = write(tree, "top", b"y" * 1000)
+    bump_mtime(path)
+    entries = asyncio.run(index.revalidate(index.page("top", None, 1)[0]))
+    assert entries[0].size == 1000 and entries[0].digest is None
+    assert [n for n, _ in index.changes_since(token)[0]] == ["top"]
+
+def test_deleted_and_recreated_directory(tree):
+    index = DirIndex(tree)
+    refresh(index)
+    token = index.token
+    shutil.rmtree(os.path.join(tree, "b"))
+    bump_mtime(tree)
+    refresh(index)
+    assert not any(n.startswith("b/") for n in index.entries)
+    assert "b" not in index.dirs and "b/sub" not in index.dirs
+    removed = {n for n, e in index.changes_since(token)[0] if e is None}
+    assert len(removed) == 10
+
+    write(tree, "b/sub/again")
+    bump_mtime(tree)
+    refresh(index)
+    assert all_pages(index, "b/") == ["b/sub/again"]
+    assert index.subdirs["b"] == {"b/sub"}
+
+def test_update_ignores_paths_outside_or_hidden(tree):
+    index = DirIndex(tree)
+    refresh(index)
+    version = index.version
+    index.update(os.path.join(tree, "..", "elsewhere"))
+    index.update(write(tree, "a/.tmp.part"))
+    assert index.version == version
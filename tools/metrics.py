@@ -1,29 +1,300 @@
-import statistics
-import time
+"""Transfer and transport metrics in constant memory.
+
+Counters are plain integers and distributions go into log-bucketed
+histograms of fixed size, so recording is O(1) and memory does not grow
+with the amount of traffic. A Metrics object can have a parent: every
+record also lands in the parent, which is how each connection keeps its
+own numbers while the process-wide object sees the total.
+
+Everything is written from the event loop thread. Readers (snapshot(),
+the exporter thread) only copy, so they never block a transfer.
+
+    metrics = Metrics()
+    conn = GBNTransport(..., metrics=metrics)   # per-connection child
+    MetricsExporter(metrics, port=9100).start() # curl localhost:9100/metrics
+"""
+import json, math, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COUNTERS = (
+    "bytes_sent",           # application bytes sent or served
+    "raw_bytes",            # file bytes before compression
+    "wire_bytes",           # the same bytes as sent or received
+    "transfers",
+    "cache_hits",
+    "cache_misses",
+    "segments_sent",        # new data segments, retransmissions not included
+    "bytes_acked",
+    "retransmissions",
+    "bytes_retransmitted",
+    "dup_acks",
+    "acks_sent",
+    "fec_parity_sent",
+    "fec_recovered",        # segments rebuilt from parity instead of retransmitted
+    "timeouts",
+)
+
+# name -> (low, high): values are bucketed between these, outliers go to the end buckets
+HISTOGRAMS = {
+    "latency_ms": (0.1, 1e7),        # one whole transfer
+    "goodput_MBps": (1e-3, 1e5),     # one whole transfer, MB/s
+    "rtt_ms": (0.01, 1e6),
+    "rto_ms": (1.0, 1e6),
+    "cwnd_bytes": (1e3, 1e10),
+    "window_bytes": (1e3, 1e10),     # usable send window: min(cwnd, peer's receive window)
+    "queue_bytes": (1e3, 1e10),      # queued and in flight, not yet acked
+}
+
+class Histogram:
+    """Log-bucketed histogram with SUB buckets per doubling (each ~19% wide).
+
+    Bucket i > 0 holds values in (upper(i-1), upper(i)]; bucket 0 everything
+    up to low and the last bucket everything above high. Quantiles are the
+    upper bound of the bucket they fall in, clamped to the observed range.
+    """
+    SUB = 4
+
+    def __init__(self, low, high):
+        self.low = low
+        self.last = math.ceil(math.log2(high / low) * self.SUB) + 1
+        self.buckets = [0] * (self.last + 1)
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        if value <= self.low:
+            i = 0
+        else:
+            i = min(self.last, math.ceil(math.log2(value / self.low) * self.SUB))
+        self.buckets[i] += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def upper(self, i):
+        return math.inf if i >= self.last else self.low * 2 ** (i / self.SUB)
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def quantiles(self, qs, buckets=None):
+        buckets = list(self.buckets) if buckets is None else buckets
+        count = sum(buckets)
+        if not count:
+            return [0.0 for _ in qs]
+        out = []
+        for q in qs:
+            target, cum = q * count, 0
+            for i, n in enumerate(buckets):
+                cum += n
+                if n and cum >= target:
+                    break
+            out.append(min(max(self.upper(i), self.min), self.max))
+        return out
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def snapshot(self):
+        buckets = list(self.buckets)
+        count = sum(buckets)
+        p50, p90, p95, p99 = self.quantiles((0.5, 0.9, 0.95, 0.99), buckets)
+        return {"count": count, "sum": self.sum, "mean": self.sum / count if count else 0.0,
+                "min": self.min if count else 0.0, "max": self.max if count else 0.0,
+                "p50": p50, "p90": p90, "p95": p95, "p99": p99}
 
 class Metrics:
-    def __init__(self):
-        self.delays = []
-        self.bytes_sent = 0
-        self.retransmissions = 0
+    def __init__(self, parent=None, label=None):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {name: Histogram(*bounds) for name, bounds in HISTOGRAMS.items()}
+        self.parent = parent
+        self.label = label            # e.g. the peer of a connection
+        self.started = time.monotonic()
+        self.children = {}            # id -> child Metrics still attached
+        self.lock = threading.Lock()  # guards children against the exporter thread
+        if parent is not None:
+            with parent.lock:
+                parent.children[id(self)] = self
+
+    def detach(self):
+        """Stop listing this child under its parent; its records stay in the totals"""
+        if self.parent is not None:
+            with self.parent.lock:
+                self.parent.children.pop(id(self), None)
 
-    def record_delay(self, delay_ms):
-        self.delays.append(delay_ms)
+    def count(self, name, n=1):
+        m = self
+        while m is not None:
+            m.counters[name] += n
+            m = m.parent
+
+    def observe(self, name, value):
+        m = self
+        while m is not None:
+            m.histograms[name].observe(value)
+            m = m.parent
+
+    # ------------------------
+    # Application-level helpers
+    def record_delay(self, delay_ms, nbytes=None):
+        """One finished transfer; with its size, its goodput is recorded too"""
+        self.count("transfers")
+        self.observe("latency_ms", delay_ms)
+        if nbytes is not None and delay_ms > 0:
+            self.observe("goodput_MBps", nbytes / delay_ms / 1000)
 
     def record_bytes(self, n):
-        self.bytes_sent += n
+        self.count("bytes_sent", n)
 
     def record_retransmission(self, n=1):
-        self.retransmissions += n
+        self.count("retransmissions", n)
+
+    def record_wire(self, raw, wire):
+        self.count("raw_bytes", raw)
+        self.count("wire_bytes", wire)
+
+    def record_cache(self, hit):
+        self.count("cache_hits" if hit else "cache_misses")
+
+    # ------------------------
+    def export_state(self):
+        """Raw counters and histogram buckets, picklable, e.g. to send to another process"""
+        return {"counters": dict(self.counters),
+                "histograms": {name: (list(h.buckets), h.sum, h.min, h.max)
+                               for name, h in self.histograms.items()}}
+
+    def load_state(self, *states):
+        """Replace this object's numbers by the sum of export_state() results"""
+        counters = dict.fromkeys(COUNTERS, 0)
+        histograms = {name: Histogram(*bounds) for name, bounds in HISTOGRAMS.items()}
+        for state in states:
+            for name, n in state["counters"].items():
+                if name in counters:
+                    counters[name] += n
+            for name, (buckets, total, low, high) in state["histograms"].items():
+                h = histograms.get(name)
+                if h is None or len(buckets) != len(h.buckets):
+                    continue
+                h.buckets = [a + b for a, b in zip(h.buckets, buckets)]
+                h.sum += total
+                h.min = min(h.min, low)
+                h.max = max(h.max, high)
+        # swapped in whole, so a reader never sees a half-merged state
+        self.counters = counters
+        self.histograms = histograms
+
+    def snapshot(self, connections=True):
+        """Counters and histogram summaries; with connections, the same for
+        every attached child under "connections"."""
+        elapsed = time.monotonic() - self.started
+        counters = dict(self.counters)
+        snap = {"uptime_s": elapsed,
+                "counters": counters,
+                "ack_rate_mbps": counters["bytes_acked"] / elapsed / 1e6 if elapsed else 0.0,
+                "histograms": {name: h.snapshot() for name, h in self.histograms.items()}}
+        if self.label is not None:
+            snap["label"] = self.label
+        if connections:
+            with self.lock:
+                children = list(self.children.values())
+            snap["connections"] = [c.snapshot(connections=False) for c in children]
+        return snap
 
     def report(self):
-        if not self.delays:
-            p95 = 0
-        else:
-            p95 = statistics.quantiles(self.delays, n=100)[94]
+        c = self.counters
+        latency = self.histograms["latency_ms"]
         return {
-            "total_bytes": self.bytes_sent,
-            "retransmissions": self.retransmissions,
-            "avg_latency_ms": statistics.mean(self.delays) if self.delays else 0,
-            "p95_latency_ms": p95
+            "total_bytes": c["bytes_sent"],
+            "retransmissions": c["retransmissions"],
+            "avg_latency_ms": latency.sum / latency.count if latency.count else 0,
+            "p95_latency_ms": latency.quantile(0.95),
+            "cache_hits": c["cache_hits"],
+            "cache_misses": c["cache_misses"],
+            "raw_bytes": c["raw_bytes"],
+            "wire_bytes": c["wire_bytes"],
+            "compression_ratio": c["raw_bytes"] / c["wire_bytes"] if c["wire_bytes"] else 1.0
         }
+
+# ------------------------
+def prometheus_text(metrics, prefix="miniftp"):
+    """Prometheus text exposition of a Metrics tree: global counters and
+    histograms, plus per-connection counters and quantiles labelled conn=..."""
+    with metrics.lock:
+        children = list(metrics.children.values())
+    lines = []
+    for name in COUNTERS:
+        metric = f"{prefix}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {metrics.counters[name]}")
+        for child in children:
+            lines.append(f'{metric}{{conn="{child.label}"}} {child.counters[name]}')
+    for name, h in metrics.histograms.items():
+        metric = f"{prefix}_{name}"
+        buckets = list(h.buckets)
+        lines.append(f"# TYPE {metric} histogram")
+        cum = 0
+        for i, n in enumerate(buckets):
+            cum += n
+            if i % Histogram.SUB == 0 and i < h.last:  # one bound per doubling is plenty
+                lines.append(f'{metric}_bucket{{le="{h.upper(i):.6g}"}} {cum}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {cum}')
+        lines.append(f"{metric}_sum {h.sum}")
+        lines.append(f"{metric}_count {cum}")
+    for name in HISTOGRAMS:
+        metric = f"{prefix}_conn_{name}"
+        lines.append(f"# TYPE {metric} summary")
+        for child in children:
+            h = child.histograms[name]
+            buckets = list(h.buckets)
+            for q, v in zip((0.5, 0.99), h.quantiles((0.5, 0.99), buckets)):
+                lines.append(f'{metric}{{conn="{child.label}",quantile="{q}"}} {v:.6g}')
+            lines.append(f'{metric}_count{{conn="{child.label}"}} {sum(buckets)}')
+    return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """Serves a Metrics tree over HTTP from a daemon thread:
+    /metrics in Prometheus text format, /snapshot as JSON."""
+    def __init__(self, metrics, port=9100, host="127.0.0.1"):
+        self.metrics = metrics
+        self.address = (host, port)
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, ctype = prometheus_text(metrics).encode(), "text/plain; version=0.0.4"
+                elif self.path == "/snapshot":
+                    body, ctype = json.dumps(metrics.snapshot(), default=str).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(self.address, Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-exporter",
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
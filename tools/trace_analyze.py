@@ -0,0 +1,229 @@
+"""Summaries and plots from transport trace dumps (see transport/trace.py).
+
+    python -m tools.trace_analyze dump.trace                 # per-connection summary
+    python -m tools.trace_analyze dump.trace --json          # the same as JSON
+    python -m tools.trace_analyze dump.trace --plot out.png  # needs matplotlib
+    python -m tools.trace_analyze dump.trace --stream 3 --events | less
+
+For every stream (one connection end) the summary has event counts, bytes
+sent and retransmitted, RTT percentiles, the cwnd range, drops by reason
+and the loss episodes: from a LOSS or TIMEOUT event until the cumulative
+ACK passes what was in flight when it began.
+
+The plot has one column per stream: a time/sequence diagram (sends,
+retransmissions, ACKs), RTT over time and cwnd over time, with the loss
+episodes shaded.
+"""
+import argparse, json, sys
+from collections import deque
+from transport import trace
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+class Stream:
+    """Everything recovered from one stream's records"""
+    def __init__(self, stream_id, label):
+        self.id = stream_id
+        self.label = label
+        self.counts = dict.fromkeys(trace.EVENT_NAMES.values(), 0)
+        self.sends = []          # (t, seq, length)
+        self.retx = []           # (t, seq, length)
+        self.acks = []           # (t, ack)
+        self.rtts = []           # (t, rtt seconds), Karn's rule applied
+        self.cwnd = []           # (t, cwnd)
+        self.drops = {}          # reason -> count
+        self.episodes = []       # [start, end or None, kind, retransmissions]
+        self.bytes_sent = 0
+        self.bytes_retx = 0
+        self.bytes_acked = 0
+        self.first = self.last = None
+        self.outstanding = deque()   # [seq, end, sent_at, retransmitted] awaiting ACK
+        self.highest_sent = 0
+        self.recover = None          # ACK that ends the open episode
+
+    def feed(self, t, event, seq, val, aux):
+        if self.first is None:
+            self.first = t
+        self.last = t
+        name = trace.EVENT_NAMES.get(event, str(event))
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if event == trace.SEND:
+            self.sends.append((t, seq, val))
+            self.cwnd.append((t, aux))
+            self.bytes_sent += val
+            self.outstanding.append([seq, seq + val, t, False])
+            self.highest_sent = max(self.highest_sent, seq + val)
+        elif event == trace.RETX:
+            self.retx.append((t, seq, val))
+            self.bytes_retx += val
+            for seg in self.outstanding:
+                if seg[0] == seq:
+                    seg[3] = True
+                    break
+            if self.episodes and self.episodes[-1][1] is None:
+                self.episodes[-1][3] += 1
+        elif event == trace.ACK:
+            self.acks.append((t, seq))
+            self.cwnd.append((t, val))
+            newest = None
+            while self.outstanding and self.outstanding[0][1] <= seq:
+                seg = self.outstanding.popleft()
+                self.bytes_acked += seg[1] - seg[0]
+                newest = seg
+            if newest and not newest[3] and self.recover is None:
+                self.rtts.append((t, t - newest[2]))
+            if self.recover is not None and seq >= self.recover:
+                self.episodes[-1][1] = t
+                self.recover = None
+        elif event in (trace.LOSS, trace.TIMEOUT):
+            if self.recover is None:
+                kind = "loss" if event == trace.LOSS else "timeout"
+                self.episodes.append([t, None, kind, 0])
+            elif event == trace.TIMEOUT:
+                self.episodes[-1][2] = "timeout"  # recovery fell back to the timer
+            self.recover = max(self.recover or 0, self.highest_sent)
+            if event == trace.TIMEOUT:
+                self.cwnd.append((t, aux))
+        elif event == trace.DROP:
+            reason = trace.DROP_NAMES.get(aux, str(aux))
+            self.drops[reason] = self.drops.get(reason, 0) + 1
+
+    def summary(self):
+        duration = (self.last - self.first) if self.first is not None else 0.0
+        rtts = [r * 1000 for _, r in self.rtts]
+        closed = [e for e in self.episodes if e[1] is not None]
+        cwnds = [c for _, c in self.cwnd]
+        return {
+            "stream": self.id,
+            "label": self.label,
+            "duration_s": duration,
+            "events": {k: v for k, v in self.counts.items() if v},
+            "bytes_sent": self.bytes_sent,
+            "bytes_retransmitted": self.bytes_retx,
+            "retransmit_ratio": self.bytes_retx / self.bytes_sent if self.bytes_sent else 0.0,
+            "goodput_MBps": self.bytes_acked / duration / 1e6 if duration else 0.0,
+            "rtt_ms": {"samples": len(rtts), "p50": percentile(rtts, 0.5),
+                       "p95": percentile(rtts, 0.95), "max": max(rtts, default=0.0)},
+            "cwnd": {"min": min(cwnds, default=0), "max": max(cwnds, default=0)},
+            "drops": self.drops,
+            "loss_episodes": {
+                "count": len(self.episodes),
+                "timeouts": sum(1 for e in self.episodes if e[2] == "timeout"),
+                "unfinished": len(self.episodes) - len(closed),
+                "mean_ms": sum(e[1] - e[0] for e in closed) / len(closed) * 1000 if closed else 0.0,
+                "longest_ms": max((e[1] - e[0] for e in closed), default=0.0) * 1000,
+            },
+        }
+
+def analyze(records, labels):
+    streams = {}
+    for t, event, stream_id, seq, val, aux in records:
+        stream = streams.get(stream_id)
+        if stream is None:
+            stream = streams[stream_id] = Stream(stream_id, labels.get(stream_id, f"stream {stream_id}"))
+        stream.feed(t, event, seq, val, aux)
+    return streams
+
+def print_summary(summary):
+    print(f"== stream {summary['stream']}: {summary['label']} "
+          f"({summary['duration_s']:.3f}s)")
+    print("   events:", ", ".join(f"{k}={v}" for k, v in summary["events"].items()))
+    print(f"   sent {summary['bytes_sent']} bytes, retransmitted {summary['bytes_retransmitted']} "
+          f"({summary['retransmit_ratio']:.1%}), goodput {summary['goodput_MBps']:.2f} MB/s")
+    rtt = summary["rtt_ms"]
+    if rtt["samples"]:
+        print(f"   rtt p50 {rtt['p50']:.2f}ms p95 {rtt['p95']:.2f}ms max {rtt['max']:.2f}ms "
+              f"({rtt['samples']} samples), cwnd {summary['cwnd']['min']}..{summary['cwnd']['max']}")
+    ep = summary["loss_episodes"]
+    if ep["count"]:
+        print(f"   loss episodes: {ep['count']} ({ep['timeouts']} with timeouts, "
+              f"{ep['unfinished']} unfinished), mean {ep['mean_ms']:.1f}ms, "
+              f"longest {ep['longest_ms']:.1f}ms")
+    if summary["drops"]:
+        print("   drops:", ", ".join(f"{k}={v}" for k, v in summary["drops"].items()))
+
+def print_events(records, t0, stream_id=None):
+    for t, event, sid, seq, val, aux in records:
+        if stream_id is None or sid == stream_id:
+            name = trace.EVENT_NAMES.get(event, str(event))
+            print(f"{(t - t0) * 1000:12.3f}ms {sid:5} {name:8} seq={seq} val={val} aux={aux}")
+
+def plot(streams, t0, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping the plot", file=sys.stderr)
+        return False
+    streams = [s for s in streams if s.sends or s.acks]
+    if not streams:
+        print("nothing to plot", file=sys.stderr)
+        return False
+    fig, axes = plt.subplots(3, len(streams), figsize=(6 * len(streams), 9),
+                             sharex="col", squeeze=False)
+    for col, s in enumerate(streams):
+        seq_ax, rtt_ax, cwnd_ax = axes[:, col]
+        seq_ax.set_title(s.label, fontsize=9)
+        if s.sends:
+            seq_ax.plot([t - t0 for t, _, _ in s.sends], [q for _, q, _ in s.sends],
+                        ".", ms=2, label="send")
+        if s.retx:
+            seq_ax.plot([t - t0 for t, _, _ in s.retx], [q for _, q, _ in s.retx],
+                        "x", color="red", ms=4, label="retransmit")
+        if s.acks:
+            seq_ax.step([t - t0 for t, _ in s.acks], [a for _, a in s.acks],
+                        where="post", lw=1, color="green", label="ack")
+        seq_ax.set_ylabel("sequence")
+        seq_ax.legend(loc="upper left", fontsize=7)
+        rtt_ax.plot([t - t0 for t, _ in s.rtts], [r * 1000 for _, r in s.rtts], ".", ms=2)
+        rtt_ax.set_ylabel("rtt (ms)")
+        cwnd_ax.step([t - t0 for t, _ in s.cwnd], [c for _, c in s.cwnd], where="post", lw=1)
+        cwnd_ax.set_ylabel("cwnd (bytes)")
+        cwnd_ax.set_xlabel("time (s)")
+        for start, end, kind, _ in s.episodes:
+            end = end if end is not None else s.last
+            for ax in (seq_ax, rtt_ax, cwnd_ax):
+                ax.axvspan(start - t0, end - t0, color="red" if kind == "timeout" else "orange",
+                           alpha=0.15, lw=0)
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    print(f"Plot written to {path}")
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("dump")
+    parser.add_argument("--stream", type=int, help="only this stream id")
+    parser.add_argument("--json", action="store_true", help="print the summaries as JSON")
+    parser.add_argument("--plot", metavar="PNG", help="write sequence/RTT/cwnd plots here")
+    parser.add_argument("--events", action="store_true", help="list the raw events")
+    args = parser.parse_args(argv)
+
+    info, records = trace.load(args.dump)
+    if not records:
+        print("empty trace")
+        return 0
+    t0 = records[0][0]
+    if args.events:
+        print_events(records, t0, args.stream)
+        return 0
+    streams = analyze(records, info["labels"])
+    selected = [s for sid, s in sorted(streams.items()) if args.stream in (None, sid)]
+    summaries = [s.summary() for s in selected]
+    if args.json:
+        print(json.dumps({"records": len(records), "written": info["written"],
+                          "streams": summaries}, indent=2))
+    else:
+        lost = info["written"] - len(records)
+        print(f"{len(records)} records" + (f" ({lost} older ones overwritten)" if lost else ""))
+        for summary in summaries:
+            print_summary(summary)
+    if args.plot:
+        plot(selected, t0, args.plot)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
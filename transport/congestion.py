@@ -0,0 +1,97 @@
+"""Pluggable congestion-control engines. All windows are in bytes."""
+
+class CongestionControl:
+    name = None
+
+    def __init__(self, mss, max_window):
+        self.mss = mss
+        self.max_window = max_window
+        self.cwnd = min(max_window, 2 * mss)
+        self.ssthresh = max_window
+
+    def on_ack(self, acked_bytes, rtt=None):
+        """New data was cumulatively acknowledged; rtt is None under Karn's rule"""
+
+    def on_loss(self, in_flight):
+        """A segment was declared lost by SACK/duplicate ACKs (once per window)"""
+
+    def on_timeout(self, in_flight):
+        """The retransmission timer expired"""
+
+    def _grow(self, n):
+        self.cwnd = min(self.max_window, self.cwnd + n)
+
+class FixedWindow(CongestionControl):
+    """The original behaviour: a constant window of max_window bytes"""
+    name = "fixed"
+
+    def __init__(self, mss, max_window):
+        super().__init__(mss, max_window)
+        self.cwnd = max_window
+
+class Reno(CongestionControl):
+    """Slow start, then additive increase / multiplicative decrease"""
+    name = "reno"
+
+    def on_ack(self, acked_bytes, rtt=None):
+        # byte counting (RFC 3465), so an ACK covering two segments grows the
+        # window as much as two ACKs would
+        if self.cwnd < self.ssthresh:
+            self._grow(min(acked_bytes, 2 * self.mss))
+        else:
+            self._grow(max(1, self.mss * acked_bytes // self.cwnd))
+
+    def on_loss(self, in_flight):
+        self.ssthresh = max(in_flight // 2, 2 * self.mss)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, in_flight):
+        self.ssthresh = max(in_flight // 2, 2 * self.mss)
+        self.cwnd = self.mss
+
+class Vegas(Reno):
+    """Delay-based: keep between ALPHA and BETA segments queued in the path.
+
+    Once per RTT the expected rate (cwnd / base RTT) is compared with the
+    actual rate (cwnd / RTT); the difference estimates our own queueing.
+    Losses are handled like Reno.
+    """
+    name = "vegas"
+    ALPHA = 2
+    BETA = 4
+    GAMMA = 1
+
+    def __init__(self, mss, max_window):
+        super().__init__(mss, max_window)
+        self.base_rtt = None
+        self.min_rtt = None  # smallest sample seen this round
+        self.acked_this_round = 0
+
+    def on_ack(self, acked_bytes, rtt=None):
+        if rtt is not None:
+            self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.acked_this_round += acked_bytes
+        if self.acked_this_round < self.cwnd or self.min_rtt is None:
+            return
+        # one RTT worth of data acknowledged: adjust once
+        queued = self.cwnd * (self.min_rtt - self.base_rtt) / self.min_rtt / self.mss
+        if self.cwnd < self.ssthresh:
+            if queued > self.GAMMA:
+                self.ssthresh = self.cwnd  # leave slow start before a queue builds
+            else:
+                self._grow(self.cwnd)
+        elif queued < self.ALPHA:
+            self._grow(self.mss)
+        elif queued > self.BETA:
+            self.cwnd = max(2 * self.mss, self.cwnd - self.mss)
+        self.acked_this_round = 0
+        self.min_rtt = None
+
+CONGESTION_CONTROLS = {cls.name: cls for cls in (FixedWindow, Reno, Vegas)}
+
+def make_congestion_control(name, mss, max_window):
+    try:
+        return CONGESTION_CONTROLS[name](mss, max_window)
+    except KeyError:
+        raise ValueError(f"Unknown congestion control: {name}") from None
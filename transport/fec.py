@@ -0,0 +1,159 @@
+"""XOR forward error correction over groups of data segments.
+
+The sender XORs every group of consecutive data segments into one parity
+packet (FLAG_FEC), sent right after the group's last segment. Its payload is
+
+    count (B) | count segment lengths (H each) | XOR of the segments, zero-padded
+
+and its seq field is the group's first seq. A receiver holding the parity
+and all but one segment of a group rebuilds the missing one, so a single
+loss per group costs no retransmission and no timeout. More losses in a
+group fall back to the usual SACK/RTO recovery.
+
+The group size follows the loss rate the sender observes (holes under
+SACKed data), keeping the expected losses per group at LOSS_PER_GROUP so
+that most lossy groups lose a single segment: LOSS_PER_GROUP / loss
+segments, between MIN_GROUP and MAX_GROUP.
+
+XOR is done with NumPy on whole segments at a time.
+"""
+import struct
+from collections import deque
+import numpy as np
+
+FEC_COUNT = struct.Struct("!B")
+MIN_GROUP = 2
+MAX_GROUP = 32
+LOSS_WINDOW = 128     # acknowledged segments per loss-rate sample
+LOSS_GAIN = 0.25      # weight of a new sample in the moving average
+LOSS_PER_GROUP = 0.3
+
+def parity_payload(lengths, parity):
+    return (FEC_COUNT.pack(len(lengths)) + struct.pack(f"!{len(lengths)}H", *lengths)
+            + parity[:max(lengths)].tobytes())
+
+def parse_parity(payload):
+    """(segment lengths, parity bytes) from a parity payload"""
+    (count,) = FEC_COUNT.unpack_from(payload)
+    lengths = struct.unpack_from(f"!{count}H", payload, FEC_COUNT.size)
+    parity = payload[FEC_COUNT.size + 2 * count:]
+    if not count or len(parity) != max(lengths):
+        raise ValueError("bad parity packet")
+    return lengths, parity
+
+class FecEncoder:
+    """Sender side: folds segments into the open group as they are first sent"""
+    def __init__(self, mss, group_size=None):
+        self.adaptive = group_size is None
+        self.group_size = group_size or 8
+        self.acc = np.zeros(mss, dtype=np.uint8)
+        self.first = None           # seq of the open group's first segment
+        self.lengths = []
+        self.loss = 0.0             # moving average of the observed loss rate
+        self.acked = 0              # segments acknowledged in the current sample
+        self.holes = 0              # ...of which arrived only after later data
+
+    def add(self, seq, payload):
+        """Fold in a new segment; returns what close() does once the group is full"""
+        if self.first is None:
+            self.first = seq
+        n = len(payload)
+        acc = self.acc[:n]
+        np.bitwise_xor(acc, np.frombuffer(payload, dtype=np.uint8), out=acc)
+        self.lengths.append(n)
+        if len(self.lengths) >= self.group_size:
+            return self.close()
+        return None
+
+    def close(self):
+        """(first seq, end seq, parity payload) of the open group, which may
+        be short; None if it is empty"""
+        if self.first is None:
+            return None
+        first, end = self.first, self.first + sum(self.lengths)
+        payload = parity_payload(self.lengths, self.acc)
+        self.acc[:max(self.lengths)] = 0
+        self.first = None
+        self.lengths = []
+        return first, end, payload
+
+    def observe(self, acked, holes):
+        """Segments newly acknowledged, and how many of them were holes"""
+        self.acked += acked
+        self.holes += holes
+        if self.acked < LOSS_WINDOW:
+            return
+        self.loss += LOSS_GAIN * (self.holes / self.acked - self.loss)
+        self.acked = self.holes = 0
+        if self.adaptive:
+            size = int(LOSS_PER_GROUP / self.loss) if self.loss > 0 else MAX_GROUP
+            self.group_size = max(MIN_GROUP, min(MAX_GROUP, size))
+
+class FecDecoder:
+    """Receiver side: keeps received segments near the left edge of the window
+    and rebuilds a group's single missing segment from its parity.
+
+    have(seq) tells whether the transport already holds the segment at seq.
+    """
+    def __init__(self, have, horizon):
+        self.have = have
+        self.horizon = horizon     # bytes below the left edge still kept for decoding
+        self.segments = {}         # seq -> payload
+        self.order = deque()       # segments' seqs in arrival order, for pruning
+        self.groups = {}           # first seq -> (member seqs, lengths, parity)
+        self.waiting = {}          # missing seq -> first seq of its group
+
+    def segment_received(self, seq, payload, expected):
+        """Remember a segment; returns [(seq, data)] it made recoverable"""
+        if seq < expected - self.horizon or seq in self.segments:
+            return []
+        self.segments[seq] = payload
+        self.order.append(seq)
+        self.prune(expected)
+        first = self.waiting.pop(seq, None)
+        return self.try_group(first) if first is not None else []
+
+    def parity_received(self, first, payload, expected):
+        lengths, parity = parse_parity(payload)
+        if first < expected - self.horizon or first in self.groups:
+            return []
+        seqs = [first]
+        for n in lengths[:-1]:
+            seqs.append(seqs[-1] + n)
+        self.groups[first] = (seqs, lengths, parity)
+        return self.try_group(first)
+
+    def try_group(self, first):
+        group = self.groups.get(first)
+        if group is None:
+            return []  # already decoded, or pruned
+        seqs, lengths, parity = group
+        missing = [i for i, s in enumerate(seqs) if not self.have(s)]
+        if len(missing) > 1:
+            for i in missing:
+                self.waiting[seqs[i]] = first
+            return []
+        del self.groups[first]
+        if not missing:
+            return []
+        lost = missing[0]
+        acc = np.frombuffer(parity, dtype=np.uint8).copy()
+        for i, s in enumerate(seqs):
+            if i == lost:
+                continue
+            data = self.segments.get(s)
+            if data is None or len(data) != lengths[i]:
+                return []  # no longer kept (or resent differently), cannot rebuild
+            np.bitwise_xor(acc[:lengths[i]], np.frombuffer(data, dtype=np.uint8),
+                           out=acc[:lengths[i]])
+        self.waiting.pop(seqs[lost], None)
+        return [(seqs[lost], acc[:lengths[lost]].tobytes())]
+
+    def prune(self, expected):
+        cutoff = expected - self.horizon
+        order = self.order
+        while order and order[0] < cutoff:
+            del self.segments[order.popleft()]
+        if len(self.groups) > MAX_GROUP:
+            self.groups = {f: g for f, g in self.groups.items() if f >= cutoff}
+            self.waiting = {s: f for s, f in self.waiting.items() if f in self.groups}
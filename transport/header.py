@@ -1,25 +1,92 @@
 import struct, zlib
+from collections import namedtuple
 
 HEADER_FMT = "!BBHIIHHI"  # 20 bytes: ver, flags, conn_id, seq, ack, win, len, checksum
 
+_HEADER = struct.Struct(HEADER_FMT)
+_CHECKSUM = struct.Struct("!I")
+HEADER_LEN = _HEADER.size
+CHECKSUM_OFFSET = HEADER_LEN - _CHECKSUM.size
+_ZERO_CHECKSUM = bytes(_CHECKSUM.size)
+
+Header = namedtuple("Header", "ver flags conn_id seq ack win length checksum")
+
+# flags
+FLAG_SYN = 0x01        # connection setup
+FLAG_ACK = 0x02
+FLAG_SACK = 0x04       # ACK payload carries SACK blocks
+FLAG_SACK_PERM = 0x08  # sender understands SACK blocks
+FLAG_FIN = 0x10        # connection teardown
+FLAG_RST = 0x20        # unknown or refused connection
+FLAG_FEC = 0x40        # parity over a group of data segments, see transport/fec.py
+
+# seq/ack are byte offsets that grow without bound; the header carries their
+# low 32 bits and the receiver restores the rest from its own position
+SEQ_MASK = 0xffffffff
+
+WIN_SHIFT = 6  # `win` counts 64-byte units, so up to ~4 MB can be advertised
+
+SACK_BLOCK_FMT = "!II"  # [start, end) byte range held by the receiver
+MAX_SACK_BLOCKS = 4
+
 def pack_header(ver, flags, conn_id, seq, ack, win, length, checksum=0):
-    return struct.pack(HEADER_FMT, ver, flags, conn_id, seq, ack, win, length, checksum)
+    return _HEADER.pack(ver, flags, conn_id, seq, ack, win, length, checksum)
 
 def compute_checksum(header_zeroed: bytes, payload: bytes) -> int:
-    return zlib.crc32(header_zeroed + payload) & 0xffffffff
+    return zlib.crc32(payload, zlib.crc32(header_zeroed)) & 0xffffffff
+
+# -----------------
+# Buffer API: one allocation and one payload copy per packet built,
+# no copies when parsing. Packets are not built into reused buffers: data
+# segments are kept for retransmission and the endpoint may queue any
+# packet until the socket is writable.
+
+def build_packet(ver, flags, conn_id, seq, ack, win, payload=b''):
+    """Build a packet as a new bytearray: header, then payload appended in place"""
+    buf = bytearray(_HEADER.pack(ver, flags, conn_id, seq & SEQ_MASK, ack & SEQ_MASK, win, len(payload), 0))
+    buf += payload
+    _CHECKSUM.pack_into(buf, CHECKSUM_OFFSET, zlib.crc32(buf))
+    return buf
 
+def parse_packet(data):
+    """Verify and parse a datagram; returns (Header, payload memoryview).
+
+    The payload view shares memory with data, nothing is copied. The CRC
+    is computed over the header with its checksum field read as zero.
+    """
+    if len(data) < HEADER_LEN:
+        raise ValueError("Short packet")
+    hdr = Header._make(_HEADER.unpack_from(data))
+    payload = memoryview(data)[HEADER_LEN:]
+    crc = zlib.crc32(data[:CHECKSUM_OFFSET] + _ZERO_CHECKSUM)  # copies the header only
+    if zlib.crc32(payload, crc) != hdr.checksum:
+        raise ValueError("Checksum mismatch")
+    return hdr, payload
+
+def unwrap_seq(wire, ref):
+    """The full seq nearest to ref whose low 32 bits are wire (serial number
+    arithmetic, RFC 1982): right as long as the two are within 2 GiB"""
+    return ref + ((wire - ref + 0x80000000) & SEQ_MASK) - 0x80000000
+
+# -----------------
 def make_packet(ver, flags, conn_id, seq, ack, win, payload: bytes):
-    length = len(payload)
-    h0 = pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
-    chk = compute_checksum(h0, payload)
-    return pack_header(ver, flags, conn_id, seq, ack, win, length, chk) + payload
+    return bytes(build_packet(ver, flags, conn_id, seq, ack, win, payload))
 
 def unpack_packet(packet: bytes):
-    header = packet[:20]
-    payload = packet[20:]
-    ver, flags, conn_id, seq, ack, win, length, chk = struct.unpack(HEADER_FMT, header)
-    h0 = pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
-    if compute_checksum(h0, payload) != chk:
-        raise ValueError("Checksum mismatch")
-    return dict(ver=ver, flags=flags, conn_id=conn_id, seq=seq, ack=ack,
-                win=win, length=length, checksum=chk), payload
+    hdr, payload = parse_packet(packet)
+    return hdr._asdict(), payload.tobytes()
+
+def pack_sack(blocks):
+    """Encode up to MAX_SACK_BLOCKS (start, end) ranges as an ACK payload"""
+    return b"".join(struct.pack(SACK_BLOCK_FMT, s & SEQ_MASK, e & SEQ_MASK)
+                    for s, e in blocks[:MAX_SACK_BLOCKS])
+
+def unpack_sack(payload: bytes, ref=None):
+    """Decode an ACK payload into a list of (start, end) ranges, unwrapped
+    around ref (see unwrap_seq) if given"""
+    size = struct.calcsize(SACK_BLOCK_FMT)
+    blocks = [struct.unpack_from(SACK_BLOCK_FMT, payload, off)
+              for off in range(0, len(payload) - size + 1, size)]
+    if ref is None:
+        return blocks
+    return [(unwrap_seq(s, ref), unwrap_seq(e, ref)) for s, e in blocks]
@@ -0,0 +1,116 @@
+import asyncio, time
+from .header import (build_packet, parse_packet, FLAG_SYN, FLAG_ACK, FLAG_FIN, FLAG_RST)
+from .transport import GBNTransport
+from . import trace
+
+class Listener(asyncio.DatagramProtocol):
+    """Owns a UDP endpoint and gives every (peer address, conn_id) its own GBNTransport.
+
+    Connections start with a SYN and end with FIN, RST or idle eviction.
+    Datagrams are parsed once here and handed to the connection, so the
+    per-packet cost does not depend on how many other clients are connected.
+    """
+    def __init__(self, local_port, on_connection=None, on_disconnect=None,
+                 max_connections=1024, idle_timeout=60.0, **transport_opts):
+        self.local_port = local_port
+        self.on_connection = on_connection    # called with each new GBNTransport
+        self.on_disconnect = on_disconnect    # called once it is gone
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.transport_opts = transport_opts
+        self.tracer = transport_opts.get("tracer") or trace.DEFAULT
+        self.connections = {}                 # (addr, conn_id) -> GBNTransport
+        self.accepting = True                 # False while draining for a shutdown
+        self.transport = None
+        self.loop = None
+        self.sweeper = None
+
+    # -----------------
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+        self.schedule_sweep()
+        print(f"[Listener] Listening on port {self.local_port}")
+
+    def connection_lost(self, exc):
+        self.close()
+
+    def datagram_received(self, data, addr):
+        try:
+            hdr, payload = parse_packet(data)
+        except Exception:
+            if self.tracer:
+                self.tracer.record(trace.DROP, 0, 0, len(data), trace.DROP_BAD)
+            return
+        key = (addr, hdr.conn_id)
+        conn = self.connections.get(key)
+        if conn is None:
+            conn = self.accept(hdr, addr)
+            if conn is None:
+                return
+        conn.packet_received(hdr, payload, addr)
+
+    def accept(self, hdr, addr):
+        flags = hdr.flags
+        if not flags & FLAG_SYN or flags & FLAG_ACK:
+            if flags & FLAG_FIN and not flags & FLAG_ACK:
+                # our FIN|ACK got lost and the connection is already gone
+                self.reply(FLAG_FIN | FLAG_ACK, hdr.conn_id, addr)
+            elif not flags & FLAG_RST:
+                self.reply(FLAG_RST, hdr.conn_id, addr)
+            return None
+        if not self.accepting:
+            self.reply(FLAG_RST, hdr.conn_id, addr)
+            return None
+        if len(self.connections) >= self.max_connections:
+            print(f"[Listener] Refusing {addr}: connection limit reached")
+            self.reply(FLAG_RST, hdr.conn_id, addr)
+            return None
+
+        key = (addr, hdr.conn_id)
+        conn = GBNTransport(self.local_port, remote_addr=addr, conn_id=hdr.conn_id,
+                            **self.transport_opts)
+        conn.transport = self.transport
+        conn.loop = self.loop
+        conn.on_close_cb = lambda: self.remove(key)
+        self.connections[key] = conn
+        if self.on_connection:
+            self.on_connection(conn)
+        return conn
+
+    def reply(self, flags, conn_id, addr):
+        self.transport.sendto(build_packet(1, flags, conn_id, 0, 0, 0, b''), addr)
+
+    def remove(self, key):
+        conn = self.connections.pop(key, None)
+        if conn and self.on_disconnect:
+            self.on_disconnect(conn)
+
+    # -----------------
+    def schedule_sweep(self):
+        self.sweeper = self.loop.call_later(max(0.1, self.idle_timeout / 4), self.sweep)
+
+    def sweep(self):
+        """Evict connections that have been silent for idle_timeout"""
+        deadline = time.monotonic() - self.idle_timeout
+        for key, conn in list(self.connections.items()):
+            if conn.last_activity < deadline:
+                print(f"[Listener] Evicting idle connection {key}")
+                conn.send_control(FLAG_RST)
+                conn.shutdown(TimeoutError("idle connection evicted"))
+        self.schedule_sweep()
+
+    async def drain(self, timeout):
+        """Refuse new connections and wait up to timeout seconds for the open ones to end"""
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        while self.connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not self.connections
+
+    def close(self):
+        if self.sweeper:
+            self.sweeper.cancel()
+            self.sweeper = None
+        for conn in list(self.connections.values()):
+            conn.shutdown()
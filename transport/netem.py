@@ -0,0 +1,212 @@
+"""Network emulator driven by the event loop.
+
+NetEm impairs one direction of a link: loss (uniform, or Gilbert-Elliott
+bursts), a bandwidth-limited drop-tail queue, base delay plus jitter,
+reordering and duplication. Delayed packets sit in one heap served by a
+single loop timer, so the cost per packet is a few RNG draws and a heap
+push. With no delay configured packets are delivered straight away.
+
+ImpairedLink sits between a datagram endpoint and the protocol using it
+and impairs both directions:
+
+    await create_endpoint(lambda: ImpairedLink(conn, profile, seed=1), sock=sock)
+
+The protocol sees the link as its transport, so nothing else changes.
+Profiles are the dicts of tests/profiles.json; see Impairment for the
+fields.
+"""
+import asyncio, heapq, random
+from collections import deque
+
+class Impairment:
+    """What to do to packets in one direction.
+
+    loss_rate       average share of packets lost
+    burst           lose packets in Gilbert-Elliott bursts instead of independently
+    burst_len       mean length of a loss burst, in packets sent back to back
+    burst_slot_ms   time one chain step stands for when the link is idle, so
+                    a quiet sender is not stuck in a burst for seconds
+    delay_ms        base one-way delay
+    jitter_ms       extra uniformly random delay in [0, jitter_ms]; packets
+                    still leave in order, as on a FIFO link
+    bandwidth_mbps  link rate; packets queue behind each other (None: unlimited)
+    queue_packets   drop-tail queue limit when the bandwidth is limited
+    reorder_rate    share of packets held back by reorder_ms so later ones overtake them
+    reorder_ms      hold-back for reordered packets
+    duplicate_rate  share of packets delivered twice
+    """
+    FIELDS = {"loss_rate": 0.0, "burst": False, "burst_len": 4.0, "burst_slot_ms": 1.0, "delay_ms": 0.0,
+              "jitter_ms": 0.0, "bandwidth_mbps": None, "queue_packets": 1000,
+              "reorder_rate": 0.0, "reorder_ms": 10.0, "duplicate_rate": 0.0}
+
+    def __init__(self, **fields):
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"unknown impairment fields: {sorted(unknown)}")
+        for name, default in self.FIELDS.items():
+            setattr(self, name, fields.get(name, default))
+
+    @classmethod
+    def from_profile(cls, profile):
+        """Impairment from a profile dict; keys that are not link settings
+        (e.g. "seed") are ignored"""
+        if isinstance(profile, Impairment):
+            return profile
+        return cls(**{k: v for k, v in (profile or {}).items() if k in cls.FIELDS})
+
+class NetEm:
+    def __init__(self, deliver, impairment=None, rng=None, loop=None):
+        self.deliver = deliver           # deliver(data, addr) at the far end
+        self.imp = impairment or Impairment()
+        self.rng = rng or random.Random()
+        self.loop = loop or asyncio.get_event_loop()
+        self.heap = []                   # (due, n, data, addr)
+        self.n = 0
+        self.timer = None
+        self.timer_at = None
+        self.bad = False                 # Gilbert-Elliott state
+        self.last_step = None            # loop time of the last chain step
+        self.link_free_at = 0.0          # when the link finishes its current backlog
+        self.last_due = 0.0              # departure of the last in-order packet
+        self.backlog = deque()           # transmit-finish times of queued packets
+        self.stats = {"packets": 0, "lost": 0, "queue_drops": 0,
+                      "reordered": 0, "duplicated": 0, "delivered": 0}
+
+    def lost(self, now):
+        imp = self.imp
+        if not imp.loss_rate:
+            return False
+        if not imp.burst:
+            return self.rng.random() < imp.loss_rate
+        # Two-state chain whose bad state loses everything; its steady-state
+        # share of bad time is loss_rate and bad runs last burst_len steps on
+        # average. Idle time counts as burst_slot_ms steps, using the k-step
+        # probability p_bad(k) = pi + (p_bad(0) - pi) * (1 - enter - leave)^k.
+        leave = 1.0 / max(imp.burst_len, 1.0)
+        enter = min(1.0, imp.loss_rate * leave / max(1e-9, 1.0 - imp.loss_rate))
+        steps = 1
+        if self.last_step is not None and imp.burst_slot_ms:
+            steps = max(1, int((now - self.last_step) * 1000 / imp.burst_slot_ms))
+        self.last_step = now
+        pi = enter / (enter + leave)
+        p_bad = pi + ((1.0 if self.bad else 0.0) - pi) * (1.0 - enter - leave) ** steps
+        self.bad = self.rng.random() < p_bad
+        return self.bad
+
+    def submit(self, data, addr):
+        imp = self.imp
+        self.stats["packets"] += 1
+        now = self.loop.time()
+        if self.lost(now):
+            self.stats["lost"] += 1
+            return
+        due = now
+        if imp.bandwidth_mbps:
+            backlog = self.backlog
+            while backlog and backlog[0] <= now:
+                backlog.popleft()
+            if len(backlog) >= imp.queue_packets:
+                self.stats["queue_drops"] += 1
+                return
+            self.link_free_at = max(self.link_free_at, now) + len(data) * 8 / (imp.bandwidth_mbps * 1e6)
+            backlog.append(self.link_free_at)
+            due = self.link_free_at
+        due += imp.delay_ms / 1000
+        if imp.jitter_ms:
+            due = max(due + self.rng.random() * imp.jitter_ms / 1000, self.last_due)
+        if imp.reorder_rate and self.rng.random() < imp.reorder_rate:
+            due += imp.reorder_ms / 1000
+            self.stats["reordered"] += 1
+        else:
+            self.last_due = due
+        copies = 1
+        if imp.duplicate_rate and self.rng.random() < imp.duplicate_rate:
+            copies = 2
+            self.stats["duplicated"] += 1
+        for _ in range(copies):
+            if due <= now and not self.heap:
+                self.stats["delivered"] += 1
+                self.deliver(data, addr)
+            else:
+                self.schedule(due, data, addr)
+
+    def schedule(self, due, data, addr):
+        self.n += 1
+        heapq.heappush(self.heap, (due, self.n, data, addr))
+        if self.timer_at is None or due < self.timer_at:
+            if self.timer:
+                self.timer.cancel()
+            self.timer_at = due
+            self.timer = self.loop.call_at(due, self.fire)
+
+    def fire(self):
+        self.timer = self.timer_at = None
+        heap = self.heap
+        now = self.loop.time() + 0.0005  # the loop may run timers a hair early
+        while heap and heap[0][0] <= now:
+            _, _, data, addr = heapq.heappop(heap)
+            self.stats["delivered"] += 1
+            self.deliver(data, addr)
+        if heap and self.timer is None:
+            self.timer_at = heap[0][0]
+            self.timer = self.loop.call_at(self.timer_at, self.fire)
+
+    def close(self):
+        if self.timer:
+            self.timer.cancel()
+        self.timer = self.timer_at = None
+        self.heap.clear()
+
+class ImpairedLink(asyncio.DatagramProtocol):
+    """Protocol-side wrapper of a datagram endpoint that impairs traffic
+    both ways; down defaults to the same settings as up. Each direction
+    draws from its own RNG, so a seed fixes which packets each one hits."""
+    def __init__(self, protocol, up=None, down=None, seed=None):
+        self.protocol = protocol
+        self.seed = seed
+        self.up_imp = Impairment.from_profile(up)
+        self.down_imp = Impairment.from_profile(down if down is not None else up)
+        self.transport = None
+        self.uplink = None
+        self.downlink = None
+
+    # endpoint -> protocol
+    def connection_made(self, transport):
+        loop = asyncio.get_running_loop()
+        self.transport = transport
+        seeds = (None, None) if self.seed is None else (self.seed, self.seed + 1)
+        self.uplink = NetEm(self.transmit, self.up_imp, random.Random(seeds[0]), loop)
+        self.downlink = NetEm(self.protocol.datagram_received, self.down_imp,
+                              random.Random(seeds[1]), loop)
+        self.protocol.connection_made(self)
+
+    def datagram_received(self, data, addr):
+        self.downlink.submit(data, addr)
+
+    def error_received(self, exc):
+        self.protocol.error_received(exc)
+
+    def connection_lost(self, exc):
+        self.uplink.close()
+        self.downlink.close()
+        self.protocol.connection_lost(exc)
+
+    # protocol -> endpoint
+    def sendto(self, data, addr=None):
+        self.uplink.submit(data, addr)
+
+    def transmit(self, data, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+    def close(self):
+        self.transport.close()
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def stats(self):
+        return {"up": dict(self.uplink.stats), "down": dict(self.downlink.stats)}
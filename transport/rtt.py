@@ -0,0 +1,34 @@
+"""Retransmission timeout estimation (RFC 6298)"""
+
+class RTOEstimator:
+    """Tracks SRTT/RTTVAR from RTT samples and derives the RTO.
+
+    Callers apply Karn's rule: only segments that were never retransmitted
+    produce samples, and the backed-off RTO is kept until one arrives.
+    """
+    ALPHA = 1/8
+    BETA = 1/4
+    K = 4
+
+    def __init__(self, initial_rto=0.5, min_rto=0.02, max_rto=60.0, granularity=0.001):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = self._clamp(self.srtt + max(self.granularity, self.K * self.rttvar))
+
+    def backoff(self):
+        self.rto = self._clamp(self.rto * 2)
+
+    def _clamp(self, rto):
+        return min(self.max_rto, max(self.min_rto, rto))
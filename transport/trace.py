@@ -0,0 +1,139 @@
+"""Per-packet event tracing into a preallocated ring buffer.
+
+Every record is a fixed 24-byte struct packed into one bytearray allocated
+up front; once full, the oldest records are overwritten. Transports hold
+a Tracer or None and test it before recording, so tracing costs one
+attribute check per event when it is off.
+
+    tracer = Tracer(capacity=1 << 20, dump_dir="/var/tmp/miniftp")
+    conn = GBNTransport(..., tracer=tracer)
+    ...
+    tracer.dump("stall.trace")        # on demand
+    tracer.dump_on_signal()           # kill -USR1 <pid> writes a dump
+                                      # connections dying with an error dump to dump_dir
+
+Setting MINIFTP_TRACE=<records> (and optionally MINIFTP_TRACE_DIR) enables
+a process-wide tracer that transports pick up by default.
+tools/trace_analyze.py reads the dumps.
+"""
+import json, os, signal, struct, time
+
+# event types; the meaning of (seq, val, aux) is given per event
+SEND = 1      # new data segment: seq, length, cwnd
+RECV = 2      # data segment received: seq, length, expected seq
+ACK = 3       # ACK received: ack, cwnd, peer's receive window
+RETX = 4      # retransmission: seq, length, times sent before
+TIMEOUT = 5   # retransmission timer fired: send_base, RTO in microseconds, cwnd
+LOSS = 6      # loss episode begins: send_base, bytes in flight, cwnd after the cut
+DROP = 7      # packet discarded: seq, length, reason (DROP_*)
+ERROR = 8     # connection failed: send_base, expected seq, 0
+RECOVER = 9   # segment rebuilt from FEC parity: seq, length, expected seq
+
+EVENT_NAMES = {SEND: "send", RECV: "recv", ACK: "ack", RETX: "retx",
+               TIMEOUT: "timeout", LOSS: "loss", DROP: "drop", ERROR: "error",
+               RECOVER: "recover"}
+
+DROP_BAD = 1        # failed to parse (checksum, truncation)
+DROP_OLD = 2        # below the expected seq, already delivered
+DROP_DUP = 3        # already buffered out of order
+DROP_WINDOW = 4     # beyond the receive window
+DROP_NAMES = {DROP_BAD: "bad", DROP_OLD: "old", DROP_DUP: "dup", DROP_WINDOW: "window"}
+
+RECORD = struct.Struct("<dBxHIII")   # time, event, stream, seq, val, aux
+MAGIC = b"MFTPTRC1"
+HEADER = struct.Struct("<8sIQQQd")   # magic, record size, capacity, written, records in file, clock offset
+MASK = 0xffffffff
+
+class Tracer:
+    def __init__(self, capacity=1 << 16, dump_dir=None, min_dump_interval=10.0):
+        self.capacity = capacity
+        self.buf = bytearray(capacity * RECORD.size)
+        self.written = 0                   # records ever written; the slot is written % capacity
+        self.dump_dir = dump_dir           # where dump_error() writes, None to disable
+        self.min_dump_interval = min_dump_interval
+        self.last_error_dump = None
+        self.labels = {0: "unattached"}    # stream id -> description, written with dumps
+        self.next_stream = 0
+        # records carry time.monotonic(); this turns them into wall-clock time
+        self.clock_offset = time.time() - time.monotonic()
+
+    def register(self, label):
+        """A stream id for one connection's records (ids are reused after 65535)"""
+        self.next_stream = self.next_stream % 0xffff + 1
+        self.labels[self.next_stream] = label
+        return self.next_stream
+
+    def record(self, event, stream, seq, val=0, aux=0):
+        RECORD.pack_into(self.buf, (self.written % self.capacity) * RECORD.size,
+                         time.monotonic(), event, stream, seq & MASK, val & MASK, aux & MASK)
+        self.written += 1
+
+    def records(self):
+        """The retained records, oldest first, as (time, event, stream, seq, val, aux)"""
+        count = min(self.written, self.capacity)
+        start = self.written - count
+        for n in range(start, self.written):
+            yield RECORD.unpack_from(self.buf, (n % self.capacity) * RECORD.size)
+
+    def dump(self, path):
+        """Write the retained records to path, oldest first, then the stream labels"""
+        count = min(self.written, self.capacity)
+        head = self.written % self.capacity if self.written > self.capacity else 0
+        view = memoryview(self.buf)
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, RECORD.size, self.capacity, self.written, count,
+                                self.clock_offset))
+            f.write(view[head * RECORD.size:count * RECORD.size])
+            if head:
+                f.write(view[:head * RECORD.size])
+            f.write(json.dumps(self.labels).encode())
+        return path
+
+    def dump_error(self, reason):
+        """Dump into dump_dir after a failure, at most once per min_dump_interval"""
+        now = time.monotonic()
+        if self.dump_dir is None or (self.last_error_dump is not None and
+                                     now - self.last_error_dump < self.min_dump_interval):
+            return None
+        self.last_error_dump = now
+        os.makedirs(self.dump_dir, exist_ok=True)
+        name = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}-{reason}.trace"
+        return self.dump(os.path.join(self.dump_dir, name))
+
+    def dump_on_signal(self, signum=getattr(signal, "SIGUSR1", None), directory=None):
+        """Write a dump whenever signum arrives (POSIX only)"""
+        if signum is None:
+            return False
+        directory = directory or self.dump_dir or "."
+
+        def handler(*_):
+            os.makedirs(directory, exist_ok=True)
+            name = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}.trace"
+            print("[Trace] Dumped to", self.dump(os.path.join(directory, name)))
+
+        signal.signal(signum, handler)
+        return True
+
+def load(path):
+    """(info dict, list of records) from a dump file; info["labels"] maps
+    stream ids to connection descriptions"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path}: not a trace dump")
+    magic, size, capacity, written, count, offset = HEADER.unpack_from(data)
+    end = HEADER.size + count * size
+    if magic != MAGIC or size != RECORD.size or len(data) < end:
+        raise ValueError(f"{path}: not a trace dump")
+    records = list(RECORD.iter_unpack(memoryview(data)[HEADER.size:end]))
+    labels = {int(k): v for k, v in json.loads(data[end:] or b"{}").items()}
+    return {"capacity": capacity, "written": written, "clock_offset": offset,
+            "labels": labels}, records
+
+def from_env():
+    capacity = os.environ.get("MINIFTP_TRACE")
+    if not capacity:
+        return None
+    return Tracer(int(capacity), dump_dir=os.environ.get("MINIFTP_TRACE_DIR"))
+
+DEFAULT = from_env()
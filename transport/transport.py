@@ -1,69 +1,382 @@
-import asyncio, time, threading
-from .header import make_packet, unpack_packet
+import asyncio, bisect, struct, time, random
+from collections import deque
+from .header import (build_packet, parse_packet, pack_sack, unpack_sack, unwrap_seq,
+                     FLAG_SYN, FLAG_ACK, FLAG_SACK, FLAG_SACK_PERM, FLAG_FIN, FLAG_RST, FLAG_FEC,
+                     WIN_SHIFT, MAX_SACK_BLOCKS)
+from .rtt import RTOEstimator
+from .congestion import make_congestion_control
+from .fec import FecEncoder, FecDecoder, MAX_GROUP
+from . import trace
+from tools.metrics import Metrics
 
 MSS = 1200
+DUP_THRESH = 3  # SACKed segments above a hole before it is considered lost
+ACK_EVERY = 2       # in-order segments per ACK
+ACK_DELAY = 0.005   # longest an ACK is held back; well under the minimum RTO
+DEAD_AFTER = 30.0   # seconds retransmitting without hearing from the peer before giving up
+SAMPLE_EVERY = 8  # window and queue histograms are fed on every SAMPLE_EVERY'th ACK
+
+class Segment:
+    """Per-segment retransmit state kept by the sender"""
+    __slots__ = ("seq", "pkt", "length", "sent_at", "sacked", "retx", "fec_end")
+
+    def __init__(self, seq, pkt, length):
+        self.seq = seq
+        self.pkt = pkt
+        self.length = length
+        self.sent_at = time.monotonic()
+        self.sacked = False
+        self.retx = 0
+        self.fec_end = None  # end of its FEC group once the group's parity is sent
 
 class GBNTransport(asyncio.DatagramProtocol):
-    def __init__(self, local_port, remote_addr=None, window_size=5, loss_wrapper=None):
+    def __init__(self, local_port, remote_addr=None, window_size=256, loss_wrapper=None, sack=True,
+                 min_rto=0.02, cc="reno", recv_window=1024*1024, conn_id=None,
+                 send_buffer_limit=4*1024*1024, metrics=None, tracer=None,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, fec=False, fec_group=None,
+                 dead_after=DEAD_AFTER):
         self.local_port = local_port
         self.remote_addr = remote_addr
-        self.window_size = window_size
+        self.conn_id = conn_id if conn_id is not None else random.randint(1, 0xffff)
+        self.window_size = window_size  # upper bound on the send window, in segments
         self.loss_wrapper = loss_wrapper
 
         self.send_base = 0
         self.next_seq = 0
-        self.send_buffer = bytearray()
-        self.unacked = {}          # seq -> (packet, timestamp)
-        self.dup_ack_count = {}    # seq -> duplicate ACKs
-        self.timer = None
-        self.timer_interval = 0.5
+        self.pending = bytearray()   # queued data not yet sent; starts at next_seq
+        self.send_buffer_limit = send_buffer_limit
+        self.segments = deque()      # in-flight Segments in seq order, acked from the left
+        self.unacked = {}            # seq -> Segment, for SACK lookups
+        self.dup_acks = 0            # duplicate ACKs for send_base
+        self.sacked_segs = 0         # SACKed segments still in flight
+        self.scan_seq = 0            # loss scan position, segments below it were judged
+        self.sacked_below = 0        # SACKed segments below scan_seq
+        self.sack_scanned = {}       # SACK block start -> end already walked
+        self.timer = None          # asyncio.TimerHandle for the oldest unacked segment
+        self.rto = RTOEstimator(min_rto=min_rto)
+        self.cc = make_congestion_control(cc, MSS, window_size * MSS)
+        self.peer_rwnd = window_size * MSS  # until the peer advertises its window
+        self.recovery_point = None          # next_seq when the current loss episode began
+        self.highest_sack = 0               # right edge of the highest SACK block seen
+        # FEC: parity is sent when fec is on (group size fec_group, or adaptive);
+        # parity from the peer is decoded whenever it arrives
+        self.fec_tx = FecEncoder(MSS, fec_group) if fec else None
+        self.fec_rx = None
+        self.fec_flush = None
 
         self.expected_seq = 0
         self.recv_buffer = {}
+        self.recv_seqs = []             # recv_buffer's keys, sorted
+        self.recv_window = recv_window  # receive buffer capacity in bytes
+        self.recv_buffered = 0          # bytes held out of order in recv_buffer
+        self.app_buffered = 0           # delivered bytes the application still holds
+        self.ack_every = ack_every      # delayed ACKs: every ack_every'th segment...
+        self.ack_delay = ack_delay      # ...or ack_delay after the first one not yet ACKed
+        self.acks_owed = 0              # segments received since the last ACK
+        self.ack_timer = None
+        self.ack_to = None              # (addr, with SACK blocks) for the owed ACK
         self.loop = asyncio.get_event_loop()
         self.transport = None
         self.on_receive_cb = None
-        self.retransmissions = 0
-        self.sack_enabled = True  # SACK-lite
+        self.on_close_cb = None
+        self.last_activity = time.monotonic()  # last packet from the peer
+        self.dead_after = dead_after    # None: retransmit for as long as it takes
+        self.closed = False
+        self.handshake = None      # future resolved by SYN|ACK or FIN|ACK
+        self.flush_waiters = []    # futures resolved once everything sent is acked
+        self.drain_waiters = []    # futures resolved once buffered() drops under the limit
+        peer = f"{remote_addr[0]}:{remote_addr[1]}/{self.conn_id}" if remote_addr else str(self.conn_id)
+        self.metrics = Metrics(parent=metrics, label=peer)  # this connection's, feeding metrics
+        self.acks_seen = 0
+        self.tracer = tracer if tracer is not None else trace.DEFAULT  # None: tracing off
+        if self.tracer:
+            self.trace_id = self.tracer.register(("from " if conn_id is not None else "to ") + peer)
+        self.sack_enabled = sack   # exchange SACK blocks, enables selective repeat
+        self.peer_sack = False     # peer has sent us SACK blocks
+
+    @property
+    def retransmissions(self):
+        return self.metrics.counters["retransmissions"]
+
+    @property
+    def bytes_retransmitted(self):
+        return self.metrics.counters["bytes_retransmitted"]
+
+    @property
+    def selective(self):
+        """Selective repeat is used only when both ends speak SACK"""
+        return self.sack_enabled and self.peer_sack
 
     # -----------------
     def connection_made(self, transport):
         self.transport = transport
+        self.loop = asyncio.get_running_loop()
         print(f"[Transport] Listening on port {self.local_port}")
 
     def datagram_received(self, data, addr):
         try:
-            hdr, payload = unpack_packet(data)
-        except Exception as e:
-            print("Bad packet:", e)
+            hdr, payload = parse_packet(data)
+        except Exception:
+            if self.tracer:
+                self.tracer.record(trace.DROP, self.trace_id, 0, len(data), trace.DROP_BAD)
             return
+        self.packet_received(hdr, payload, addr)
 
-        # Handle ACK
-        if hdr['flags'] & 0x02:
-            self.handle_ack(hdr['ack'])
+    def packet_received(self, hdr, payload, addr):
+        self.last_activity = time.monotonic()
+        if hdr.flags & (FLAG_SYN | FLAG_FIN | FLAG_RST):
+            self.handle_control(hdr, addr)
             return
 
-        seq = hdr['seq']
-        # Drop duplicates
-        if seq < self.expected_seq:
-            ack_pkt = make_packet(1, 0x02, hdr['conn_id'], 0, self.expected_seq, 4096, b'')
-            self.send_raw(ack_pkt, addr)
+        if hdr.flags & FLAG_FEC:
+            self.parity_received(hdr, payload, addr)
             return
 
-        # Buffer out-of-order if SACK
-        if self.sack_enabled and seq != self.expected_seq:
-            self.recv_buffer[seq] = payload
-        else:
-            self.recv_buffer[seq] = payload
+        # Handle ACK
+        if hdr.flags & FLAG_ACK:
+            blocks = None
+            if hdr.flags & FLAG_SACK and self.sack_enabled:
+                self.peer_sack = True
+                blocks = unpack_sack(payload, self.send_base)
+            rwnd = hdr.win << WIN_SHIFT
+            # an ACK that only opens the window is not a duplicate; buffering
+            # out-of-order data shrinks it, so a smaller window still counts
+            window_update = rwnd > self.peer_rwnd
+            self.peer_rwnd = rwnd
+            ack = unwrap_seq(hdr.ack, self.send_base)
+            if self.tracer:
+                self.tracer.record(trace.ACK, self.trace_id, ack, self.cc.cwnd, self.peer_rwnd)
+            self.handle_ack(ack, blocks, window_update)
+            return
+
+        seq = unwrap_seq(hdr.seq, self.expected_seq)
+        if self.tracer:
+            self.trace_data(seq, len(payload))
+        immediate = self.accept_data(seq, payload)
+        if self.fec_rx:
+            recovered = self.fec_rx.segment_received(seq, payload, self.expected_seq)
+            if recovered:
+                immediate = self.accept_recovered(recovered)
+        self.owe_ack(hdr, addr, immediate)
+
+    def accept_data(self, seq, payload):
+        """Deliver or buffer one data segment; True if its ACK should not wait.
+
+        Only in-order data with no hole behind it may wait for a delayed ACK;
+        out-of-order segments, gap fills and duplicates are ACKed at once so
+        the sender's loss detection is not slowed down.
+        """
+        if seq == self.expected_seq:
+            immediate = bool(self.recv_buffer)
+            self.deliver(payload)
             while self.expected_seq in self.recv_buffer:
                 chunk = self.recv_buffer.pop(self.expected_seq)
-                if self.on_receive_cb:
-                    self.on_receive_cb(chunk)
-                self.expected_seq += len(chunk)
+                self.recv_seqs.pop(0)
+                self.recv_buffered -= len(chunk)
+                self.deliver(chunk)
+            return immediate
+        if seq > self.expected_seq and seq not in self.recv_buffer and \
+                seq + len(payload) - self.expected_seq <= self.recv_window:
+            # Buffer out-of-order, SACK blocks tell the sender what we hold
+            self.recv_buffer[seq] = payload
+            bisect.insort(self.recv_seqs, seq)
+            self.recv_buffered += len(payload)
+        return True
+
+    def owe_ack(self, hdr, addr, immediate):
+        self.ack_to = (addr, self.sack_enabled and bool(hdr.flags & FLAG_SACK_PERM))
+        self.acks_owed += 1
+        if immediate or self.acks_owed >= self.ack_every:
+            self.send_ack()
+        elif self.ack_timer is None:
+            self.ack_timer = self.loop.call_later(self.ack_delay, self.send_ack)
 
-        # Send cumulative ACK + optional SACK
-        ack_pkt = make_packet(1, 0x02, hdr['conn_id'], 0, self.expected_seq, 4096, b'')
+    def holds(self, seq):
+        """Whether the segment at seq has been received"""
+        return seq < self.expected_seq or seq in self.recv_buffer
+
+    def parity_received(self, hdr, payload, addr):
+        if self.fec_rx is None:
+            # keep a couple of full groups below the left edge for decoding
+            self.fec_rx = FecDecoder(self.holds, horizon=2 * MAX_GROUP * MSS)
+        first = unwrap_seq(hdr.seq, self.expected_seq)
+        try:
+            recovered = self.fec_rx.parity_received(first, payload, self.expected_seq)
+        except (ValueError, struct.error):
+            if self.tracer:
+                self.tracer.record(trace.DROP, self.trace_id, first, len(payload), trace.DROP_BAD)
+            return
+        if recovered:
+            self.owe_ack(hdr, addr, self.accept_recovered(recovered))
+
+    def accept_recovered(self, recovered):
+        """Take segments rebuilt from parity as if they had arrived; their ACK is immediate"""
+        for seq, data in recovered:
+            if self.tracer:
+                self.tracer.record(trace.RECOVER, self.trace_id, seq, len(data), self.expected_seq)
+            self.metrics.count("fec_recovered")
+            self.accept_data(seq, memoryview(data))
+        return True
+
+    def trace_data(self, seq, length):
+        self.tracer.record(trace.RECV, self.trace_id, seq, length, self.expected_seq)
+        if seq < self.expected_seq:
+            self.tracer.record(trace.DROP, self.trace_id, seq, length, trace.DROP_OLD)
+        elif seq in self.recv_buffer:
+            self.tracer.record(trace.DROP, self.trace_id, seq, length, trace.DROP_DUP)
+        elif seq + length - self.expected_seq > self.recv_window:
+            self.tracer.record(trace.DROP, self.trace_id, seq, length, trace.DROP_WINDOW)
+
+    def deliver(self, chunk):
+        """Hand in-order data to the application (a memoryview into the datagram).
+
+        The bytes count as received before the callback runs, and its errors
+        are reported, not raised: data the application choked on must still
+        be ACKed, or its retransmission would be delivered a second time.
+        """
+        self.expected_seq += len(chunk)
+        if self.on_receive_cb:
+            try:
+                self.on_receive_cb(chunk)
+            except Exception as e:
+                self.loop.call_exception_handler({
+                    "message": "on_receive_cb failed", "exception": e, "protocol": self})
+
+    def advertised_window(self):
+        """Free receive buffer space, in the header's scaled `win` units"""
+        free = max(0, self.recv_window - self.recv_buffered - self.app_buffered)
+        return min(0xffff, free >> WIN_SHIFT)
+
+    def hold(self, n):
+        """The application keeps n delivered bytes in flight (e.g. a queued disk
+        write); they count against the advertised window until release()"""
+        self.app_buffered += n
+
+    def release(self, n):
+        was_closed = self.advertised_window() << WIN_SHIFT < MSS
+        self.app_buffered -= n
+        if was_closed and not self.closed and self.advertised_window() << WIN_SHIFT >= MSS:
+            # window update, so the sender doesn't have to wait for its probe
+            self.send_raw(build_packet(1, FLAG_ACK, self.conn_id, 0, self.expected_seq,
+                                       self.advertised_window()))
+
+    def send_ack(self):
+        """Send the owed cumulative ACK, plus SACK blocks if the sender permits them"""
+        if self.ack_timer:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        self.acks_owed = 0
+        addr, sack = self.ack_to
+        if sack:
+            ack_pkt = build_packet(1, FLAG_ACK | FLAG_SACK, self.conn_id, 0, self.expected_seq,
+                                  self.advertised_window(), pack_sack(self.sack_blocks()))
+        else:
+            ack_pkt = build_packet(1, FLAG_ACK, self.conn_id, 0, self.expected_seq,
+                                  self.advertised_window(), b'')
         self.send_raw(ack_pkt, addr)
+        self.metrics.count("acks_sent")
+
+    def sack_blocks(self):
+        """The lowest MAX_SACK_BLOCKS contiguous [start, end) ranges held in recv_buffer"""
+        blocks = []
+        for seq in self.recv_seqs:
+            end = seq + len(self.recv_buffer[seq])
+            if blocks and blocks[-1][1] == seq:
+                blocks[-1][1] = end
+            elif len(blocks) == MAX_SACK_BLOCKS:
+                break
+            else:
+                blocks.append([seq, end])
+        return blocks
+
+    # -----------------
+    def handle_control(self, hdr, addr):
+        flags = hdr.flags
+        if flags & FLAG_RST:
+            self.shutdown(ConnectionResetError("connection reset by peer"))
+        elif flags & FLAG_ACK:
+            # SYN|ACK answers our connect(), FIN|ACK our close()
+            self.peer_rwnd = hdr.win << WIN_SHIFT
+            if self.handshake and not self.handshake.done():
+                self.handshake.set_result(None)
+        elif flags & FLAG_SYN:
+            # passive open, or a retransmitted SYN whose SYN|ACK was lost
+            self.remote_addr = addr
+            self.peer_rwnd = hdr.win << WIN_SHIFT
+            self.send_control(FLAG_SYN | FLAG_ACK, addr)
+        elif flags & FLAG_FIN:
+            self.send_control(FLAG_FIN | FLAG_ACK, addr)
+            self.shutdown()
+
+    def send_control(self, flags, addr=None):
+        self.send_raw(build_packet(1, flags, self.conn_id, self.next_seq, self.expected_seq,
+                                  self.advertised_window(), b''), addr)
+
+    async def exchange(self, flags, retries):
+        """Send a SYN/FIN until the peer ACKs it, backing off like a data segment"""
+        self.handshake = self.loop.create_future()
+        try:
+            for attempt in range(retries):
+                sent_at = time.monotonic()
+                self.send_control(flags)
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.handshake), self.rto.rto)
+                except asyncio.TimeoutError:
+                    self.rto.backoff()
+                    continue
+                if attempt == 0:
+                    self.rto.sample(time.monotonic() - sent_at)
+                return
+            raise ConnectionError("no answer from peer")
+        finally:
+            self.handshake = None
+
+    async def connect(self, retries=6):
+        """Active open: SYN -> SYN|ACK"""
+        await self.exchange(FLAG_SYN, retries)
+
+    async def flush(self):
+        """Wait until everything passed to send() has been acknowledged"""
+        if not self.pending and self.send_base == self.next_seq:
+            return
+        fut = self.loop.create_future()
+        self.flush_waiters.append(fut)
+        await fut
+
+    async def close(self, retries=4):
+        """Graceful close: drain the send queue, then FIN -> FIN|ACK"""
+        if self.closed:
+            return
+        await self.flush()
+        try:
+            await self.exchange(FLAG_FIN, retries)
+        except ConnectionError:
+            pass  # peer is gone, nothing left to tell it
+        self.shutdown()
+
+    def shutdown(self, exc=None):
+        """Drop all connection state; waiters see exc (or a plain close)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.stop_timer()
+        if self.ack_timer:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        if self.fec_flush:
+            self.fec_flush.cancel()
+            self.fec_flush = None
+        for fut in self.flush_waiters + self.drain_waiters + [self.handshake]:
+            if fut and not fut.done():
+                fut.set_exception(exc or ConnectionError("connection closed"))
+        self.flush_waiters = []
+        self.drain_waiters = []
+        self.metrics.detach()
+        if self.tracer and exc is not None:
+            self.tracer.record(trace.ERROR, self.trace_id, self.send_base, self.expected_seq)
+            self.tracer.dump_error(type(exc).__name__)
+        if self.on_close_cb:
+            self.on_close_cb()
 
     # -----------------
     def send_raw(self, packet, addr=None):
@@ -73,48 +386,223 @@ class GBNTransport(asyncio.DatagramProtocol):
             self.transport.sendto(packet, addr or self.remote_addr)
 
     def send(self, data: bytes):
-        self.send_buffer.extend(data)
+        if self.closed:
+            raise ConnectionError("connection closed")
+        self.pending.extend(data)
         self.try_send()
 
+    def buffered(self):
+        """Bytes queued or in flight, i.e. not yet acknowledged"""
+        return len(self.pending) + self.next_seq - self.send_base
+
+    async def drain(self):
+        """Wait until buffered() is back under send_buffer_limit"""
+        while self.buffered() > self.send_buffer_limit:
+            fut = self.loop.create_future()
+            self.drain_waiters.append(fut)
+            await fut
+
+    def send_window(self):
+        """Bytes allowed in flight: the smaller of cwnd and the peer's receive window"""
+        return min(self.cc.cwnd, self.peer_rwnd)
+
     def try_send(self):
-        while (self.next_seq - self.send_base)//MSS < self.window_size and \
-              self.next_seq - self.send_base < len(self.send_buffer):
-            offset = self.next_seq - self.send_base
-            payload = self.send_buffer[offset:offset+MSS]
-            pkt = make_packet(1, 0, 1, self.next_seq, 0, 4096, payload)
-            self.send_raw(pkt)
-            self.unacked[self.next_seq] = (pkt, time.time())
-            self.dup_ack_count[self.next_seq] = 0
-            if not self.timer:
-                self.start_timer()
-            self.next_seq += len(payload)
+        flags = FLAG_SACK_PERM if self.sack_enabled else 0
+        window = self.send_window()
+        win = self.advertised_window()
+        taken = 0
+        with memoryview(self.pending) as mv:
+            while taken < len(mv):
+                in_flight = self.next_seq - self.send_base
+                # with nothing in flight one segment always goes out, probing a closed window
+                if in_flight and in_flight + MSS > window:
+                    break
+                n = min(MSS, len(mv) - taken)
+                # the payload is copied once, straight into the packet buffer
+                pkt = build_packet(1, flags, self.conn_id, self.next_seq, 0, win, mv[taken:taken+n])
+                self.send_raw(pkt)
+                if self.tracer:
+                    self.tracer.record(trace.SEND, self.trace_id, self.next_seq, n, self.cc.cwnd)
+                seg = Segment(self.next_seq, pkt, n)
+                self.segments.append(seg)
+                self.unacked[seg.seq] = seg
+                if not self.timer:
+                    self.start_timer()
+                self.next_seq += n
+                if self.fec_tx:
+                    self.send_parity(self.fec_tx.add(seg.seq, mv[taken:taken+n]))
+                taken += n
+        del self.pending[:taken]  # bytearray trims its head in O(1)
+        if taken:
+            self.metrics.count("segments_sent", -(-taken // MSS))
+        if self.fec_tx and self.fec_tx.first is not None and not self.pending and not self.fec_flush:
+            # out of data: close the short group at the end of this loop pass
+            self.fec_flush = self.loop.call_soon(self.flush_parity)
+
+    def flush_parity(self):
+        self.fec_flush = None
+        if not self.closed:
+            self.send_parity(self.fec_tx.close())
+
+    def send_parity(self, group):
+        """Send a closed FEC group's parity and tag its segments with the group's end"""
+        if group is None:
+            return
+        first, end, payload = group
+        flags = FLAG_FEC | (FLAG_SACK_PERM if self.sack_enabled else 0)
+        self.send_raw(build_packet(1, flags, self.conn_id, first, 0, self.advertised_window(), payload))
+        self.metrics.count("fec_parity_sent")
+        for seg in reversed(self.segments):
+            if seg.seq < first:
+                break
+            seg.fec_end = end
+
+    def retransmit(self, seq):
+        seg = self.unacked[seq]
+        self.send_raw(seg.pkt)
+        if self.tracer:
+            self.tracer.record(trace.RETX, self.trace_id, seq, seg.length, seg.retx + 1)
+        seg.sent_at = time.monotonic()
+        seg.retx += 1
+        self.metrics.count("retransmissions")
+        self.metrics.count("bytes_retransmitted", seg.length)
 
     # -----------------
-    def handle_ack(self, ack_num):
-        remove_seqs = [seq for seq in self.unacked if seq < ack_num]
-        for seq in remove_seqs:
-            del self.unacked[seq]
-            del self.dup_ack_count[seq]
-        # Fast retransmit on 3 duplicate ACKs
-        for seq in self.unacked:
-            if self.dup_ack_count[seq] >= 3:
-                print(f"[Transport] Fast retransmit seq {seq}")
-                pkt, _ = self.unacked[seq]
-                self.send_raw(pkt)
-                self.retransmissions += 1
-                self.dup_ack_count[seq] = 0
+    def handle_ack(self, ack_num, sack_blocks=None, window_update=False):
+        if ack_num < self.send_base or ack_num > self.next_seq:
+            return  # stale, reordered ACK (or garbage)
+        advanced = ack_num > self.send_base
+        if advanced:
+            self.ack_segments(ack_num)
+        elif self.segments and not sack_blocks and not window_update:
+            # a duplicate ACK: nothing new acknowledged, same window, data in flight
+            self.dup_acks += 1
+            self.metrics.count("dup_acks")
+            if self.dup_acks == DUP_THRESH and not self.selective:
+                self.on_loss()
+                self.retransmit(self.send_base)
+        if sack_blocks:
+            self.apply_sack(sack_blocks)
+            self.detect_losses()
 
-        self.send_base = ack_num
+        # RFC 6298 5.2/5.3: stop once everything is acked, restart only when
+        # new data is acked; duplicate and SACK-only ACKs leave it running
         if self.send_base == self.next_seq:
             self.stop_timer()
-        else:
+        elif advanced or not self.timer:
             self.start_timer()
         self.try_send()
+        self.wake_waiters()
+
+    def ack_segments(self, ack_num):
+        """Release segments below ack_num from the head of the window, O(1) each"""
+        newest = None
+        popped = holes = 0
+        while self.segments and self.segments[0].seq + self.segments[0].length <= ack_num:
+            newest = self.segments.popleft()
+            del self.unacked[newest.seq]
+            popped += 1
+            if newest.sacked:
+                self.sacked_segs -= 1
+                if newest.seq < self.scan_seq:
+                    self.sacked_below -= 1
+            elif newest.retx or newest.seq < self.highest_sack:
+                holes += 1  # its first copy was lost, or overtaken by later data
+        if self.fec_tx:
+            self.fec_tx.observe(popped, holes)
+        # Karn's rule: never sample RTT from a retransmitted segment. ACKs that
+        # jump over a repaired hole are skipped too, they include the repair time.
+        rtt = None
+        if newest and not newest.retx and self.recovery_point is None:
+            rtt = time.monotonic() - newest.sent_at
+            self.sample_rtt(rtt)
+        self.cc.on_ack(ack_num - self.send_base, rtt)
+        self.metrics.count("bytes_acked", ack_num - self.send_base)
+        self.send_base = ack_num
+        self.scan_seq = max(self.scan_seq, ack_num)
+        self.dup_acks = 0
+        if self.recovery_point is not None and ack_num >= self.recovery_point:
+            self.recovery_point = None
+        self.acks_seen += 1
+        if self.acks_seen % SAMPLE_EVERY == 0:
+            metrics = self.metrics
+            metrics.observe("rto_ms", self.rto.rto * 1000)
+            metrics.observe("cwnd_bytes", self.cc.cwnd)
+            metrics.observe("window_bytes", self.send_window())
+            metrics.observe("queue_bytes", self.buffered())
+
+    def sample_rtt(self, rtt):
+        self.rto.sample(rtt)
+        self.metrics.observe("rtt_ms", rtt * 1000)
+
+    def apply_sack(self, blocks):
+        """Mark SACKed segments, walking each block only past the part seen before"""
+        newest = None
+        for start, end in blocks:
+            seq = max(start, self.send_base, self.sack_scanned.get(start, start))
+            while seq < end:
+                seg = self.unacked.get(seq)
+                if seg is None or seq + seg.length > end:
+                    break
+                if not seg.sacked:
+                    seg.sacked = True
+                    self.sacked_segs += 1
+                    if seq < self.scan_seq:
+                        self.sacked_below += 1
+                    if not seg.retx and (newest is None or seg.sent_at > newest.sent_at):
+                        newest = seg
+                seq += seg.length
+            self.sack_scanned[start] = seq
+            self.highest_sack = max(self.highest_sack, end)
+        if len(self.sack_scanned) > 4 * MAX_SACK_BLOCKS:
+            self.sack_scanned = {s: e for s, e in self.sack_scanned.items() if e > self.send_base}
+        if newest:
+            self.sample_rtt(time.monotonic() - newest.sent_at)
+
+    def detect_losses(self):
+        """Resend holes with enough SACKed segments above them.
+
+        scan_seq only moves forward, so each segment is judged once.
+        """
+        # early retransmit (RFC 5827): small flights cannot produce DUP_THRESH SACKs
+        thresh = min(DUP_THRESH, max(1, len(self.segments) - 1))
+        while self.scan_seq < self.next_seq:
+            seg = self.unacked[self.scan_seq]
+            if self.sacked_segs - self.sacked_below - seg.sacked < thresh:
+                break
+            if seg.sacked:
+                self.sacked_below += 1
+            elif not seg.retx:
+                if seg.fec_end is not None and self.highest_sack <= seg.fec_end:
+                    break  # nothing past its group's parity is SACKed yet, the parity may rebuild it
+                self.on_loss()
+                self.retransmit(seg.seq)
+            self.scan_seq += seg.length
+
+    def wake_waiters(self):
+        if self.flush_waiters and not self.pending and self.send_base == self.next_seq:
+            for fut in self.flush_waiters:
+                if not fut.done():
+                    fut.set_result(None)
+            self.flush_waiters = []
+        if self.drain_waiters and self.buffered() <= self.send_buffer_limit:
+            for fut in self.drain_waiters:
+                if not fut.done():
+                    fut.set_result(None)
+            self.drain_waiters = []
+
+    def on_loss(self):
+        """Tell congestion control about a loss, at most once per window of data"""
+        if self.recovery_point is None:
+            self.cc.on_loss(self.next_seq - self.send_base)
+            self.recovery_point = self.next_seq
+            if self.tracer:
+                self.tracer.record(trace.LOSS, self.trace_id, self.send_base,
+                                   self.next_seq - self.send_base, self.cc.cwnd)
 
     def start_timer(self):
         self.stop_timer()
-        self.timer = threading.Timer(self.timer_interval, self.timeout)
-        self.timer.start()
+        self.timer = self.loop.call_later(self.rto.rto, self.timeout)
 
     def stop_timer(self):
         if self.timer:
@@ -122,9 +610,29 @@ class GBNTransport(asyncio.DatagramProtocol):
             self.timer = None
 
     def timeout(self):
-        print("[Transport] Timeout! Retransmitting...")
-        for seq, (pkt, _) in self.unacked.items():
-            self.send_raw(pkt)
-            self.unacked[seq] = (pkt, time.time())
-            self.retransmissions += 1
+        self.timer = None
+        if not self.segments:
+            return
+        if self.dead_after is not None and time.monotonic() - self.last_activity >= self.dead_after:
+            # the peer has not answered anything for a long time: fail the
+            # waiters instead of retransmitting forever
+            self.shutdown(ConnectionError("peer not responding"))
+            return
+        rto = self.rto.rto
+        if self.tracer:
+            self.tracer.record(trace.TIMEOUT, self.trace_id, self.send_base, int(rto * 1e6), self.cc.cwnd)
+        self.rto.backoff()
+        self.metrics.count("timeouts")
+        self.metrics.observe("rto_ms", self.rto.rto * 1000)
+        self.cc.on_timeout(self.next_seq - self.send_base)
+        self.recovery_point = self.next_seq
+        if self.selective:
+            # Selective repeat: only resend segments the receiver does not hold
+            now = time.monotonic()
+            for seg in self.segments:
+                if not seg.sacked and now - seg.sent_at >= rto:
+                    self.retransmit(seg.seq)
+        else:
+            for seg in self.segments:
+                self.retransmit(seg.seq)
         self.start_timer()
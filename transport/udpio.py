@@ -0,0 +1,247 @@
+"""Batched datagram I/O for the event loop.
+
+asyncio's datagram transport does one sendto() per packet and one
+recvfrom() per readiness callback. UDPEndpoint instead
+
+- queues everything sent during a loop tick and flushes it in one go,
+  handing runs of equal-sized datagrams to the same peer to the kernel
+  as a single UDP GSO send (UDP_SEGMENT, Linux 4.18+) where supported,
+- drains up to RECV_BATCH datagrams per readiness callback,
+- applies SO_SNDBUF/SO_RCVBUF.
+
+reuseport_group() binds several sockets to one port for multi-process
+servers, steering each connection to one of them by conn_id.
+
+It speaks the subset of DatagramTransport our protocols use (sendto,
+close, get_extra_info). create_endpoint() falls back to the stock
+transport on loops without add_reader (the Windows proactor).
+"""
+import asyncio, ctypes, errno, socket, struct, sys
+
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)   # from linux/udp.h
+GSO_MAX_BYTES = 65000       # a GSO send is one UDP datagram before segmentation
+GSO_MAX_SEGMENTS = 64
+RECV_BATCH = 64
+RECV_SIZE = 2048            # larger than any packet we send (header + MSS)
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, "SO_ATTACH_REUSEPORT_CBPF", 51)
+CONN_ID_OFFSET = 2          # of the header's 16-bit conn_id, see transport/header.py
+
+def tune_socket(sock, sndbuf=None, rcvbuf=None):
+    """Set the socket buffer sizes; returns what the kernel granted"""
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    return (sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+
+def gso_supported(sock):
+    if not sys.platform.startswith("linux") or not hasattr(sock, "sendmsg"):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)  # probe: 0 means "per-send only"
+    except OSError:
+        return False
+    return True
+
+class UDPEndpoint(asyncio.DatagramTransport):
+    def __init__(self, loop, sock, protocol, gso=None):
+        super().__init__()
+        self.loop = loop
+        self.sock = sock
+        self.protocol = protocol
+        self.gso = gso_supported(sock) if gso is None else gso
+        self.queue = []            # (data, addr) waiting for the end of the tick
+        self.flush_handle = None
+        self.writing = False       # waiting for the socket to drain
+        self.closing = False
+        self.sends = 0             # send syscalls, for benchmarks
+        self.datagrams_sent = 0
+        sock.setblocking(False)
+        protocol.connection_made(self)
+        loop.add_reader(sock.fileno(), self.read_ready)
+
+    # -----------------
+    def get_extra_info(self, name, default=None):
+        if name == "socket":
+            return self.sock
+        if name == "sockname":
+            return self.sock.getsockname()
+        if name == "peername":
+            try:
+                return self.sock.getpeername()
+            except OSError:
+                return default
+        return default
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.flush()
+        self.loop.remove_reader(self.sock.fileno())
+        if self.writing:
+            self.loop.remove_writer(self.sock.fileno())
+        self.loop.call_soon(self.finish_close)
+
+    def abort(self):
+        self.queue.clear()
+        self.close()
+
+    def finish_close(self):
+        try:
+            self.protocol.connection_lost(None)
+        finally:
+            self.sock.close()
+
+    def get_write_buffer_size(self):
+        return sum(len(data) for data, _ in self.queue)
+
+    # -----------------
+    def sendto(self, data, addr=None):
+        if self.closing:
+            return
+        self.queue.append((data, addr))
+        if self.flush_handle is None and not self.writing:
+            self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        """Send what the tick queued; on a full socket buffer wait for it to drain"""
+        self.flush_handle = None
+        queue = self.queue
+        i = 0
+        try:
+            while i < len(queue):
+                i += self.send_run(queue, i)
+        except (BlockingIOError, InterruptedError):
+            if not self.writing and not self.closing:
+                self.writing = True
+                self.loop.add_writer(self.sock.fileno(), self.write_ready)
+        del queue[:i]
+
+    def write_ready(self):
+        self.writing = False
+        self.loop.remove_writer(self.sock.fileno())
+        self.flush()
+
+    def send_run(self, queue, i):
+        """Send queue[i] and, with GSO, the equal-sized datagrams to the same
+        peer after it; returns how many datagrams went out. A datagram that
+        fails for any reason other than a full buffer is reported and dropped."""
+        data, addr = queue[i]
+        count = 1
+        if self.gso:
+            size = len(data)
+            limit = min(GSO_MAX_SEGMENTS, GSO_MAX_BYTES // max(size, 1), len(queue) - i)
+            while count < limit:
+                nxt, nxt_addr = queue[i + count]
+                if nxt_addr != addr or len(nxt) > size:
+                    break
+                count += 1
+                if len(nxt) < size:
+                    break  # only the last segment may be short
+        try:
+            if count > 1:
+                bufs = [queue[j][0] for j in range(i, i + count)]
+                try:
+                    self.sock.sendmsg(bufs, [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))], 0, addr)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP):
+                        raise
+                    self.gso = False  # not usable on this path after all
+                    return 0
+            elif addr is None:
+                self.sock.send(data)
+            else:
+                self.sock.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            raise
+        except OSError as e:
+            self.protocol.error_received(e)
+        self.sends += 1
+        self.datagrams_sent += count
+        return count
+
+    # -----------------
+    def read_ready(self):
+        for _ in range(RECV_BATCH):
+            try:
+                data, addr = self.sock.recvfrom(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.protocol.error_received(e)
+                return
+            self.protocol.datagram_received(data, addr)
+            if self.closing:
+                return
+
+def conn_id_filter(count):
+    """Classic BPF program for SO_ATTACH_REUSEPORT_CBPF: socket conn_id % count.
+
+    The kernel runs it with the packet starting at the UDP payload; runt
+    datagrams make the load fail and land on socket 0.
+    """
+    code = (struct.pack("HBBI", 0x28, 0, 0, CONN_ID_OFFSET)  # ldh [CONN_ID_OFFSET]
+            + struct.pack("HBBI", 0x94, 0, 0, count)         # mod #count
+            + struct.pack("HBBI", 0x16, 0, 0, 0))            # ret a
+    buf = ctypes.create_string_buffer(code, len(code))
+    # struct sock_fprog; the kernel copies the program during setsockopt()
+    return struct.pack("HL", len(code) // 8, ctypes.addressof(buf)), buf
+
+def reuseport_group(local_addr, count, rcvbuf=None, sndbuf=None):
+    """count UDP sockets bound to local_addr with SO_REUSEPORT.
+
+    Returns (sockets, sharded). With sharded, a BPF program sends every
+    datagram to sockets[conn_id % count], so all connections sharing a
+    conn_id stay on one socket whatever their source port. Otherwise
+    (not Linux 4.5+) the kernel hashes the source address and port, which
+    still keeps each connection on one socket. Either mapping only holds
+    while all the sockets stay open, so keep them open across worker restarts.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise OSError("SO_REUSEPORT is not available on this platform")
+    socks = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            socks.append(sock)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            tune_socket(sock, sndbuf, rcvbuf)
+            # port 0: the rest join whatever port the first one got
+            sock.bind(socks[0].getsockname() if len(socks) > 1 else local_addr)
+    except OSError:
+        for sock in socks:
+            sock.close()
+        raise
+    sharded = False
+    if sys.platform.startswith("linux"):
+        prog, _buf = conn_id_filter(count)
+        try:
+            socks[0].setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, prog)
+            sharded = True
+        except OSError:
+            pass
+    return socks, sharded
+
+async def create_endpoint(protocol_factory, local_addr=None, sock=None, batched=True,
+                          gso=None, sndbuf=None, rcvbuf=None):
+    """Like loop.create_datagram_endpoint(), with batched I/O and buffer sizing"""
+    loop = asyncio.get_running_loop()
+    if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(local_addr or ("0.0.0.0", 0))
+    tune_socket(sock, sndbuf, rcvbuf)
+    if not batched or not hasattr(loop, "add_reader"):
+        return await loop.create_datagram_endpoint(protocol_factory, sock=sock)
+    try:
+        loop.add_reader(sock.fileno(), lambda: None)
+        loop.remove_reader(sock.fileno())
+    except NotImplementedError:  # proactor loop
+        return await loop.create_datagram_endpoint(protocol_factory, sock=sock)
+    protocol = protocol_factory()
+    return UDPEndpoint(loop, sock, protocol, gso), protocol